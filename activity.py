@@ -0,0 +1,128 @@
+"""
+Structured activity log.
+
+Routes and jobs call record_activity() for one task or department, record_task_activities()
+for many tasks, or record_status_changes() for the transitions of task_status.set_task_statuses(),
+before they commit a mutation, so each ActivityEvent is stored in the same
+transaction as the change it describes. Events keep plain task, department and actor ids, so
+the history of a deleted task stays readable. Feeds page newest first with an id cursor.
+"""
+import json
+from datetime import date, datetime
+from flask import has_request_context
+from sqlalchemy import inspect, insert
+from extensions import db
+from models import ActivityEvent, Task, User
+
+ACTIVITY_PAGE_SIZE = 50
+
+def _actor_id():
+    if not has_request_context():
+        return None
+    from flask_login import current_user
+    return current_user.id if current_user.is_authenticated else None
+
+def _jsonable(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def _dump(details):
+    return json.dumps({key: _jsonable(value) for key, value in details.items()}) if details else None
+
+def record_activity(action, task=None, department_id=None, details=None):
+    """Add one event for task (and its department, unless department_id is given); the caller commits.
+    New tasks must be flushed first so they have an id."""
+    event = ActivityEvent(
+        action=action,
+        task_id=task.id if task is not None else None,
+        department_id=department_id if department_id is not None else (task.department_id if task is not None else None),
+        actor_id=_actor_id(),
+        details=_dump(details),
+        created_at=datetime.utcnow(),
+    )
+    db.session.add(event)
+    return event
+
+def record_task_activities(action, task_ids, details=None, department_id=None, actor_id=None):
+    """Add one event per task with a single INSERT (before the tasks are deleted, for deletions).
+    Events go to each task's department unless department_id is given."""
+    task_ids = set(task_ids)
+    if not task_ids:
+        return 0
+    rows = db.session.query(Task.id, Task.department_id).filter(Task.id.in_(task_ids)).all()
+    if rows:
+        actor_id = actor_id if actor_id is not None else _actor_id()
+        created_at = datetime.utcnow()
+        payload = _dump(details)
+        db.session.execute(insert(ActivityEvent), [{
+            'action': action,
+            'task_id': task_id,
+            'department_id': department_id if department_id is not None else task_department_id,
+            'actor_id': actor_id,
+            'details': payload,
+            'created_at': created_at,
+        } for task_id, task_department_id in rows])
+    return len(rows)
+
+def record_status_changes(transitions, details=None, department_id=None):
+    """Add one status_changed event per (task_id, department_id, old_status, new_status) transition
+    with a single INSERT. Details hold {'status': [old, new]} like single-task status changes."""
+    if not transitions:
+        return 0
+    actor_id = _actor_id()
+    created_at = datetime.utcnow()
+    db.session.execute(insert(ActivityEvent), [{
+        'action': 'status_changed',
+        'task_id': task_id,
+        'department_id': department_id if department_id is not None else task_department_id,
+        'actor_id': actor_id,
+        'details': _dump({'status': [old_status, new_status], **(details or {})}),
+        'created_at': created_at,
+    } for task_id, task_department_id, old_status, new_status in transitions])
+    return len(transitions)
+
+def changed_fields(obj, fields):
+    """{field: [old, new]} for the fields changed on obj and not yet flushed"""
+    state = inspect(obj)
+    changes = {}
+    for field in fields:
+        history = state.attrs[field].history
+        if not history.added:
+            continue
+        old = _jsonable(history.deleted[0]) if history.deleted else None
+        new = _jsonable(history.added[0])
+        # Form values arrive as strings ('3' for department 3)
+        if str(old) != str(new):
+            changes[field] = [old, new]
+    return changes
+
+def serialize_activity(event, actor_names):
+    try:
+        details = json.loads(event.details) if event.details else {}
+    except (json.JSONDecodeError, TypeError):
+        details = {}
+    return {
+        'id': event.id,
+        'action': event.action,
+        'task_id': event.task_id,
+        'department_id': event.department_id,
+        'actor_id': event.actor_id,
+        'actor': actor_names.get(event.actor_id),
+        'details': details,
+        'at': event.created_at.isoformat() if event.created_at else None,
+    }
+
+def activity_feed(*criteria, before=None, limit=ACTIVITY_PAGE_SIZE):
+    """A page of events matching criteria, newest first: (events, next_before).
+    Criteria should match an (x, id) index such as task_id or department_id."""
+    query = ActivityEvent.query.filter(*criteria)
+    if before:
+        query = query.filter(ActivityEvent.id < before)
+    # One extra row tells whether another page exists
+    events = query.order_by(ActivityEvent.id.desc()).limit(limit + 1).all()
+    has_more = len(events) > limit
+    events = events[:limit]
+    actor_ids = {event.actor_id for event in events if event.actor_id}
+    actor_names = dict(db.session.query(User.id, User.full_name).filter(User.id.in_(actor_ids)).all()) if actor_ids else {}
+    return [serialize_activity(event, actor_names) for event in events], (events[-1].id if has_more else None)
@@ -50,9 +50,46 @@ def create_app(config_class=Config):
     if hasattr(config_class, 'SQLALCHEMY_ENGINE_OPTIONS') and config_class.SQLALCHEMY_ENGINE_OPTIONS:
         app.config['SQLALCHEMY_ENGINE_OPTIONS'] = config_class.SQLALCHEMY_ENGINE_OPTIONS
     
+    # Connection pools that time their checkouts for /admin/pool-health (see db_pool.py)
+    from db_pool import configure_pool_class, monitor_engine
+    configure_pool_class(app)
+    
     # Initialize extensions (Flask-SQLAlchemy 3.x reads SQLALCHEMY_ENGINE_OPTIONS from app.config)
     db.init_app(app)
     
+    # Optional read replicas for dashboards and analytics (see replicas.py)
+    from replicas import init_replicas
+    init_replicas(app)
+    
+    # Count pre-ping failures, and dispose the pools in forked workers (gunicorn --preload)
+    with app.app_context():
+        for engine in list(db.engines.values()) + list(app.extensions['replica_router'].engines.values()):
+            monitor_engine(engine)
+    
+    # Record task changes for incremental sync (see task_changes.py)
+    from task_changes import init_change_tracking
+    init_change_tracking()
+    
+    # In-app notification inbox rows for new assignments (see inbox.py)
+    from inbox import init_notification_inbox
+    init_notification_inbox()
+    
+    # Task status history for flow analytics (see task_status.py)
+    from task_status import init_status_history
+    init_status_history()
+    
+    # Broker for live dashboard updates (see events.py)
+    from events import init_event_broker
+    init_event_broker(app)
+    
+    # Per-user coalescing of assignment notifications (see notification_queue.py)
+    from notification_queue import init_notification_queue
+    init_notification_queue(app)
+    
+    # Push transport: Firebase, or the in-process fake for development and load tests
+    from notification_transport import init_notification_transport
+    init_notification_transport(app)
+    
     bcrypt.init_app(app)
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
@@ -70,6 +107,8 @@ def create_app(config_class=Config):
     from routes.team_member import team_member_bp
     from routes.tasks import tasks_bp
     from routes.notifications import notifications_bp
+    from routes.sync import sync_bp
+    from routes.activity import activity_bp
     
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(admin_bp, url_prefix='/admin')
@@ -77,6 +116,11 @@ def create_app(config_class=Config):
     app.register_blueprint(team_member_bp, url_prefix='/team-member')
     app.register_blueprint(tasks_bp, url_prefix='/tasks')
     app.register_blueprint(notifications_bp, url_prefix='/api/notifications')
+    app.register_blueprint(sync_bp, url_prefix='/api/tasks')
+    app.register_blueprint(activity_bp, url_prefix='/api/activity')
+    
+    from commands import register_commands
+    register_commands(app)
     
     # Add custom Jinja2 filters
     @app.template_filter('from_json')
@@ -123,6 +167,15 @@ def create_app(config_class=Config):
         from flask import jsonify
         return jsonify({'error': 'Internal server error'}), 500
     
+    # A version_id_col check failed: the row changed since this request read it
+    from sqlalchemy.orm.exc import StaleDataError
+    @app.errorhandler(StaleDataError)
+    def stale_data_error(error):
+        db.session.rollback()
+        app.logger.info(f'Concurrent update conflict on {request.method} {request.path}: {error}')
+        from utils import conflict_response
+        return conflict_response((request.view_args or {}).get('task_id'))
+    
     # Log unhandled exceptions
     @app.errorhandler(Exception)
     def handle_exception(e):
@@ -143,7 +196,7 @@ def create_app(config_class=Config):
     with app.app_context():
         try:
             # Import all models to ensure they're registered with SQLAlchemy
-            from models import User, Department, Task, TaskAssignment, Subtask, TaskDepartmentAssignment, DepartmentTaskCompletion, TaskApprovalRequest, FCMDevice
+            from models import User, Department, Task, TaskAssignment, Subtask, TaskDepartmentAssignment, DepartmentTaskCompletion, TaskApprovalRequest, TaskApprovalRequestDepartment, FCMDevice, TaskChange, RecurringTask, RecurringTaskAssignee, Notification
             db.create_all()
             
             # Create default admin if not exists (skip in test mode)
@@ -0,0 +1,108 @@
+"""
+Archive of old completed tasks.
+
+`flask archive-tasks` (jobs.archive_completed_tasks) moves COMPLETED tasks that nobody has
+touched for ARCHIVE_AFTER_DAYS into ArchivedTask, one batch per transaction. A batch copies
+the tasks with their assignments, subtasks, department assignments, completions, approval
+requests and status history, then deletes the live rows (children go with ON DELETE CASCADE),
+so a task is always in exactly one of the two tables. Dashboards, analytics and sync only read
+the live tables; admins search the archive on demand (/admin/archive).
+"""
+import json
+from datetime import date, datetime
+from sqlalchemy import exists, func, insert, or_
+from sqlalchemy.orm import defer
+from extensions import db
+from models import (Task, TaskAssignment, Subtask, TaskDepartmentAssignment, DepartmentTaskCompletion,
+                    TaskApprovalRequest, TaskApprovalRequestDepartment, TaskStatusEvent, Notification, ArchivedTask)
+
+ARCHIVE_PAGE_SIZE = 50
+
+# details key -> model of the task's child rows
+ARCHIVED_CHILDREN = {
+    'assignments': TaskAssignment,
+    'subtasks': Subtask,
+    'department_assignments': TaskDepartmentAssignment,
+    'completions': DepartmentTaskCompletion,
+    'approval_requests': TaskApprovalRequest,
+    'status_history': TaskStatusEvent,
+}
+
+TASK_COLUMNS = ('task_name', 'description', 'priority', 'status', 'department_id', 'created_by_id',
+                'client_name', 'deadline', 'remark', 'created_at', 'updated_at')
+
+def _row_dict(obj):
+    row = {}
+    for column in obj.__table__.columns:
+        value = getattr(obj, column.key)
+        row[column.key] = value.isoformat() if isinstance(value, (datetime, date)) else value
+    return row
+
+def archivable_task_ids(cutoff, limit):
+    """Ids of completed tasks not updated since cutoff and without a pending approval request"""
+    pending = exists().where(TaskApprovalRequest.task_id == Task.id, TaskApprovalRequest.status == 'PENDING')
+    return [row.id for row in db.session.query(Task.id).filter(
+        Task.status == 'COMPLETED', Task.updated_at < cutoff, ~pending
+    ).order_by(Task.id).limit(limit)]
+
+def archive_tasks(task_ids, now=None):
+    """Copy tasks and their child rows into ArchivedTask and delete them from the live tables.
+    Reads one query per child table; the caller commits. Returns the number of tasks archived."""
+    now = now or datetime.utcnow()
+    tasks = Task.query.filter(Task.id.in_(list(task_ids))).order_by(Task.id).all()
+    if not tasks:
+        return 0
+    task_ids = [task.id for task in tasks]
+
+    children = {task_id: {key: [] for key in ARCHIVED_CHILDREN} for task_id in task_ids}
+    for key, model in ARCHIVED_CHILDREN.items():
+        for obj in model.query.filter(model.task_id.in_(task_ids)).order_by(model.id):
+            children[obj.task_id][key].append(_row_dict(obj))
+    requested = {}
+    for row in db.session.query(TaskApprovalRequestDepartment.approval_request_id, TaskApprovalRequestDepartment.department_id).join(
+            TaskApprovalRequest, TaskApprovalRequest.id == TaskApprovalRequestDepartment.approval_request_id
+    ).filter(TaskApprovalRequest.task_id.in_(task_ids)):
+        requested.setdefault(row.approval_request_id, []).append(row.department_id)
+    completed_at = dict(db.session.query(TaskStatusEvent.task_id, func.max(TaskStatusEvent.changed_at)).filter(
+        TaskStatusEvent.task_id.in_(task_ids), TaskStatusEvent.to_status == 'COMPLETED'
+    ).group_by(TaskStatusEvent.task_id).all())
+
+    rows = []
+    for task in tasks:
+        details = children[task.id]
+        for approval in details['approval_requests']:
+            approval['requested_department_ids'] = sorted(requested.get(approval['id'], []))
+        row = {column: getattr(task, column) for column in TASK_COLUMNS}
+        row.update(task_id=task.id, completed_at=completed_at.get(task.id) or task.updated_at, archived_at=now, details=json.dumps(details))
+        rows.append(row)
+    db.session.execute(insert(ArchivedTask), rows)
+
+    from activity import record_task_activities
+    record_task_activities('task_archived', task_ids)
+    # Inbox entries stay; their data still carries the task id
+    Notification.query.filter(Notification.task_id.in_(task_ids)).update(
+        {Notification.task_id: None}, synchronize_session=False)
+    # Sync clients get task tombstones (see task_changes.py)
+    Task.query.filter(Task.id.in_(task_ids)).delete(synchronize_session=False)
+    return len(tasks)
+
+def search_archived_tasks(q='', department_id=None, completed_from=None, completed_to=None, before=None, limit=ARCHIVE_PAGE_SIZE):
+    """A page of archived tasks, newest first: (tasks, next_before). q matches the task or client name."""
+    query = ArchivedTask.query
+    if q:
+        pattern = f'%{q}%'
+        query = query.filter(or_(ArchivedTask.task_name.ilike(pattern), ArchivedTask.client_name.ilike(pattern)))
+    if department_id:
+        query = query.filter(ArchivedTask.department_id == department_id)
+    if completed_from:
+        query = query.filter(ArchivedTask.completed_at >= completed_from)
+    if completed_to:
+        query = query.filter(ArchivedTask.completed_at < completed_to)
+    if before:
+        query = query.filter(ArchivedTask.id < before)
+    # The JSON details are only needed on the detail page
+    tasks = query.options(defer(ArchivedTask.details)).order_by(ArchivedTask.id.desc()).limit(limit + 1).all()
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        return tasks, tasks[-1].id
+    return tasks, None
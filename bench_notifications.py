@@ -0,0 +1,124 @@
+"""
+Notification load test: runs assignment storms through the full notification path
+(TaskAssignment insert -> inbox row -> coalescing queue -> fcm_service -> transport)
+against the in-process fake FCM transport, with a throwaway in-memory database.
+
+Usage:
+    python bench_notifications.py --users 50 --tasks 20 --workers 8 --latency-ms 30 --error-rate 0.01
+    python bench_notifications.py --coalesce-seconds 1   # Compare with per-recipient coalescing
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def build_app(args):
+    from sqlalchemy.pool import StaticPool
+
+    class BenchConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+        # One shared in-memory database for all worker threads
+        SQLALCHEMY_ENGINE_OPTIONS = {'poolclass': StaticPool, 'connect_args': {'check_same_thread': False}}
+        NOTIFICATION_TRANSPORT = 'fake'
+        NOTIFICATION_COALESCE_SECONDS = args.coalesce_seconds
+        FAKE_FCM_LATENCY_MS = args.latency_ms
+        FAKE_FCM_ERROR_RATE = args.error_rate
+        FAKE_FCM_QUOTA_PER_SECOND = args.quota
+
+    from app import create_app
+    app = create_app(BenchConfig)
+    app.extensions['notification_transport'].jitter_ms = args.jitter_ms
+    # Per-message log lines would dominate the run time being measured
+    app.logger.disabled = not args.verbose
+    return app
+
+def seed(app, args):
+    """Department, assigner, recipients with one device each, and the tasks to assign"""
+    from extensions import db
+    from models import Department, User, Task, FCMDevice
+    with app.app_context():
+        db.create_all()
+        department = Department(name='Bench')
+        db.session.add(department)
+        db.session.flush()
+        assigner = User(email='head@bench', username='head', password_hash='x', full_name='Bench Head',
+                        role='department_head', department_id=department.id)
+        users = [User(email=f'user{i}@bench', username=f'user{i}', password_hash='x', full_name=f'User {i}',
+                      role='team_member', department_id=department.id) for i in range(args.users)]
+        db.session.add_all([assigner] + users)
+        db.session.flush()
+        db.session.add_all([FCMDevice(user_id=user.id, fcm_token=f'token-{user.id}') for user in users])
+        tasks = [Task(task_name=f'Storm task {i}', priority='URGENT' if i % 5 == 0 else 'IMPORTANT', status='ASSIGNED',
+                      department_id=department.id, created_by_id=assigner.id) for i in range(args.tasks)]
+        db.session.add_all(tasks)
+        db.session.commit()
+        return assigner.id, [user.id for user in users], [task.id for task in tasks]
+
+def storm(app, assigner_id, user_ids, task_ids, workers):
+    """Assign every task to every user, one request-like unit of work per user, on a thread pool"""
+    from extensions import db
+    from models import User, Task, TaskAssignment
+    from notification_queue import queue_task_assignment_notification
+    latencies = []
+    lock = threading.Lock()
+
+    def assign_all(user_id):
+        with app.app_context():
+            user = db.session.get(User, user_id)
+            assigner = db.session.get(User, assigner_id)
+            tasks = Task.query.filter(Task.id.in_(task_ids)).all()
+            db.session.add_all([TaskAssignment(task_id=task.id, user_id=user_id, assigned_by_id=assigner_id) for task in tasks])
+            db.session.commit()
+            for task in tasks:
+                started = time.perf_counter()
+                queue_task_assignment_notification(user, task, assigner)
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+            db.session.remove()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(assign_all, user_ids))
+    app.extensions['notification_queue'].flush_all()
+    return time.perf_counter() - started, latencies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--tasks', type=int, default=20, help='Tasks assigned to every user')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=30.0, help='Simulated FCM round trip')
+    parser.add_argument('--jitter-ms', type=float, default=10.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of sends failing with a token error')
+    parser.add_argument('--quota', type=int, default=0, help='Messages per second before QuotaExceeded (0 = unlimited)')
+    parser.add_argument('--coalesce-seconds', type=float, default=0.0)
+    parser.add_argument('--verbose', action='store_true', help='Keep the per-notification log lines')
+    args = parser.parse_args()
+
+    app = build_app(args)
+    assigner_id, user_ids, task_ids = seed(app, args)
+    elapsed, latencies = storm(app, assigner_id, user_ids, task_ids, args.workers)
+
+    transport = app.extensions['notification_transport']
+    calls = list(transport.call_seconds)
+    assignments = len(user_ids) * len(task_ids)
+    print(f'Assignments:        {assignments} ({len(user_ids)} users x {len(task_ids)} tasks, {args.workers} workers)')
+    print(f'Wall time:          {elapsed:.2f}s')
+    print(f'Transport calls:    {transport.calls} ({transport.calls / elapsed:.1f} sends/sec), '
+          f'delivered {len(transport.sent)}, failed {transport.failures}')
+    print(f'Notify latency:     p50 {percentile(latencies, 0.50) * 1000:.1f}ms  p95 {percentile(latencies, 0.95) * 1000:.1f}ms  '
+          f'p99 {percentile(latencies, 0.99) * 1000:.1f}ms  max {max(latencies, default=0) * 1000:.1f}ms')
+    print(f'Transport latency:  p50 {percentile(calls, 0.50) * 1000:.1f}ms  p95 {percentile(calls, 0.95) * 1000:.1f}ms  '
+          f'p99 {percentile(calls, 0.99) * 1000:.1f}ms  mean {statistics.fmean(calls) * 1000 if calls else 0:.1f}ms')
+
+if __name__ == '__main__':
+    main()
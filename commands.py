@@ -0,0 +1,294 @@
+"""
+Flask CLI commands for database maintenance.
+Run with: flask --app app <command>
+"""
+import json
+import click
+from sqlalchemy import inspect, select, text
+from sqlalchemy.schema import CreateColumn, CreateTable
+from extensions import db
+
+def register_commands(app):
+    """Register maintenance commands on the Flask CLI"""
+    app.cli.add_command(upgrade_db)
+    app.cli.add_command(expire_approvals)
+    app.cli.add_command(send_deadline_reminders)
+    app.cli.add_command(generate_recurring_tasks)
+    app.cli.add_command(rollup_task_flow)
+    app.cli.add_command(archive_tasks)
+    app.cli.add_command(purge_idempotency_keys)
+    app.cli.add_command(purge_task_changes)
+    app.cli.add_command(replica_status)
+
+@click.command('upgrade-db')
+def upgrade_db():
+    """Create missing tables and bring existing schemas in line with the models"""
+    db.create_all()
+    columns = _add_missing_columns()
+    updated = _sync_foreign_key_rules()
+    indexes = _create_missing_indexes()
+    backfilled = _backfill_approval_request_departments()
+    _backfill_archived_task_ids()
+    
+    from utils import recount_pending_approvals, refresh_subtask_counts
+    pending = recount_pending_approvals()
+    recounted = refresh_subtask_counts()
+    db.session.commit()
+    
+    click.echo(f'Database upgraded ({columns} column(s) added, {updated} foreign key(s) updated, {indexes} index(es) created, '
+               f'{backfilled} approval request department(s) backfilled, {pending} pending approval(s) counted, '
+               f'{recounted} task subtask count(s) updated)')
+
+@click.command('expire-approvals')
+def expire_approvals():
+    """Escalate and expire stale pending approval requests (run periodically, e.g. from cron)"""
+    from jobs import process_stale_approval_requests
+    escalated, expired = process_stale_approval_requests()
+    click.echo(f'{escalated} approval request(s) escalated, {expired} expired')
+
+@click.command('send-deadline-reminders')
+def send_deadline_reminders():
+    """Send assignees digests of tasks due soon and overdue tasks (run periodically, e.g. from cron)"""
+    from jobs import send_deadline_reminders as run
+    due_soon, overdue, users = run()
+    click.echo(f'{due_soon} task(s) due soon, {overdue} overdue, {users} user(s) notified')
+
+@click.command('generate-recurring-tasks')
+@click.option('--date', 'day', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Day to generate tasks for (default: today)')
+def generate_recurring_tasks(day):
+    """Create today's instances of recurring tasks (run daily, e.g. from cron; safe to rerun)"""
+    from jobs import generate_recurring_tasks as run
+    created, users = run(day.date() if day else None)
+    click.echo(f'{created} recurring task(s) created, {users} user(s) notified')
+
+@click.command('rollup-task-flow')
+@click.option('--date', 'day', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='UTC day to roll up (default: yesterday)')
+def rollup_task_flow(day):
+    """Store a day's lead time, cycle time and time-in-status statistics (run nightly; safe to rerun)"""
+    from jobs import rollup_task_flow as run
+    rows = run(day.date() if day else None)
+    click.echo(f'{rows} task flow statistic(s) stored')
+
+@click.command('archive-tasks')
+def archive_tasks():
+    """Move old completed tasks into the archive tables (run nightly, e.g. from cron)"""
+    from jobs import archive_completed_tasks
+    archived = archive_completed_tasks()
+    click.echo(f'{archived} task(s) archived')
+
+@click.command('purge-idempotency-keys')
+def purge_idempotency_keys():
+    """Delete task creation idempotency keys older than IDEMPOTENCY_KEY_TTL_HOURS (run hourly, e.g. from cron)"""
+    from idempotency import purge_expired_keys
+    deleted = purge_expired_keys()
+    click.echo(f'{deleted} expired idempotency key(s) deleted')
+
+@click.command('purge-task-changes')
+def purge_task_changes():
+    """Delete sync changes older than TASK_CHANGE_RETENTION_DAYS (run nightly, e.g. from cron)"""
+    from jobs import purge_task_changes as run
+    deleted = run()
+    click.echo(f'{deleted} task change(s) purged')
+
+@click.command('replica-status')
+def replica_status():
+    """Show how far each read replica (DATABASE_REPLICA_URLS) is behind the primary"""
+    from replicas import get_replica_router
+    router = get_replica_router()
+    if not router.engines:
+        click.echo('No read replicas configured')
+        return
+    for name, lag in router.check().items():
+        if lag is None:
+            state = 'unreachable'
+        else:
+            state = f'{lag:.1f}s behind' + (' (skipped)' if lag > router.max_lag_seconds else '')
+        click.echo(f'{name} {router.engines[name].url.render_as_string(hide_password=True)}: {state}')
+
+def _add_missing_columns():
+    """Add model columns missing from existing tables (db.create_all() skips existing tables).
+    Only nullable columns or columns with a server default can be added to populated tables."""
+    engine = db.engine
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    added = 0
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    click.echo(f'  Skipping {table.name}.{column.name}: NOT NULL without a server default')
+                    continue
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}'))
+                click.echo(f'  Added column {table.name}.{column.name}')
+                added += 1
+    return added
+
+def _create_missing_indexes():
+    """Create model indexes missing from existing tables (db.create_all() skips existing tables)"""
+    inspector = inspect(db.engine)
+    created = 0
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                click.echo(f'  Created index {index.name} on {table.name}')
+                created += 1
+    return created
+
+def _stale_foreign_keys(inspector, table):
+    """(model foreign key, existing foreign key or None) pairs whose ON DELETE rule differs"""
+    existing = {tuple(fk['constrained_columns']): fk for fk in inspector.get_foreign_keys(table.name)}
+    stale = []
+    for fk in table.foreign_key_constraints:
+        if not fk.ondelete:
+            continue
+        current = existing.get(tuple(column.name for column in fk.columns))
+        current_rule = (current or {}).get('options', {}).get('ondelete') or ''
+        if current_rule.upper() != fk.ondelete.upper():
+            stale.append((fk, current))
+    return stale
+
+def _sync_foreign_key_rules():
+    """Recreate foreign keys whose ON DELETE rule differs from the models.
+    db.create_all() never alters existing tables, so databases created before the
+    cascades were added still have plain foreign keys. MySQL alters the constraints in place;
+    SQLite cannot, so the affected tables are rebuilt."""
+    engine = db.engine
+    if engine.dialect.name == 'sqlite':
+        return _rebuild_sqlite_tables()
+    if engine.dialect.name != 'mysql':
+        click.echo(f'Skipping foreign key update on {engine.dialect.name}: '
+                   'recreate the database to pick up ON DELETE rules')
+        return 0
+    
+    inspector = inspect(engine)
+    updated = 0
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            for fk, current in _stale_foreign_keys(inspector, table):
+                columns = [column.name for column in fk.columns]
+                if current:
+                    conn.execute(text(f"ALTER TABLE `{table.name}` DROP FOREIGN KEY `{current['name']}`"))
+                name = current['name'] if current else f"fk_{table.name}_{'_'.join(columns)}"
+                referred_columns = [element.column.name for element in fk.elements]
+                conn.execute(text(
+                    f"ALTER TABLE `{table.name}` ADD CONSTRAINT `{name}` "
+                    f"FOREIGN KEY ({', '.join(f'`{c}`' for c in columns)}) "
+                    f"REFERENCES `{fk.referred_table.name}` ({', '.join(f'`{c}`' for c in referred_columns)}) "
+                    f"ON DELETE {fk.ondelete}"
+                ))
+                click.echo(f'  {table.name}({", ".join(columns)}) -> ON DELETE {fk.ondelete}')
+                updated += 1
+    return updated
+
+def _rebuild_sqlite_tables():
+    """Rebuild SQLite tables with stale foreign keys from the models: create the new table,
+    copy the rows, drop the old one and rename (https://sqlite.org/lang_altertable.html#otheralter).
+    Returns the number of foreign keys updated."""
+    engine = db.engine
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    updated = 0
+    with engine.connect() as conn:
+        # Must be switched off outside a transaction, or dropping a parent table deletes its children
+        conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        conn.commit()
+        try:
+            # pysqlite only opens transactions for DML; make the DDL part of this one
+            conn.exec_driver_sql('BEGIN')
+            for table in db.metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    continue
+                stale = _stale_foreign_keys(inspector, table)
+                if not stale:
+                    continue
+                existing = [column['name'] for column in inspector.get_columns(table.name)]
+                unknown = set(existing) - set(table.columns.keys())
+                if unknown:
+                    click.echo(f'  Skipping rebuild of {table.name}: unknown column(s) {", ".join(sorted(unknown))}')
+                    continue
+                
+                name = preparer.format_table(table)
+                new_name = preparer.quote(f'_new_{table.name}')
+                ddl = str(CreateTable(table).compile(dialect=engine.dialect))
+                conn.exec_driver_sql(ddl.replace(f'CREATE TABLE {name} (', f'CREATE TABLE {new_name} (', 1))
+                columns = ', '.join(preparer.quote(column) for column in existing)
+                conn.exec_driver_sql(f'INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {name}')
+                conn.exec_driver_sql(f'DROP TABLE {name}')
+                conn.exec_driver_sql(f'ALTER TABLE {new_name} RENAME TO {name}')
+                for index in table.indexes:
+                    index.create(conn)
+                for fk, _ in stale:
+                    click.echo(f'  {table.name}({", ".join(column.name for column in fk.columns)}) -> ON DELETE {fk.ondelete}')
+                updated += len(stale)
+            
+            violations = conn.exec_driver_sql('PRAGMA foreign_key_check').fetchall()
+            if violations:
+                raise click.ClickException(f'{len(violations)} row(s) reference missing parents; '
+                                           'fix them and run upgrade-db again')
+            conn.commit()
+        finally:
+            # Nothing is left half-rebuilt, and the pooled connection enforces foreign keys again
+            conn.rollback()
+            conn.exec_driver_sql('PRAGMA foreign_keys=ON')
+    return updated
+
+def _backfill_archived_task_ids():
+    """Archive rows written before ArchivedTask got its own id kept the task id in `id`.
+    On MySQL that id column also needs AUTO_INCREMENT now."""
+    from models import ArchivedTask
+    engine = db.engine
+    if engine.dialect.name == 'mysql':
+        columns = {column['name']: column for column in inspect(engine).get_columns('archived_task')}
+        if not columns['id'].get('autoincrement'):
+            with engine.begin() as conn:
+                conn.execute(text('ALTER TABLE `archived_task` MODIFY `id` INTEGER NOT NULL AUTO_INCREMENT'))
+            click.echo('  archived_task.id -> AUTO_INCREMENT')
+    updated = ArchivedTask.query.filter(ArchivedTask.task_id.is_(None)).update(
+        {ArchivedTask.task_id: ArchivedTask.id}, synchronize_session=False)
+    if updated:
+        click.echo(f'  {updated} archived task(s) got their task_id')
+    return updated
+
+def _backfill_approval_request_departments():
+    """Copy legacy JSON requested_department_ids into TaskApprovalRequestDepartment rows.
+    Requests that already have rows are skipped, so running it again is harmless."""
+    from models import Department, TaskApprovalRequest, TaskApprovalRequestDepartment
+    legacy_requests = db.session.query(TaskApprovalRequest.id, TaskApprovalRequest.requested_department_ids).filter(
+        TaskApprovalRequest.requested_department_ids.isnot(None),
+        TaskApprovalRequest.id.not_in(select(TaskApprovalRequestDepartment.approval_request_id))
+    ).all()
+    if not legacy_requests:
+        return 0
+    
+    # Departments deleted since the request was made are dropped
+    existing_department_ids = {row.id for row in db.session.query(Department.id)}
+    rows = []
+    for request_id, raw_ids in legacy_requests:
+        try:
+            department_ids = json.loads(raw_ids)
+        except (json.JSONDecodeError, TypeError):
+            click.echo(f'  Skipping approval request #{request_id}: invalid requested_department_ids')
+            continue
+        if not isinstance(department_ids, list):
+            continue
+        department_ids = {int(d) for d in department_ids if str(d).isdigit()} & existing_department_ids
+        rows.extend({'approval_request_id': request_id, 'department_id': d} for d in sorted(department_ids))
+    
+    if rows:
+        db.session.execute(TaskApprovalRequestDepartment.__table__.insert(), rows)
+    db.session.commit()
+    return len(rows)
@@ -4,6 +4,18 @@ from urllib.parse import quote_plus
 
 load_dotenv()
 
+def pool_options(workers, threads, max_connections=0):
+    """Per-process pool_size/max_overflow for `workers` processes of `threads` threads each.
+    Every thread can hold a connection, with half as many again as overflow for background work;
+    max_connections (0 = no limit) caps the total across all workers."""
+    workers, threads = max(workers, 1), max(threads, 1)
+    pool_size, max_overflow = threads, max(threads // 2, 2)
+    if max_connections:
+        per_worker = max(max_connections // workers, 1)
+        pool_size = min(pool_size, per_worker)
+        max_overflow = min(max_overflow, per_worker - pool_size)
+    return {'pool_size': pool_size, 'max_overflow': max_overflow}
+
 class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-change-this-in-production')
     
@@ -19,6 +31,72 @@ class Config:
     FIREBASE_SERVICE_ACCOUNT_PATH = os.getenv('FIREBASE_SERVICE_ACCOUNT_PATH', 'workflow-firebase.json')
     FIREBASE_VAPID_KEY = os.getenv('FIREBASE_VAPID_KEY', '')
     
+    # Push transport: 'firebase', or 'fake' for an in-process stand-in (see notification_transport.py)
+    NOTIFICATION_TRANSPORT = os.getenv('NOTIFICATION_TRANSPORT', 'firebase')
+    FAKE_FCM_LATENCY_MS = float(os.getenv('FAKE_FCM_LATENCY_MS', '0'))
+    FAKE_FCM_ERROR_RATE = float(os.getenv('FAKE_FCM_ERROR_RATE', '0'))
+    FAKE_FCM_QUOTA_PER_SECOND = int(os.getenv('FAKE_FCM_QUOTA_PER_SECOND', '0'))  # 0 = unlimited
+    
+    # Live dashboard events (server-sent events)
+    # Set a Redis URL to share events between workers; without it events stay in-process
+    EVENTS_REDIS_URL = os.getenv('EVENTS_REDIS_URL', '')
+    EVENTS_HEARTBEAT_SECONDS = int(os.getenv('EVENTS_HEARTBEAT_SECONDS', '15'))
+    EVENTS_MAX_STREAM_SECONDS = int(os.getenv('EVENTS_MAX_STREAM_SECONDS', '300'))  # Browsers reconnect automatically
+    
+    # Task assignment notifications to the same user within this window are sent as one
+    # "N new tasks" notification; 0 sends every notification immediately
+    NOTIFICATION_COALESCE_SECONDS = float(os.getenv('NOTIFICATION_COALESCE_SECONDS', '10'))
+    
+    # Stale approval requests (`flask expire-approvals`, run from cron); 0 disables a step
+    APPROVAL_ESCALATION_DAYS = int(os.getenv('APPROVAL_ESCALATION_DAYS', '3'))
+    APPROVAL_EXPIRY_DAYS = int(os.getenv('APPROVAL_EXPIRY_DAYS', '14'))
+    APPROVAL_JOB_BATCH_SIZE = int(os.getenv('APPROVAL_JOB_BATCH_SIZE', '500'))
+    
+    # Deadline reminders (`flask send-deadline-reminders`, run from cron); 0 disables a step
+    DEADLINE_REMINDER_HOURS = int(os.getenv('DEADLINE_REMINDER_HOURS', '24'))  # Warn this long before the deadline
+    DEADLINE_OVERDUE_LOOKBACK_DAYS = int(os.getenv('DEADLINE_OVERDUE_LOOKBACK_DAYS', '7'))  # Older overdue tasks are not announced
+    DEADLINE_JOB_BATCH_SIZE = int(os.getenv('DEADLINE_JOB_BATCH_SIZE', '500'))
+    
+    # Flow analytics window (lead time, cycle time, time in status; rolled up by `flask rollup-task-flow`)
+    FLOW_ANALYTICS_DAYS = int(os.getenv('FLOW_ANALYTICS_DAYS', '30'))
+    
+    # Task archive (`flask archive-tasks`, run from cron): completed tasks untouched this long leave the live tables; 0 disables
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '180'))
+    ARCHIVE_JOB_BATCH_SIZE = int(os.getenv('ARCHIVE_JOB_BATCH_SIZE', '200'))
+    
+    # A repeated task creation with the same idempotency key within this window returns the
+    # first task instead of creating another (`flask purge-idempotency-keys` removes older keys)
+    IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+    
+    # Task sync (/api/tasks/changes): changes younger than the safety window are held back, so a
+    # transaction still committing a lower change id is not skipped by a client's cursor; transactions
+    # running longer than the window can still be missed. `flask purge-task-changes` deletes changes
+    # older than the retention; clients whose cursor is older must resync (410 Gone).
+    SYNC_SAFETY_WINDOW_SECONDS = float(os.getenv('SYNC_SAFETY_WINDOW_SECONDS', '5'))
+    TASK_CHANGE_RETENTION_DAYS = int(os.getenv('TASK_CHANGE_RETENTION_DAYS', '30'))
+    TASK_CHANGE_PURGE_BATCH_SIZE = int(os.getenv('TASK_CHANGE_PURGE_BATCH_SIZE', '5000'))
+    
+    # Read replicas (optional, comma-separated URLs): dashboards and analytics read from them (see replicas.py)
+    DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', '10'))  # A user reads from the primary this long after writing
+    REPLICA_MAX_LAG_SECONDS = int(os.getenv('REPLICA_MAX_LAG_SECONDS', '30'))  # Replicas further behind are skipped
+    REPLICA_LAG_CHECK_SECONDS = int(os.getenv('REPLICA_LAG_CHECK_SECONDS', '5'))
+    
+    # Declared server concurrency: gunicorn -w WEB_CONCURRENCY --threads WEB_THREADS. Connection pools are
+    # sized from it; DB_MAX_CONNECTIONS is this app's share of the server's max_connections (0 = no limit).
+    # DB_POOL_SIZE/DB_MAX_OVERFLOW override the derived values.
+    WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', '1'))
+    WEB_THREADS = int(os.getenv('WEB_THREADS', '8'))
+    DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', '0'))
+    # Every open live-update stream (/api/tasks/events) holds one of these threads; at most this many
+    # streams per process (default half the threads, 0 = unlimited) so page requests always find a
+    # free thread. Further streams get 503 and retry after EVENTS_RETRY_AFTER_SECONDS.
+    EVENTS_MAX_STREAMS_PER_WORKER = int(os.getenv('EVENTS_MAX_STREAMS_PER_WORKER', max(WEB_THREADS // 2, 1)))
+    EVENTS_RETRY_AFTER_SECONDS = int(os.getenv('EVENTS_RETRY_AFTER_SECONDS', '30'))
+    DB_POOL_OPTIONS = pool_options(WEB_CONCURRENCY, WEB_THREADS, DB_MAX_CONNECTIONS)
+    DB_POOL_OPTIONS['pool_size'] = int(os.getenv('DB_POOL_SIZE', DB_POOL_OPTIONS['pool_size']))
+    DB_POOL_OPTIONS['max_overflow'] = int(os.getenv('DB_MAX_OVERFLOW', DB_POOL_OPTIONS['max_overflow']))
+    
     # Database configuration
     DB_HOSTNAME = os.getenv('DB_HOSTNAME', 'localhost')
     DB_USER = os.getenv('DB_USER', 'root')
@@ -45,9 +123,8 @@ class Config:
         SQLALCHEMY_ENGINE_OPTIONS = {
             'pool_pre_ping': True,      # Verify connections before using them (reconnects if stale)
             'pool_recycle': 3600,       # Recycle connections after 1 hour (3600 seconds)
-            'pool_timeout': 20,         # Timeout for getting connection from pool
-            'max_overflow': 10,         # Allow connections to overflow pool
-            'pool_size': 5,             # Maintain 5 connections in pool
+            'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', '20')),  # Timeout for getting connection from pool
+            **DB_POOL_OPTIONS,          # pool_size and max_overflow from the declared workers/threads
             'connect_args': {
                 'connect_timeout': 10,  # Connection timeout
                 'read_timeout': 30,     # Read timeout
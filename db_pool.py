@@ -0,0 +1,144 @@
+"""
+Database connection pools: sizing, health statistics and reuse after fork.
+
+Pool sizes follow the declared server concurrency (config.pool_options): every worker thread can
+hold one connection, and DB_MAX_CONNECTIONS, when set, caps workers x (pool_size + max_overflow)
+so the app stays inside the database server's max_connections.
+
+MonitoredQueuePool records how long each checkout took (queueing for a free connection, plus
+connecting and the pre-ping when needed) and how many timed out. Listeners count pre-ping
+failures and invalidated connections. pool_status() reports them together with the pool's
+checked-in/checked-out/overflow counts for GET /admin/pool-health. Statistics are per process
+and start over when a pool is disposed.
+
+Connections must not be shared between processes. When the app is created before the server
+forks (gunicorn --preload), the startup queries leave connections in the parent's pools, so
+every engine is disposed in the child right after the fork (close=False leaves the parent's
+sockets alone).
+"""
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+WAIT_HISTORY_SIZE = 1000
+
+class PoolStats:
+    """Checkout timings and failure counts of one pool"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.recent_waits = deque(maxlen=WAIT_HISTORY_SIZE)
+        self.timeouts = 0
+        self.pre_ping_failures = 0
+        self.invalidations = 0
+    
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+    
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            self.recent_waits.append(seconds)
+            if timed_out:
+                self.timeouts += 1
+    
+    def summary(self):
+        with self._lock:
+            recent = sorted(self.recent_waits)
+            def ms(seconds):
+                return round(seconds * 1000, 2)
+            return {
+                'checkouts': self.checkouts,
+                'wait_avg_ms': ms(self.total_wait_seconds / self.checkouts) if self.checkouts else 0.0,
+                'wait_p95_ms': ms(recent[min(int(len(recent) * 0.95), len(recent) - 1)]) if recent else 0.0,
+                'wait_max_ms': ms(self.max_wait_seconds),
+                'timeouts': self.timeouts,
+                'pre_ping_failures': self.pre_ping_failures,
+                'invalidations': self.invalidations,
+            }
+
+class MonitoredQueuePool(QueuePool):
+    """QueuePool that times every checkout"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+    
+    def connect(self):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self.stats.record_wait(time.perf_counter() - started, timed_out)
+
+_engines = weakref.WeakSet()  # Engines to dispose in forked children
+
+def _dispose_after_fork():
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_after_fork)
+
+def monitor_engine(engine):
+    """Count pre-ping failures and invalidations of engine's pool, and dispose it after fork"""
+    if engine in _engines:
+        return
+    _engines.add(engine)
+    
+    # Looked up on every event: dispose() replaces the pool (and its statistics)
+    def stats():
+        return getattr(engine.pool, 'stats', None)
+    
+    @event.listens_for(engine, 'handle_error')
+    def count_pre_ping_failure(context):
+        if context.is_pre_ping and stats() is not None:
+            stats().count('pre_ping_failures')
+    
+    @event.listens_for(engine, 'invalidate')
+    def count_invalidation(dbapi_connection, connection_record, exception):
+        if stats() is not None:
+            stats().count('invalidations')
+
+def configure_pool_class(app):
+    """Use MonitoredQueuePool for the app's engines; call before db.init_app(). In-memory SQLite
+    keeps the single shared connection Flask-SQLAlchemy gives it."""
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if url.drivername.startswith('sqlite') and url.database in (None, '', ':memory:'):
+        return
+    # A copy, so the Config class attribute is not changed
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    options.setdefault('poolclass', MonitoredQueuePool)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+def pool_status(engine):
+    """Current pool occupancy plus the checkout statistics of a monitored pool"""
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'timeout_seconds': pool.timeout(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        })
+    if isinstance(pool, MonitoredQueuePool):
+        status.update(pool.stats.summary())
+    return status
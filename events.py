@@ -0,0 +1,157 @@
+"""
+Live task events for dashboards (server-sent events).
+
+Committed task changes (collected in task_changes.py) are published to a broker. Every
+open SSE stream holds a subscription queue and forwards the events its user may see.
+The default broker only reaches streams served by the same process; set
+EVENTS_REDIS_URL to fan events out through Redis pub/sub when running several workers.
+
+Each stream holds a worker thread while it is open, so subscribe() takes a per-process limit
+(EVENTS_MAX_STREAMS_PER_WORKER) and the SSE view answers 503 with Retry-After beyond it.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# Reconnect delays of the Redis listener: doubled after every failure up to the maximum
+LISTENER_RETRY_SECONDS = 1
+LISTENER_MAX_RETRY_SECONDS = 30
+
+class LocalEventBroker:
+    """In-process pub/sub: every subscriber gets a bounded queue of event batches"""
+
+    def __init__(self, queue_size=100):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._queue_size = queue_size
+
+    def subscribe(self, limit=0):
+        """A new subscription queue, or None when limit (0 = unlimited) streams are already open"""
+        subscription = queue.Queue(maxsize=self._queue_size)
+        with self._lock:
+            if limit and len(self._subscribers) >= limit:
+                return None
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, events):
+        self._deliver(events)
+
+    def _deliver(self, events):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait(events)
+            except queue.Full:
+                # Stalled client: drop the batch rather than block the writer
+                pass
+
+class RedisEventBroker(LocalEventBroker):
+    """Shares events between worker processes through a Redis pub/sub channel"""
+
+    def __init__(self, url, channel='workflow:task_events', queue_size=100):
+        import redis  # Optional dependency, only needed for multi-worker deployments
+        super().__init__(queue_size)
+        self._redis = redis.Redis.from_url(url)
+        self._channel = channel
+        self._listener = None
+
+    def subscribe(self, limit=0):
+        self._ensure_listener()
+        return super().subscribe(limit)
+
+    def publish(self, events):
+        self._redis.publish(self._channel, json.dumps(events))
+
+    def _ensure_listener(self):
+        # One listener thread per process relays the channel to the local subscribers
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='task-events-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        # Reconnects by itself when Redis goes away, so open streams keep receiving events
+        # (events published while it is disconnected are lost; dashboards can still refresh)
+        delay = LISTENER_RETRY_SECONDS
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self._channel)
+                delay = LISTENER_RETRY_SECONDS
+                for message in pubsub.listen():
+                    self._deliver(json.loads(message['data']))
+            except Exception as e:
+                logger.warning(f"Task events listener disconnected, retrying in {delay}s: {str(e)}")
+            finally:
+                pubsub.close()
+            time.sleep(delay)
+            delay = min(delay * 2, LISTENER_MAX_RETRY_SECONDS)
+
+def init_event_broker(app):
+    """Create the broker for this app, using Redis when EVENTS_REDIS_URL is configured"""
+    redis_url = app.config.get('EVENTS_REDIS_URL')
+    broker = None
+    if redis_url:
+        try:
+            broker = RedisEventBroker(redis_url)
+        except ImportError:
+            app.logger.warning("EVENTS_REDIS_URL is set but the redis package is not installed. Live task events will only reach this worker.")
+    app.extensions['task_events'] = broker or LocalEventBroker()
+    return app.extensions['task_events']
+
+def get_event_broker():
+    return current_app.extensions['task_events']
+
+def publish_task_events(events):
+    """Publish committed task events; failures are logged and never fail the request"""
+    def ids(values):
+        return sorted(value for value in values if value is not None)
+
+    batch = [{
+        'task_id': event['task_id'],
+        'status': event['status'],
+        'created': event['created'],
+        'deleted': event['deleted'],
+        'department_ids': ids(event['department_ids']),
+        'user_ids': ids(event['user_ids']),
+        'former_department_ids': ids(event['former_department_ids'] - event['department_ids']),
+        'former_user_ids': ids(event['former_user_ids'] - event['user_ids']),
+    } for event in events]
+    try:
+        get_event_broker().publish(batch)
+    except Exception as e:
+        current_app.logger.error(f"Task events publish FAILED - {len(batch)} event(s): {str(e)}")
+
+def event_for_user(event, user_id, role, department_id):
+    """Routing counterpart of can_access_task, evaluated on the event's audience.
+    Returns the browser payload, or None when the user must not receive the event."""
+    if role == 'admin':
+        visible, former = True, False
+    elif role == 'department_head':
+        visible = department_id is not None and department_id in event['department_ids']
+        former = department_id is not None and department_id in event['former_department_ids']
+    elif role == 'team_member':
+        visible = user_id in event['user_ids']
+        former = user_id in event['former_user_ids']
+    else:
+        visible = former = False
+    if not (visible or former):
+        return None
+    return {
+        'task_id': event['task_id'],
+        'status': event['status'],
+        'created': event['created'],
+        'deleted': event['deleted'],
+        'removed': event['deleted'] or not visible,  # Gone from this user's scope
+    }
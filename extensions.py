@@ -1,8 +1,40 @@
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import Select
 
-db = SQLAlchemy()
+REPLICA_INFO_KEY = 'replica_engine'    # session.info: replica engine that this request reads from
+WROTE_INFO_KEY = 'wrote_to_primary'    # session.info: set once the request issued a write
+
+class RoutingSession(Session):
+    """Sends SELECTs to the replica chosen for the request (see replicas.py) and everything else,
+    flushes, bulk writes and raw connections, to the primary"""
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            reading = not self._flushing and isinstance(clause, Select)
+            replica = self.info.get(REPLICA_INFO_KEY)
+            if replica is not None:
+                if reading:
+                    return replica
+                # Later reads in the same request must see the write
+                self.info.pop(REPLICA_INFO_KEY)
+            if not reading:
+                self.info[WROTE_INFO_KEY] = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 bcrypt = Bcrypt()
 login_manager = LoginManager()
 
+@event.listens_for(Engine, 'connect')
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite ignores foreign keys (and ON DELETE cascades) unless enabled per connection"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
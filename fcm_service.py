@@ -1,23 +1,110 @@
 import os
+import threading
 import firebase_admin
 from firebase_admin import credentials, messaging
 from flask import current_app
+from notification_transport import TransportUnavailable, get_notification_transport
 
-# Initialize Firebase Admin SDK
-_firebase_app = None
+# Android delivery settings per notification type (the data payload's 'type').
+# The notification channel (configured with sound in MainApplication.kt) handles sound settings.
+ANDROID_TEMPLATES = {
+    'default': {'channel_id': 'task_notifications', 'priority': 'high'},  # Channel ID must match the Android app
+    # A new digest replaces the previous one in the notification tray
+    'approvals_digest': {'channel_id': 'task_notifications', 'priority': 'high', 'tag': 'approvals_digest'},
+    'task_deadlines': {'channel_id': 'task_notifications', 'priority': 'high', 'tag': 'task_deadlines'},
+}
+
+class NotificationClient:
+    """
+    Process-wide Firebase Cloud Messaging client.
+
+    Firebase is initialized once (the credentials file is checked once, not per send), every
+    send passes the same firebase_admin app so its messaging service and HTTP session are
+    reused, and the AndroidConfig for each notification type is built once and shared.
+    """
+    name = 'firebase'
+
+    def __init__(self, cred_path=None):
+        self._cred_path = cred_path or os.getenv('FIREBASE_SERVICE_ACCOUNT_PATH', 'workflow-firebase.json')
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._app = None
+        self._android_configs = {}
+
+    def initialize(self):
+        """Initialize Firebase on first use; returns the firebase_admin app or None if not configured"""
+        if self._initialized:
+            return self._app
+        with self._lock:
+            if not self._initialized:
+                if os.path.exists(self._cred_path):
+                    try:
+                        self._app = firebase_admin.get_app()
+                    except ValueError:
+                        self._app = firebase_admin.initialize_app(credentials.Certificate(self._cred_path))
+                else:
+                    current_app.logger.warning(f"Firebase credentials file not found at {self._cred_path}. FCM notifications will be disabled.")
+                self._initialized = True
+        return self._app
+
+    def _firebase_app(self):
+        app = self.initialize()
+        if app is None:
+            raise TransportUnavailable('Firebase not initialized')
+        return app
+
+    def android_config(self, notification_type=None):
+        config = self._android_configs.get(notification_type)
+        if config is None:
+            template = ANDROID_TEMPLATES.get(notification_type, ANDROID_TEMPLATES['default'])
+            config = messaging.AndroidConfig(
+                priority=template['priority'],
+                notification=messaging.AndroidNotification(
+                    channel_id=template['channel_id'],
+                    priority=template['priority'],
+                    tag=template.get('tag'),
+                )
+            )
+            # Concurrent first builds for a type produce equal objects, so no lock is needed
+            self._android_configs[notification_type] = config
+        return config
+
+    def send(self, token, title, body, data):
+        """Send to one device; returns the provider message id or raises"""
+        app = self._firebase_app()
+        return messaging.send(messaging.Message(
+            notification=messaging.Notification(title=title, body=body),
+            data=data,
+            token=token,
+            android=self.android_config(data.get('type')),
+        ), app=app)
+
+    def send_multicast(self, tokens, title, body, data):
+        """Send to several devices; returns (success_count, failure_count) or raises"""
+        app = self._firebase_app()
+        response = messaging.send_each_for_multicast(messaging.MulticastMessage(
+            notification=messaging.Notification(title=title, body=body),
+            data=data,
+            tokens=tokens,
+            android=self.android_config(data.get('type')),
+        ), app=app)
+        return response.success_count, response.failure_count
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_notification_client():
+    """The NotificationClient shared by every app in this process"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = NotificationClient()
+    return _client
 
 def initialize_firebase():
     """Initialize Firebase Admin SDK"""
-    global _firebase_app
-    if _firebase_app is None:
-        # Check for Firebase credentials file path from environment variable
-        cred_path = os.getenv('FIREBASE_SERVICE_ACCOUNT_PATH', 'workflow-firebase.json')
-        if os.path.exists(cred_path):
-            cred = credentials.Certificate(cred_path)
-            _firebase_app = firebase_admin.initialize_app(cred)
-        else:
-            current_app.logger.warning(f"Firebase credentials file not found at {cred_path}. FCM notifications will be disabled.")
-    return _firebase_app
+    return get_notification_client().initialize()
 
 def send_notification(fcm_token, title, body, data=None):
     """
@@ -36,38 +123,14 @@ def send_notification(fcm_token, title, body, data=None):
         return False
     
     try:
-        initialize_firebase()
-        
-        if _firebase_app is None:
-            current_app.logger.error(f"FCM Notification FAILED - Firebase not initialized. Title: '{title}', Body: '{body}'")
-            return False
-        
-        # Configure Android notification - let channel handle sound settings
-        android_config = messaging.AndroidConfig(
-            priority='high',
-            notification=messaging.AndroidNotification(
-                channel_id='task_notifications',  # Should match channel ID in Android app
-                priority='high',
-                # Don't specify sound here - let the notification channel handle it
-                # The channel is configured with sound in MainApplication.kt
-            )
-        )
-        
-        message = messaging.Message(
-            notification=messaging.Notification(
-                title=title,
-                body=body,
-            ),
-            data=data or {},
-            token=fcm_token,
-            android=android_config,
-        )
-        
-        response = messaging.send(message)
+        response = get_notification_transport().send(fcm_token, title, body, data or {})
         # Log to production log (INFO) and error log (ERROR)
         current_app.logger.info(f"FCM Notification SENT - Title: '{title}', Body: '{body}', Token: {fcm_token[:20]}..., Response: {response}")
         current_app.logger.error(f"FCM Notification SENT - Title: '{title}', Body: '{body}', Token: {fcm_token[:20]}..., Response: {response}")
         return True
+    except TransportUnavailable:
+        current_app.logger.error(f"FCM Notification FAILED - Firebase not initialized. Title: '{title}', Body: '{body}'")
+        return False
     except Exception as e:
         # Log failures to both logs
         current_app.logger.error(f"FCM Notification FAILED - Title: '{title}', Body: '{body}', Token: {fcm_token[:20] if fcm_token else 'None'}..., Error: {str(e)}")
@@ -95,51 +158,15 @@ def send_notification_to_multiple(tokens, title, body, data=None):
         return {'success': 0, 'failure': 0}
     
     try:
-        initialize_firebase()
-        
-        if _firebase_app is None:
-            current_app.logger.error(f"FCM Notification MULTICAST FAILED - Firebase not initialized. Title: '{title}', Body: '{body}', Tokens: {len(valid_tokens)}")
-            return {'success': 0, 'failure': len(valid_tokens)}
-        
-        # Configure Android notification - let channel handle sound settings
-        android_config = messaging.AndroidConfig(
-            priority='high',
-            notification=messaging.AndroidNotification(
-                channel_id='task_notifications',  # Should match channel ID in Android app
-                priority='high',
-                # Don't specify sound here - let the notification channel handle it
-                # The channel is configured with sound in MainApplication.kt
-            )
-        )
-        
-        # Configure Android notification - let channel handle sound settings
-        android_config = messaging.AndroidConfig(
-            priority='high',
-            notification=messaging.AndroidNotification(
-                channel_id='task_notifications',  # Should match channel ID in Android app
-                priority='high',
-                # Don't specify sound here - let the notification channel handle it
-                # The channel is configured with sound in MainApplication.kt
-            )
-        )
-        
-        message = messaging.MulticastMessage(
-            notification=messaging.Notification(
-                title=title,
-                body=body,
-            ),
-            data=data or {},
-            tokens=valid_tokens,
-            android=android_config,
-        )
-        
-        response = messaging.send_multicast(message)
+        success_count, failure_count = get_notification_transport().send_multicast(valid_tokens, title, body, data or {})
         # Log to production log (INFO) and error log (ERROR)
-        current_app.logger.info(f"FCM Notification MULTICAST - Title: '{title}', Body: '{body}', Tokens: {len(valid_tokens)}, Success: {response.success_count}, Failed: {response.failure_count}")
-        current_app.logger.error(f"FCM Notification MULTICAST - Title: '{title}', Body: '{body}', Tokens: {len(valid_tokens)}, Success: {response.success_count}, Failed: {response.failure_count}")
-        return {'success': response.success_count, 'failure': response.failure_count}
+        current_app.logger.info(f"FCM Notification MULTICAST - Title: '{title}', Body: '{body}', Tokens: {len(valid_tokens)}, Success: {success_count}, Failed: {failure_count}")
+        current_app.logger.error(f"FCM Notification MULTICAST - Title: '{title}', Body: '{body}', Tokens: {len(valid_tokens)}, Success: {success_count}, Failed: {failure_count}")
+        return {'success': success_count, 'failure': failure_count}
+    except TransportUnavailable:
+        current_app.logger.error(f"FCM Notification MULTICAST FAILED - Firebase not initialized. Title: '{title}', Body: '{body}', Tokens: {len(valid_tokens)}")
+        return {'success': 0, 'failure': len(valid_tokens)}
     except Exception as e:
         # Log failures to both logs
         current_app.logger.error(f"FCM Notification MULTICAST FAILED - Title: '{title}', Body: '{body}', Tokens: {len(valid_tokens)}, Error: {str(e)}")
         return {'success': 0, 'failure': len(valid_tokens)}
-
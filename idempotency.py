@@ -0,0 +1,68 @@
+"""
+Idempotency keys for task creation.
+
+Create forms carry a one-time key in a hidden field; API clients send an Idempotency-Key
+header. The first request with a key stores it with the id of the task it created, in the
+same transaction as the task. A repeat (double-click, mobile retry) finds the key and answers
+with the original task instead of creating rows and sending notifications again. When two
+copies race, the unique (user_id, endpoint, key) index makes the second commit fail, and it
+is rolled back and answered the same way. Keys expire after IDEMPOTENCY_KEY_TTL_HOURS and
+are removed by `flask purge-idempotency-keys`.
+"""
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app, request
+from flask_login import current_user
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 64
+
+def new_idempotency_key():
+    """Key for a hidden form field, rendered once per form"""
+    return uuid.uuid4().hex
+
+def request_idempotency_key():
+    """The key sent with this request (header first, then form field), or None"""
+    key = (request.headers.get(IDEMPOTENCY_HEADER) or request.form.get('idempotency_key') or '').strip()
+    return key[:MAX_KEY_LENGTH] or None
+
+def _expiry_cutoff(now=None):
+    return (now or datetime.utcnow()) - timedelta(hours=current_app.config.get('IDEMPOTENCY_KEY_TTL_HOURS', 24))
+
+def find_idempotent_result(key):
+    """The stored key of an earlier request by the current user to this endpoint, or None.
+    An expired key is removed so it can be used again."""
+    if not key:
+        return None
+    stored = IdempotencyKey.query.filter_by(user_id=current_user.id, endpoint=request.endpoint, key=key).first()
+    if stored is not None and stored.created_at < _expiry_cutoff():
+        db.session.delete(stored)
+        db.session.flush()
+        return None
+    return stored
+
+def remember_idempotent_result(key, task_id):
+    """Store key with the created task in the current transaction; the caller commits"""
+    if key:
+        db.session.add(IdempotencyKey(user_id=current_user.id, endpoint=request.endpoint, key=key, task_id=task_id))
+
+def commit_or_replay(key):
+    """Commit the creation. Returns False, with the transaction rolled back, if a concurrent
+    request with the same key committed first."""
+    try:
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+        if find_idempotent_result(key) is not None:
+            return False
+        raise
+
+def purge_expired_keys(now=None):
+    """Delete expired keys in one statement; returns how many were removed"""
+    deleted = IdempotencyKey.query.filter(IdempotencyKey.created_at < _expiry_cutoff(now)).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
@@ -0,0 +1,99 @@
+"""
+In-app notification inbox.
+
+Every new TaskAssignment gets a Notification row for the assignee in the same flush, so the
+inbox is complete even when a push fails or the user has no registered device. Bulk inserts
+bypass the flush and call record_assignment_notifications() (see jobs.generate_recurring_tasks).
+Digest notifications (deadlines, stale approvals) are stored by the job that sends them.
+"""
+import json
+from datetime import datetime
+from sqlalchemy import event, insert, select
+from extensions import db
+from models import Task, TaskAssignment, Notification
+
+PRIORITY_EMOJI = {
+    'URGENT': '🔴',
+    'IMPORTANT': '🟡',
+    'DAILY TASK': '🟢'
+}
+
+def init_notification_inbox():
+    """Attach the assignment listener to the Flask-SQLAlchemy session (idempotent)"""
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+
+def _assignment_rows(connection, assignments):
+    """Notification rows for (task_id, user_id, assigned_by_id) tuples, task names read in one query"""
+    task_ids = {task_id for task_id, _, _ in assignments}
+    if not task_ids:
+        return []
+    tasks = {row.id: row for row in connection.execute(
+        select(Task.id, Task.task_name, Task.priority).where(Task.id.in_(task_ids)))}
+    created_at = datetime.utcnow()
+    rows = []
+    for task_id, user_id, assigned_by_id in assignments:
+        task = tasks.get(task_id)
+        if task is None:
+            continue
+        body = f"🔴 URGENT: {task.task_name}" if task.priority == 'URGENT' else f"{PRIORITY_EMOJI.get(task.priority, '📋')} {task.task_name}"
+        rows.append({
+            'user_id': user_id,
+            'notification_type': 'task_assigned',
+            'title': 'New Task Assigned',
+            'body': body,
+            'task_id': task_id,
+            'data': json.dumps({'task_id': task_id, 'priority': task.priority, 'assigned_by_id': assigned_by_id}),
+            'created_at': created_at,
+        })
+    return rows
+
+def _after_flush(session, flush_context):
+    assignments = [(obj.task_id, obj.user_id, obj.assigned_by_id)
+                   for obj in session.new if isinstance(obj, TaskAssignment)]
+    if assignments:
+        connection = session.connection()
+        rows = _assignment_rows(connection, assignments)
+        if rows:
+            connection.execute(insert(Notification), rows)
+
+def record_assignment_notifications(session, *criteria):
+    """Create inbox rows for TaskAssignments added with a bulk insert (criteria must match exactly those rows)"""
+    connection = session.connection()
+    assignments = connection.execute(
+        select(TaskAssignment.task_id, TaskAssignment.user_id, TaskAssignment.assigned_by_id).where(*criteria)).all()
+    rows = _assignment_rows(connection, assignments)
+    if rows:
+        connection.execute(insert(Notification), rows)
+
+def assignment_notification_ids(user_id, task_ids):
+    """Latest task_assigned notification id per task for user, used as the push payload"""
+    from sqlalchemy import func
+    return [row[0] for row in db.session.query(func.max(Notification.id)).filter(
+        Notification.user_id == user_id,
+        Notification.task_id.in_(task_ids),
+        Notification.notification_type == 'task_assigned'
+    ).group_by(Notification.task_id)]
+
+def create_notification(user_id, notification_type, title, body, data=None):
+    """Add a digest notification to the session; the caller commits"""
+    notification = Notification(user_id=user_id, notification_type=notification_type, title=title,
+                                body=body, data=json.dumps(data or {}))
+    db.session.add(notification)
+    return notification
+
+def serialize_notification(notification):
+    try:
+        data = json.loads(notification.data) if notification.data else {}
+    except (json.JSONDecodeError, TypeError):
+        data = {}
+    return {
+        'id': notification.id,
+        'type': notification.notification_type,
+        'title': notification.title,
+        'body': notification.body,
+        'task_id': notification.task_id,
+        'data': data,
+        'created_at': notification.created_at.isoformat() if notification.created_at else None,
+        'read_at': notification.read_at.isoformat() if notification.read_at else None,
+    }
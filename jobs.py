@@ -0,0 +1,314 @@
+"""
+Scheduled maintenance jobs. Each job is exposed as a Flask CLI command (see commands.py)
+so it can be run from cron, e.g.:
+
+    */30 * * * * cd /path/to/workflow && flask --app app expire-approvals
+    */15 * * * * cd /path/to/workflow && flask --app app send-deadline-reminders
+    5 0 * * * cd /path/to/workflow && flask --app app generate-recurring-tasks
+    30 0 * * * cd /path/to/workflow && flask --app app rollup-task-flow
+    45 1 * * * cd /path/to/workflow && flask --app app archive-tasks
+    0 * * * * cd /path/to/workflow && flask --app app purge-idempotency-keys
+    15 2 * * * cd /path/to/workflow && flask --app app purge-task-changes
+"""
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import case, exists, func, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from extensions import db
+from models import (User, Task, TaskAssignment, TaskDepartmentAssignment, DepartmentTaskCompletion,
+                    TaskApprovalRequest, RecurringTask, TaskFlowDailyStat, TaskChange)
+
+def _append_note(note):
+    """approval_notes with note appended, as a SQL expression for bulk UPDATEs"""
+    notes = TaskApprovalRequest.approval_notes
+    return case((notes.is_(None), note), else_=notes + '\n' + note)
+
+def _update_in_batches(criteria, values, batch_size, action, details, applied):
+    """Apply values to PENDING requests matching criteria, batch_size rows per transaction, and
+    log action for the tasks of the requests that now match applied. Returns the number of updated requests; each batch is committed
+    with its counter change and activity events."""
+    from utils import adjust_pending_approvals_count
+    from activity import record_task_activities
+    total = 0
+    while True:
+        ids = [row.id for row in db.session.query(TaskApprovalRequest.id).filter(
+            TaskApprovalRequest.status == 'PENDING', *criteria
+        ).order_by(TaskApprovalRequest.id).limit(batch_size)]
+        if not ids:
+            return total
+        # Re-check the status so requests resolved since the SELECT are left alone
+        updated = TaskApprovalRequest.query.filter(
+            TaskApprovalRequest.id.in_(ids), TaskApprovalRequest.status == 'PENDING'
+        ).update(values, synchronize_session=False)
+        if values.get(TaskApprovalRequest.status) == 'EXPIRED':
+            adjust_pending_approvals_count(-updated)
+        if updated:
+            record_task_activities(action, [row.task_id for row in db.session.query(TaskApprovalRequest.task_id).filter(
+                TaskApprovalRequest.id.in_(ids), applied)], details)
+        db.session.commit()
+        total += updated
+        if len(ids) < batch_size:
+            return total
+
+def process_stale_approval_requests(now=None):
+    """Expire requests pending longer than APPROVAL_EXPIRY_DAYS and escalate the ones pending
+    longer than APPROVAL_ESCALATION_DAYS, then send admins a single digest notification.
+    Returns (escalated, expired)."""
+    now = now or datetime.utcnow()
+    config = current_app.config
+    batch_size = config.get('APPROVAL_JOB_BATCH_SIZE', 500)
+    expiry_days = config.get('APPROVAL_EXPIRY_DAYS', 0)
+    escalation_days = config.get('APPROVAL_ESCALATION_DAYS', 0)
+    stamp = now.strftime('%d %b %y %H:%M')
+    
+    expired = 0
+    if expiry_days:
+        expired = _update_in_batches(
+            [TaskApprovalRequest.created_at < now - timedelta(days=expiry_days)],
+            {
+                TaskApprovalRequest.status: 'EXPIRED',
+                TaskApprovalRequest.approval_notes: _append_note(f'[{stamp}] Expired automatically after {expiry_days} day(s) without a decision'),
+                TaskApprovalRequest.updated_at: now,
+            },
+            batch_size,
+            'approval_expired',
+            {'after_days': expiry_days},
+            TaskApprovalRequest.status == 'EXPIRED',
+        )
+    
+    escalated = 0
+    if escalation_days:
+        escalated = _update_in_batches(
+            [TaskApprovalRequest.created_at < now - timedelta(days=escalation_days),
+             TaskApprovalRequest.escalated_at.is_(None)],
+            {
+                TaskApprovalRequest.escalated_at: now,
+                TaskApprovalRequest.approval_notes: _append_note(f'[{stamp}] Escalated: pending for more than {escalation_days} day(s)'),
+                TaskApprovalRequest.updated_at: now,
+            },
+            batch_size,
+            'approval_escalated',
+            {'after_days': escalation_days},
+            TaskApprovalRequest.escalated_at.isnot(None),
+        )
+    
+    current_app.logger.info(f"Stale approval requests - Escalated: {escalated}, Expired: {expired}")
+    if escalated or expired:
+        from utils import send_stale_approvals_notification
+        admins = User.query.filter_by(role='admin').all()
+        send_stale_approvals_notification(admins, escalated, expired)
+    return escalated, expired
+
+def send_deadline_reminders(now=None):
+    """Tell assignees about open tasks due within DEADLINE_REMINDER_HOURS and tasks that became
+    overdue (within DEADLINE_OVERDUE_LOOKBACK_DAYS), one digest per assignee.
+    Tasks are found by bounded range scans on the (deadline, status) index and marked in batches,
+    so each task is announced once per deadline. Returns (due_soon, overdue, notified_users)."""
+    now = now or datetime.now()  # Deadlines are entered as local times
+    config = current_app.config
+    batch_size = config.get('DEADLINE_JOB_BATCH_SIZE', 500)
+    reminder_hours = config.get('DEADLINE_REMINDER_HOURS', 0)
+    lookback_days = config.get('DEADLINE_OVERDUE_LOOKBACK_DAYS', 0)
+    
+    windows = []
+    if reminder_hours:
+        windows.append(('due_soon', Task.deadline_reminder_sent_at, now, now + timedelta(hours=reminder_hours)))
+    if lookback_days:
+        windows.append(('overdue', Task.overdue_notified_at, now - timedelta(days=lookback_days), now))
+    
+    digests = {}  # user_id -> {'due_soon': [task, ...], 'overdue': [task, ...]}
+    totals = {'due_soon': 0, 'overdue': 0}
+    for kind, marker, start, end in windows:
+        while True:
+            tasks = db.session.query(Task.id, Task.task_name, Task.priority).filter(
+                Task.deadline >= start, Task.deadline < end,
+                Task.status != 'COMPLETED', marker.is_(None)
+            ).order_by(Task.deadline).limit(batch_size).all()
+            if not tasks:
+                break
+            by_id = {task.id: task for task in tasks}
+            assignees = db.session.query(TaskAssignment.task_id, TaskAssignment.user_id).filter(
+                TaskAssignment.task_id.in_(by_id)
+            ).distinct()
+            for task_id, user_id in assignees:
+                digests.setdefault(user_id, {'due_soon': [], 'overdue': []})[kind].append(by_id[task_id])
+            # Keep updated_at: reminders are not edits
+            Task.query.filter(Task.id.in_(by_id)).update(
+                {marker: now, Task.updated_at: Task.updated_at}, synchronize_session=False
+            )
+            db.session.commit()
+            totals[kind] += len(tasks)
+            if len(tasks) < batch_size:
+                break
+    
+    if digests:
+        from utils import send_deadline_digest_notification
+        users = User.query.options(selectinload(User.fcm_devices)).filter(User.id.in_(digests)).all()
+        for user in users:
+            send_deadline_digest_notification(user, digests[user.id]['due_soon'], digests[user.id]['overdue'])
+    
+    current_app.logger.info(f"Deadline reminders - Due soon: {totals['due_soon']}, Overdue: {totals['overdue']}, Users: {len(digests)}")
+    return totals['due_soon'], totals['overdue'], len(digests)
+
+def generate_recurring_tasks(day=None):
+    """Create the day's instances of active recurring tasks with one bulk INSERT per table.
+    Templates that already have an instance for the day are skipped, so running it again is
+    harmless. Every assignee gets one digest notification. Returns (created, notified_users)."""
+    from task_changes import record_bulk_inserts
+    from inbox import record_assignment_notifications
+    from task_status import record_created_tasks
+    from activity import record_task_activities
+    day = day or date.today()
+    templates = [template for template in RecurringTask.query.options(selectinload(RecurringTask.assignees)).filter(
+        RecurringTask.is_active.is_(True),
+        ~exists().where(Task.recurring_task_id == RecurringTask.id, Task.occurrence_date == day)
+    ) if template.occurs_on(day)]
+    if not templates:
+        return 0, 0
+    
+    department_ids = {template.department_id for template in templates}
+    dept_heads = dict(db.session.query(User.department_id, User.id).filter(
+        User.department_id.in_(department_ids), User.role == 'department_head'
+    ).order_by(User.id.desc()))  # Lowest id wins, like .first()
+    
+    now = datetime.utcnow()
+    try:
+        db.session.execute(insert(Task), [{
+            'task_name': template.task_name,
+            'description': template.description,
+            'priority': template.priority,
+            'status': 'ASSIGNED',
+            'department_id': template.department_id,
+            'created_by_id': template.created_by_id,
+            'client_name': template.client_name,
+            'remark': template.remark,
+            'deadline': datetime.combine(day, template.deadline_time) if template.deadline_time else None,
+            'recurring_task_id': template.id,
+            'occurrence_date': day,
+            'created_at': now,
+            'updated_at': now,
+        } for template in templates])
+    except IntegrityError:
+        # Another run created the same instances first
+        db.session.rollback()
+        current_app.logger.info(f"Recurring tasks - already generated for {day}")
+        return 0, 0
+    
+    template_ids = [template.id for template in templates]
+    task_ids = dict(db.session.query(Task.recurring_task_id, Task.id).filter(
+        Task.recurring_task_id.in_(template_ids), Task.occurrence_date == day
+    ))
+    
+    assignments = {}  # (task_id, user_id) -> assigned_by_id
+    for template in templates:
+        task_id = task_ids[template.id]
+        head_id = dept_heads.get(template.department_id)
+        for user_id in ([head_id] if head_id else []) + [assignee.user_id for assignee in template.assignees]:
+            assignments.setdefault((task_id, user_id), template.created_by_id)
+    
+    db.session.execute(insert(TaskDepartmentAssignment), [
+        {'task_id': task_ids[template.id], 'department_id': template.department_id,
+         'assigned_by_id': template.created_by_id, 'assigned_at': now} for template in templates])
+    db.session.execute(insert(DepartmentTaskCompletion), [
+        {'task_id': task_ids[template.id], 'department_id': template.department_id, 'is_completed': False}
+        for template in templates])
+    if assignments:
+        db.session.execute(insert(TaskAssignment), [
+            {'task_id': task_id, 'user_id': user_id, 'assigned_by_id': assigned_by_id, 'assigned_at': now}
+            for (task_id, user_id), assigned_by_id in assignments.items()])
+    
+    new_task_ids = list(task_ids.values())
+    record_bulk_inserts(db.session, Task, Task.id.in_(new_task_ids))
+    for model in (TaskDepartmentAssignment, DepartmentTaskCompletion, TaskAssignment):
+        record_bulk_inserts(db.session, model, model.task_id.in_(new_task_ids))
+    record_assignment_notifications(db.session, TaskAssignment.task_id.in_(new_task_ids))
+    record_created_tasks(db.session, Task.id.in_(new_task_ids))
+    record_task_activities('task_created', new_task_ids, {'recurring': True, 'occurrence_date': day})
+    db.session.commit()
+    
+    current_app.logger.info(f"Recurring tasks - Generated {len(new_task_ids)} task(s) for {day}, Task IDs: {sorted(new_task_ids)}")
+    
+    # One digest per assignee instead of one push per generated task
+    tasks_by_id = {task.id: task for task in Task.query.filter(Task.id.in_(new_task_ids))}
+    per_user = {}
+    for (task_id, user_id), assigned_by_id in assignments.items():
+        per_user.setdefault(user_id, ([], assigned_by_id))[0].append(tasks_by_id[task_id])
+    if per_user:
+        from utils import send_task_assignments_notification
+        users = {user.id: user for user in User.query.options(selectinload(User.fcm_devices)).filter(
+            User.id.in_(set(per_user) | {assigned_by_id for _, assigned_by_id in per_user.values()}))}
+        for user_id, (tasks, assigned_by_id) in per_user.items():
+            send_task_assignments_notification(users[user_id], tasks, users[assigned_by_id])
+    return len(new_task_ids), len(per_user)
+
+def rollup_task_flow(day=None):
+    """Store lead time, cycle time and time in status for one UTC day (default: yesterday) in
+    TaskFlowDailyStat. The day's rows are replaced, so running it again is harmless. Returns rows written."""
+    import json
+    from task_status import compute_flow_stats, day_bounds
+    day = day or datetime.utcnow().date() - timedelta(days=1)
+    stats = compute_flow_stats(*day_bounds(day))
+    TaskFlowDailyStat.query.filter(TaskFlowDailyStat.day == day).delete(synchronize_session=False)
+    if stats:
+        db.session.execute(insert(TaskFlowDailyStat), [{
+            'day': day,
+            'department_id': department_id,
+            'metric': metric,
+            'status': status,
+            'count': stat['count'],
+            'total_seconds': stat['total_seconds'],
+            'max_seconds': stat['max_seconds'],
+            'histogram': json.dumps(stat['histogram']),
+        } for (department_id, metric, status), stat in stats.items()])
+    db.session.commit()
+    current_app.logger.info(f"Task flow rollup - {len(stats)} row(s) for {day}")
+    return len(stats)
+
+def archive_completed_tasks(now=None):
+    """Move tasks completed and untouched for ARCHIVE_AFTER_DAYS into ArchivedTask, ARCHIVE_JOB_BATCH_SIZE
+    tasks per transaction. Tasks with a pending approval request stay live. Returns the number archived."""
+    from archive import archivable_task_ids, archive_tasks
+    now = now or datetime.utcnow()
+    config = current_app.config
+    after_days = config.get('ARCHIVE_AFTER_DAYS', 0)
+    batch_size = config.get('ARCHIVE_JOB_BATCH_SIZE', 200)
+    if not after_days:
+        return 0
+    cutoff = now - timedelta(days=after_days)
+    total = 0
+    while True:
+        task_ids = archivable_task_ids(cutoff, batch_size)
+        if not task_ids:
+            break
+        total += archive_tasks(task_ids, now)
+        db.session.commit()
+        if len(task_ids) < batch_size:
+            break
+    current_app.logger.info(f"Task archive - Archived {total} task(s) completed before {cutoff:%Y-%m-%d}")
+    return total
+
+def purge_task_changes(now=None):
+    """Delete sync changes older than TASK_CHANGE_RETENTION_DAYS, TASK_CHANGE_PURGE_BATCH_SIZE
+    rows per transaction. The newest change is always kept so cursors and ETag watermarks never
+    go back; clients with an older cursor are told to resync. Returns the number deleted."""
+    config = current_app.config
+    retention_days = config.get('TASK_CHANGE_RETENTION_DAYS', 30)
+    if not retention_days:
+        return 0
+    batch_size = config.get('TASK_CHANGE_PURGE_BATCH_SIZE', 5000)
+    cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    newest = db.session.query(func.max(TaskChange.id)).scalar()
+    total = 0
+    while newest is not None:
+        ids = [row.id for row in db.session.query(TaskChange.id).filter(
+            TaskChange.changed_at < cutoff, TaskChange.id < newest
+        ).order_by(TaskChange.id).limit(batch_size)]
+        if not ids:
+            break
+        total += TaskChange.query.filter(TaskChange.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        if len(ids) < batch_size:
+            break
+    current_app.logger.info(f"Task changes - Purged {total} change(s) older than {retention_days} day(s)")
+    return total
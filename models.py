@@ -10,14 +10,16 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     full_name = db.Column(db.String(200), nullable=False)
     role = db.Column(db.String(50), nullable=False)  # admin, department_head, team_member
-    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id', ondelete='SET NULL'), nullable=True)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     
     department = relationship('Department', back_populates='members')
-    assigned_tasks = relationship('TaskAssignment', primaryjoin='TaskAssignment.user_id == User.id', back_populates='user', cascade='all, delete-orphan')
-    created_tasks = relationship('Task', foreign_keys='Task.created_by_id', back_populates='creator')
-    fcm_devices = relationship('FCMDevice', back_populates='user', cascade='all, delete-orphan')
+    # Child rows are removed by ON DELETE CASCADE in the database, not loaded and deleted one by one
+    assigned_tasks = relationship('TaskAssignment', primaryjoin='TaskAssignment.user_id == User.id', back_populates='user', cascade='all, delete-orphan', passive_deletes=True)
+    # Tasks keep their creator; the database refuses to delete a user who still created tasks
+    created_tasks = relationship('Task', foreign_keys='Task.created_by_id', back_populates='creator', passive_deletes='all')
+    fcm_devices = relationship('FCMDevice', back_populates='user', cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<User {self.username}>'
@@ -28,13 +30,18 @@ class Department(db.Model):
     description = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     
-    members = relationship('User', back_populates='department')
+    # Members are detached (department_id SET NULL) by the database when a department is deleted
+    members = relationship('User', back_populates='department', passive_deletes=True)
     head = relationship('User', uselist=False, primaryjoin='and_(Department.id==User.department_id, User.role=="department_head")', overlaps="department,members", viewonly=True)
-    tasks = relationship('Task', back_populates='department')
+    # Tasks must be moved or deleted before their primary department can be deleted
+    tasks = relationship('Task', back_populates='department', passive_deletes='all')
     
     def __repr__(self):
         return f'<Department {self.name}>'
 
+TASK_STATUSES = ('ASSIGNED', 'PENDING', 'COMPLETED', 'Review with ADMIN', 'Waiting for approval from Client')
+TASK_PRIORITIES = ('URGENT', 'IMPORTANT', 'DAILY TASK')
+
 class Task(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     task_name = db.Column(db.String(300), nullable=False)
@@ -49,24 +56,103 @@ class Task(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     
+    # Set by `flask send-deadline-reminders` so each task is announced once; cleared when the deadline changes
+    deadline_reminder_sent_at = db.Column(db.DateTime, nullable=True)
+    overdue_notified_at = db.Column(db.DateTime, nullable=True)
+    
+    # Instances generated from a RecurringTask template, one per template and day
+    recurring_task_id = db.Column(db.Integer, db.ForeignKey('recurring_task.id', ondelete='SET NULL'), nullable=True)
+    occurrence_date = db.Column(db.Date, nullable=True)
+    
+    # Subtask progress for dashboards, kept in step by utils.refresh_subtask_counts()
+    subtasks_total = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    subtasks_done = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    # Optimistic concurrency: ORM updates check and bump it, so a write based on a stale read
+    # fails with StaleDataError instead of overwriting a concurrent change
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    
+    __table_args__ = (
+        # Deadline reminders and the overdue filter are range scans on deadline
+        db.Index('ix_task_deadline_status', 'deadline', 'status'),
+        # Makes `flask generate-recurring-tasks` idempotent per day
+        db.Index('ux_task_recurring_task_occurrence', 'recurring_task_id', 'occurrence_date', unique=True),
+        # `flask archive-tasks` looks for completed tasks untouched since a cutoff
+        db.Index('ix_task_status_updated_at', 'status', 'updated_at'),
+        # Never hand out the id of a deleted or archived task again (SQLite reuses the highest
+        # INTEGER PRIMARY KEY otherwise); archive rows, activity and sync history refer to it
+        {'sqlite_autoincrement': True},
+    )
+    __mapper_args__ = {'version_id_col': version_id}
+    
     department = relationship('Department', back_populates='tasks')
     creator = relationship('User', foreign_keys=[created_by_id], back_populates='created_tasks')
-    assignments = relationship('TaskAssignment', back_populates='task', cascade='all, delete-orphan')
-    subtasks = relationship('Subtask', back_populates='task', cascade='all, delete-orphan')
-    department_assignments = relationship('TaskDepartmentAssignment', back_populates='task', cascade='all, delete-orphan')
-    department_completions = relationship('DepartmentTaskCompletion', back_populates='task', cascade='all, delete-orphan')
-    approval_requests = relationship('TaskApprovalRequest', back_populates='task', cascade='all, delete-orphan')
+    # Child rows are removed by ON DELETE CASCADE in the database, not loaded and deleted one by one
+    assignments = relationship('TaskAssignment', back_populates='task', cascade='all, delete-orphan', passive_deletes=True)
+    subtasks = relationship('Subtask', back_populates='task', cascade='all, delete-orphan', passive_deletes=True)
+    department_assignments = relationship('TaskDepartmentAssignment', back_populates='task', cascade='all, delete-orphan', passive_deletes=True)
+    department_completions = relationship('DepartmentTaskCompletion', back_populates='task', cascade='all, delete-orphan', passive_deletes=True)
+    approval_requests = relationship('TaskApprovalRequest', back_populates='task', cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<Task {self.task_name}>'
 
+class RecurringTask(db.Model):
+    """Template for tasks that are recreated every day (or on given weekdays) by `flask generate-recurring-tasks`"""
+    id = db.Column(db.Integer, primary_key=True)
+    task_name = db.Column(db.String(300), nullable=False)
+    description = db.Column(db.Text, nullable=True)
+    priority = db.Column(db.String(50), nullable=False, default='DAILY TASK')
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id', ondelete='CASCADE'), nullable=False)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    client_name = db.Column(db.String(200), nullable=True)
+    remark = db.Column(db.Text, nullable=True)
+    frequency = db.Column(db.String(20), nullable=False, default='DAILY')  # DAILY, WEEKLY
+    weekdays = db.Column(db.String(20), nullable=True)  # WEEKLY: comma-separated weekday numbers, 0 = Monday
+    deadline_time = db.Column(db.Time, nullable=True)  # Deadline on the day of each instance
+    is_active = db.Column(db.Boolean, default=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    department = relationship('Department')
+    creator = relationship('User', foreign_keys=[created_by_id])
+    assignees = relationship('RecurringTaskAssignee', back_populates='recurring_task', cascade='all, delete-orphan', passive_deletes=True)
+    
+    @property
+    def weekday_list(self):
+        return [int(day) for day in (self.weekdays or '').split(',') if day.strip().isdigit()]
+    
+    def occurs_on(self, day):
+        if self.frequency == 'WEEKLY':
+            return day.weekday() in self.weekday_list
+        return True
+    
+    def __repr__(self):
+        return f'<RecurringTask {self.task_name} {self.frequency}>'
+
+class RecurringTaskAssignee(db.Model):
+    """Users assigned to every instance of a recurring task (besides the department head)"""
+    id = db.Column(db.Integer, primary_key=True)
+    recurring_task_id = db.Column(db.Integer, db.ForeignKey('recurring_task.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    
+    recurring_task = relationship('RecurringTask', back_populates='assignees')
+    user = relationship('User')
+    
+    __table_args__ = (db.UniqueConstraint('recurring_task_id', 'user_id', name='unique_recurring_task_assignee'),)
+    
+    def __repr__(self):
+        return f'<RecurringTaskAssignee recurring_task_id={self.recurring_task_id} user_id={self.user_id}>'
+
 class TaskAssignment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     assigned_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     assigned_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
+    # Workload counts group a user's assignments by task
+    __table_args__ = (db.Index('ix_task_assignment_user_id_task_id', 'user_id', 'task_id'),)
+    
     task = relationship('Task', back_populates='assignments')
     user = relationship('User', foreign_keys=[user_id], back_populates='assigned_tasks')
     assigned_by = relationship('User', foreign_keys=[assigned_by_id])
@@ -76,7 +162,7 @@ class TaskAssignment(db.Model):
 
 class Subtask(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id', ondelete='CASCADE'), nullable=False)
     subtask_name = db.Column(db.String(300), nullable=False)
     description = db.Column(db.Text, nullable=True)
     status = db.Column(db.String(50), nullable=False, default='PENDING')  # COMPLETED, PENDING
@@ -87,14 +173,17 @@ class Subtask(db.Model):
     task = relationship('Task', back_populates='subtasks')
     creator = relationship('User', foreign_keys=[created_by_id])
     
+    # Subtask progress counts per task
+    __table_args__ = (db.Index('ix_subtask_task_id_status', 'task_id', 'status'),)
+    
     def __repr__(self):
         return f'<Subtask {self.subtask_name}>'
 
 class TaskDepartmentAssignment(db.Model):
     """Tracks which departments are assigned to work on a task"""
     id = db.Column(db.Integer, primary_key=True)
-    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
-    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id', ondelete='CASCADE'), nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id', ondelete='CASCADE'), nullable=False)
     assigned_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     assigned_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
@@ -110,17 +199,19 @@ class TaskDepartmentAssignment(db.Model):
 class DepartmentTaskCompletion(db.Model):
     """Tracks completion status for each department assigned to a task"""
     id = db.Column(db.Integer, primary_key=True)
-    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
-    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id', ondelete='CASCADE'), nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id', ondelete='CASCADE'), nullable=False)
     is_completed = db.Column(db.Boolean, default=False, nullable=False)
     completed_at = db.Column(db.DateTime, nullable=True)
-    completed_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    completed_by_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     
     task = relationship('Task', back_populates='department_completions')
     department = relationship('Department')
     completed_by = relationship('User', foreign_keys=[completed_by_id])
     
     __table_args__ = (db.UniqueConstraint('task_id', 'department_id', name='unique_task_department_completion'),)
+    __mapper_args__ = {'version_id_col': version_id}
     
     def __repr__(self):
         return f'<DepartmentTaskCompletion task_id={self.task_id} department_id={self.department_id} is_completed={self.is_completed}>'
@@ -128,35 +219,67 @@ class DepartmentTaskCompletion(db.Model):
 class TaskApprovalRequest(db.Model):
     """Tracks approval requests for department head actions"""
     id = db.Column(db.Integer, primary_key=True)
-    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id', ondelete='CASCADE'), nullable=False)
     request_type = db.Column(db.String(50), nullable=False)  # 'reassign' or 'assign_departments'
     requested_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    status = db.Column(db.String(50), nullable=False, default='PENDING')  # PENDING, APPROVED, REJECTED
-    approved_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    status = db.Column(db.String(50), nullable=False, default='PENDING')  # PENDING, APPROVED, REJECTED, EXPIRED
+    approved_by_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
     approval_notes = db.Column(db.Text, nullable=True)
+    escalated_at = db.Column(db.DateTime, nullable=True)  # Set by `flask expire-approvals` when a request waits too long
     
     # For reassign requests
-    new_dept_head_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    new_dept_head_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
     
-    # For assign_departments requests - stored as JSON or separate table
-    # We'll use a JSON field or create a separate table for requested departments
-    requested_department_ids = db.Column(db.Text, nullable=True)  # JSON array of department IDs
+    # Legacy JSON array of department IDs for assign_departments requests. No longer written:
+    # superseded by requested_departments and backfilled by `flask upgrade-db`
+    requested_department_ids = db.Column(db.Text, nullable=True)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     
+    # The approvals queue pages through pending requests newest first
+    __table_args__ = (db.Index('ix_task_approval_request_status_id', 'status', 'id'),)
+    
     task = relationship('Task', back_populates='approval_requests')
     requested_by = relationship('User', foreign_keys=[requested_by_id])
     approved_by = relationship('User', foreign_keys=[approved_by_id])
     new_dept_head = relationship('User', foreign_keys=[new_dept_head_id])
+    # For assign_departments requests
+    requested_departments = relationship('TaskApprovalRequestDepartment', back_populates='approval_request', cascade='all, delete-orphan', passive_deletes=True)
+    
+    @property
+    def requested_department_id_list(self):
+        return [d.department_id for d in self.requested_departments]
+    
+    def set_requested_departments(self, department_ids):
+        """Replace the requested departments, keeping rows that are still requested"""
+        existing = {d.department_id: d for d in self.requested_departments}
+        self.requested_departments = [
+            existing.get(department_id) or TaskApprovalRequestDepartment(department_id=department_id)
+            for department_id in sorted(set(department_ids))
+        ]
     
     def __repr__(self):
         return f'<TaskApprovalRequest task_id={self.task_id} type={self.request_type} status={self.status}>'
 
+class TaskApprovalRequestDepartment(db.Model):
+    """Departments requested by an assign_departments approval request"""
+    id = db.Column(db.Integer, primary_key=True)
+    approval_request_id = db.Column(db.Integer, db.ForeignKey('task_approval_request.id', ondelete='CASCADE'), nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id', ondelete='CASCADE'), nullable=False, index=True)
+    
+    approval_request = relationship('TaskApprovalRequest', back_populates='requested_departments')
+    department = relationship('Department')
+    
+    __table_args__ = (db.UniqueConstraint('approval_request_id', 'department_id', name='unique_approval_request_department'),)
+    
+    def __repr__(self):
+        return f'<TaskApprovalRequestDepartment approval_request_id={self.approval_request_id} department_id={self.department_id}>'
+
 class FCMDevice(db.Model):
     """Stores FCM tokens for user devices"""
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     fcm_token = db.Column(db.String(500), nullable=False, unique=True, index=True)
     device_name = db.Column(db.String(200), nullable=True)  # e.g., "John's iPhone", "Samsung Galaxy"
     device_type = db.Column(db.String(50), nullable=True)  # e.g., "android", "ios", "web"
@@ -168,3 +291,162 @@ class FCMDevice(db.Model):
     def __repr__(self):
         return f'<FCMDevice user_id={self.user_id} device={self.device_name}>'
 
+class Notification(db.Model):
+    """In-app notification inbox. Pushes only carry the notification id; the app reads the rest here."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    notification_type = db.Column(db.String(50), nullable=False)  # task_assigned, task_deadlines, approvals_digest
+    title = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=True)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id', ondelete='CASCADE'), nullable=True)
+    data = db.Column(db.Text, nullable=True)  # JSON object with details for the app
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    read_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        # Unread counts and mark-read; the inbox pages newest first by id
+        db.Index('ix_notification_user_id_read_at', 'user_id', 'read_at'),
+        db.Index('ix_notification_user_id_id', 'user_id', 'id'),
+    )
+    
+    def __repr__(self):
+        return f'<Notification user_id={self.user_id} type={self.notification_type}>'
+
+class TaskChange(db.Model):
+    """Append-only log of changes to tasks and their child rows; the id is the sync cursor"""
+    id = db.Column(db.Integer, primary_key=True)
+    entity_type = db.Column(db.String(50), nullable=False)  # task, assignment, subtask, completion, department_assignment, approval
+    entity_id = db.Column(db.Integer, nullable=False)
+    task_id = db.Column(db.Integer, nullable=True)  # No foreign key: tombstones outlive the task
+    operation = db.Column(db.String(10), nullable=False)  # upsert, delete
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # JSON {"department_ids": [...], "user_ids": [...]}: who may have lost sight of the task through
+    # this change (the audience of a deleted task, a removed assignee, the previous department)
+    former_audience = db.Column(db.Text, nullable=True)
+    
+    __table_args__ = (db.Index('ix_task_change_task_id_id', 'task_id', 'id'),)
+    
+    def __repr__(self):
+        return f'<TaskChange {self.id} {self.operation} {self.entity_type}={self.entity_id}>'
+
+class ActivityEvent(db.Model):
+    """Append-only structured activity log ("who changed this"), written by activity.py in the
+    same transaction as the change it describes"""
+    id = db.Column(db.Integer, primary_key=True)
+    action = db.Column(db.String(50), nullable=False)  # task_created, task_updated, task_deleted, status_changed, ...
+    task_id = db.Column(db.Integer, nullable=True)  # No foreign keys: the history outlives the task, department and actor
+    department_id = db.Column(db.Integer, nullable=True)
+    actor_id = db.Column(db.Integer, nullable=True)  # None for scheduled jobs
+    details = db.Column(db.Text, nullable=True)  # JSON object, e.g. {"status": ["ASSIGNED", "PENDING"]}
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        # Per-task and per-department feeds page newest first by id
+        db.Index('ix_activity_event_task_id_id', 'task_id', 'id'),
+        db.Index('ix_activity_event_department_id_id', 'department_id', 'id'),
+    )
+    
+    def __repr__(self):
+        return f'<ActivityEvent {self.id} {self.action} task_id={self.task_id}>'
+
+class TaskStatusEvent(db.Model):
+    """Append-only history of task status transitions, written only by task_status.py"""
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id', ondelete='CASCADE'), nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id', ondelete='CASCADE'), nullable=False)  # Task department at the time
+    from_status = db.Column(db.String(50), nullable=True)  # None for the creation of the task
+    to_status = db.Column(db.String(50), nullable=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    changed_by_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
+    
+    __table_args__ = (
+        # Daily rollups scan one day of transitions; each task's history is read in order
+        db.Index('ix_task_status_event_changed_at', 'changed_at'),
+        db.Index('ix_task_status_event_task_id_changed_at', 'task_id', 'changed_at'),
+    )
+    
+    def __repr__(self):
+        return f'<TaskStatusEvent task_id={self.task_id} {self.from_status} -> {self.to_status}>'
+
+class TaskFlowDailyStat(db.Model):
+    """Nightly rollup of lead time, cycle time and time in status per department and day.
+    Durations are kept as histogram bucket counts so days can be merged into percentiles."""
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id', ondelete='CASCADE'), nullable=False)
+    metric = db.Column(db.String(20), nullable=False)  # lead_time, cycle_time, time_in_status
+    status = db.Column(db.String(50), nullable=False, default='')  # Status measured by time_in_status, '' otherwise
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total_seconds = db.Column(db.Float, nullable=False, default=0)
+    max_seconds = db.Column(db.Float, nullable=False, default=0)
+    histogram = db.Column(db.Text, nullable=False)  # JSON list of counts per task_status.DURATION_BUCKETS_HOURS bucket
+    
+    __table_args__ = (db.UniqueConstraint('day', 'department_id', 'metric', 'status', name='unique_task_flow_daily_stat'),)
+    
+    def __repr__(self):
+        return f'<TaskFlowDailyStat {self.day} department_id={self.department_id} {self.metric} {self.status}>'
+
+class ArchivedTask(db.Model):
+    """Completed task moved out of the live tables by `flask archive-tasks` (see archive.py).
+    task_id is the original task id; the child rows are kept in details as one JSON document."""
+    id = db.Column(db.Integer, primary_key=True)
+    # Not unique: a database that reuses ids (SQLite tables created before AUTOINCREMENT, MySQL < 8.0
+    # after a restart) can archive two tasks with the same id. NULL only until `flask upgrade-db`.
+    task_id = db.Column(db.Integer, nullable=True)
+    task_name = db.Column(db.String(300), nullable=False)
+    description = db.Column(db.Text, nullable=True)
+    priority = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(50), nullable=False)
+    department_id = db.Column(db.Integer, nullable=False)  # No foreign keys: archived rows outlive departments and users
+    created_by_id = db.Column(db.Integer, nullable=False)
+    client_name = db.Column(db.String(200), nullable=True)
+    deadline = db.Column(db.DateTime, nullable=True)
+    remark = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+    completed_at = db.Column(db.DateTime, nullable=False)  # Last move to COMPLETED (updated_at for tasks without history)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # {"assignments": [...], "subtasks": [...], "department_assignments": [...], "completions": [...],
+    #  "approval_requests": [...], "status_history": [...]}
+    details = db.Column(db.Text, nullable=False)
+    
+    __table_args__ = (
+        # Archive search pages newest first by id, optionally within a department
+        db.Index('ix_archived_task_department_id_id', 'department_id', 'id'),
+        db.Index('ix_archived_task_completed_at', 'completed_at'),
+        db.Index('ix_archived_task_task_id', 'task_id'),
+    )
+    
+    @property
+    def children(self):
+        import json
+        return json.loads(self.details) if self.details else {}
+    
+    def __repr__(self):
+        return f'<ArchivedTask {self.task_name}>'
+
+class IdempotencyKey(db.Model):
+    """Key of a create request and the task it created, so a repeated request gets the same task (see idempotency.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    endpoint = db.Column(db.String(100), nullable=False)  # e.g. admin.create_task
+    key = db.Column(db.String(64), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id', ondelete='CASCADE'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        # The second of two concurrent requests with the same key fails here and is rolled back
+        db.UniqueConstraint('user_id', 'endpoint', 'key', name='unique_idempotency_key'),
+        db.Index('ix_idempotency_key_created_at', 'created_at'),
+    )
+    
+    def __repr__(self):
+        return f'<IdempotencyKey {self.endpoint} user_id={self.user_id} task_id={self.task_id}>'
+
+class Counter(db.Model):
+    """Denormalized counts (e.g. pending approvals) kept in step with their rows in the same transaction"""
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<Counter {self.name}={self.value}>'
@@ -0,0 +1,81 @@
+"""
+Coalescing of task assignment notifications.
+
+Assignment bursts (forwarding or bulk-assigning many tasks) used to send one push per task.
+Assignments are now buffered per recipient for NOTIFICATION_COALESCE_SECONDS; when the
+window closes the recipient gets a single notification: the normal "New Task Assigned"
+push for one task, or an "N New Tasks Assigned" digest carrying the task IDs.
+The buffer lives in the worker process, which is where a burst from one request lands.
+"""
+import atexit
+import threading
+from types import SimpleNamespace
+from flask import current_app
+
+class NotificationCoalescer:
+    """Buffers task assignment notifications per user and sends one notification per window"""
+
+    def __init__(self, app, window_seconds):
+        self._app = app
+        self._window = window_seconds
+        self._lock = threading.Lock()
+        self._pending = {}  # user_id -> {'assigned_by_id', 'tasks': {task_id: (task_name, priority)}, 'timer'}
+
+    def add(self, user, task, assigned_by):
+        if self._window <= 0:
+            from utils import send_task_assignment_notification
+            return send_task_assignment_notification(user, task, assigned_by)
+        with self._lock:
+            entry = self._pending.get(user.id)
+            if entry is None:
+                timer = threading.Timer(self._window, self.flush, args=(user.id,))
+                timer.daemon = True
+                entry = self._pending[user.id] = {'assigned_by_id': assigned_by.id, 'tasks': {}, 'timer': timer}
+                timer.start()
+            entry['tasks'][task.id] = (task.task_name, task.priority)
+        return True
+
+    def pending_user_ids(self):
+        with self._lock:
+            return set(self._pending)
+
+    def flush(self, user_id):
+        """Send the buffered notification for one user now"""
+        with self._lock:
+            entry = self._pending.pop(user_id, None)
+        if entry is None:
+            return False
+        entry['timer'].cancel()
+        tasks = [SimpleNamespace(id=task_id, task_name=task_name, priority=priority)
+                 for task_id, (task_name, priority) in entry['tasks'].items()]
+        # Runs on the timer thread: load the users in a fresh app context and session
+        with self._app.app_context():
+            from extensions import db
+            from models import User
+            from utils import send_task_assignments_notification
+            try:
+                user = db.session.get(User, user_id)
+                assigned_by = db.session.get(User, entry['assigned_by_id']) or user
+                if user is None:
+                    return False
+                return send_task_assignments_notification(user, tasks, assigned_by)
+            except Exception as e:
+                self._app.logger.error(f"FCM Notification Coalescing - EXCEPTION - User ID: {user_id}, Tasks: {len(tasks)}, Error: {str(e)}")
+                return False
+            finally:
+                db.session.remove()
+
+    def flush_all(self):
+        for user_id in self.pending_user_ids():
+            self.flush(user_id)
+
+def init_notification_queue(app):
+    """Create the coalescer for this app; buffered notifications are sent on interpreter exit"""
+    coalescer = NotificationCoalescer(app, app.config.get('NOTIFICATION_COALESCE_SECONDS', 0))
+    app.extensions['notification_queue'] = coalescer
+    atexit.register(coalescer.flush_all)
+    return coalescer
+
+def queue_task_assignment_notification(user, task, assigned_by):
+    """Coalescing front for send_task_assignment_notification (sends at once when the window is 0)"""
+    return current_app.extensions['notification_queue'].add(user, task, assigned_by)
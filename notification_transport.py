@@ -0,0 +1,109 @@
+"""
+Push notification transports used by fcm_service.
+
+The Firebase transport is fcm_service.NotificationClient, shared by the whole process.
+FakeTransport is an in-process stand-in for development and load tests (see
+bench_notifications.py): it never leaves the process and can simulate network latency,
+per-token errors and a send quota. Select it with NOTIFICATION_TRANSPORT=fake.
+"""
+import random
+import threading
+import time
+from collections import deque
+from flask import current_app
+
+class TransportUnavailable(Exception):
+    """The transport is not configured (e.g. no Firebase credentials)"""
+
+class QuotaExceeded(Exception):
+    """The provider refused the message because the send quota was used up"""
+
+class FakeTransport:
+    """In-process FCM stand-in with simulated latency, per-token errors and a per-second quota.
+    Tokens in failing_tokens, or starting with 'invalid', always fail; others fail with error_rate."""
+    name = 'fake'
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, quota_per_second=0,
+                 failing_tokens=(), seed=None, history_size=10000):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.quota_per_second = quota_per_second
+        self.failing_tokens = set(failing_tokens)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._next_id = 0
+        self.sent = deque(maxlen=history_size)  # (token, title, body, data) of delivered messages
+        self.calls = 0
+        self.failures = 0
+        self.call_seconds = deque(maxlen=history_size)
+
+    def _take_quota(self, count):
+        if not self.quota_per_second:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 1:
+                self._window_start, self._window_count = now, 0
+            if self._window_count + count > self.quota_per_second:
+                raise QuotaExceeded(f'Quota of {self.quota_per_second} messages/second exceeded')
+            self._window_count += count
+
+    def _simulate_call(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency_ms + (self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _deliver(self, token, title, body, data):
+        with self._lock:
+            failed = token in self.failing_tokens or token.startswith('invalid') or (
+                self.error_rate and self._random.random() < self.error_rate)
+            if failed:
+                self.failures += 1
+                return None
+            self._next_id += 1
+            self.sent.append((token, title, body, data))
+            return f'fake-message-{self._next_id}'
+
+    def send(self, token, title, body, data):
+        started = time.perf_counter()
+        try:
+            self._simulate_call()
+            self._take_quota(1)
+            message_id = self._deliver(token, title, body, data)
+            if message_id is None:
+                raise ValueError(f'Requested entity was not found (token {token[:20]})')
+            return message_id
+        finally:
+            self.call_seconds.append(time.perf_counter() - started)
+
+    def send_multicast(self, tokens, title, body, data):
+        started = time.perf_counter()
+        try:
+            self._simulate_call()
+            self._take_quota(len(tokens))
+            delivered = sum(1 for token in tokens if self._deliver(token, title, body, data))
+            return delivered, len(tokens) - delivered
+        finally:
+            self.call_seconds.append(time.perf_counter() - started)
+
+def init_notification_transport(app):
+    """Create the transport selected by NOTIFICATION_TRANSPORT ('firebase' or 'fake')"""
+    if app.config.get('NOTIFICATION_TRANSPORT', 'firebase') == 'fake':
+        transport = FakeTransport(
+            latency_ms=app.config.get('FAKE_FCM_LATENCY_MS', 0),
+            error_rate=app.config.get('FAKE_FCM_ERROR_RATE', 0),
+            quota_per_second=app.config.get('FAKE_FCM_QUOTA_PER_SECOND', 0),
+        )
+    else:
+        from fcm_service import get_notification_client
+        transport = get_notification_client()
+    app.extensions['notification_transport'] = transport
+    return transport
+
+def get_notification_transport():
+    return current_app.extensions['notification_transport']
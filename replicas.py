@@ -0,0 +1,148 @@
+"""
+Read replicas for dashboard and analytics reads.
+
+DATABASE_REPLICA_URLS lists replica databases (comma-separated); each gets an engine named
+replica_0, replica_1, ... with the primary's engine options. They are kept out of
+SQLALCHEMY_BINDS so create_all() and `flask upgrade-db` never touch them. Views decorated with
+@replica_read run their SELECTs on a replica when the request is a GET/HEAD (the routing is
+done by extensions.RoutingSession). Everything else, and any write issued while such a view
+runs (flush, INSERT/UPDATE/DELETE), goes to the primary, and the rest of that request stays on
+the primary.
+
+Read-your-writes: a request that wrote to the primary keeps its user on the primary for
+REPLICA_STICKY_SECONDS (a timestamp in the signed session cookie), so a user never sees a
+dashboard older than their own last change.
+
+Lag: every REPLICA_LAG_CHECK_SECONDS a worker compares the TaskChange log (append-only, written
+by every task change) of each replica with the primary. A replica's lag is the age of the oldest
+change it has not received yet. Replicas further behind than REPLICA_MAX_LAG_SECONDS, or that
+cannot be reached, are skipped until the next check; with none left, reads use the primary.
+
+Local testing works with two SQLite files (copy the primary file over the replica file to
+"replicate") or two MySQL instances; see README.
+"""
+import itertools
+import os
+import threading
+import time
+from datetime import datetime
+from functools import wraps
+from flask import current_app, request, session
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import StaticPool
+from extensions import db, REPLICA_INFO_KEY, WROTE_INFO_KEY
+from models import TaskChange
+
+STICKY_SESSION_KEY = 'db_primary_until'
+
+def create_replica_engine(app, url):
+    """Engine for one replica URL, with the primary's engine options and the same SQLite
+    handling as Flask-SQLAlchemy (relative files in the instance folder, shared in-memory database)"""
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    url = make_url(url)
+    if url.drivername.startswith('sqlite'):
+        if url.database in (None, '', ':memory:'):
+            options.update(poolclass=StaticPool, connect_args={'check_same_thread': False})
+        elif not os.path.isabs(url.database):
+            os.makedirs(app.instance_path, exist_ok=True)
+            url = url.set(database=os.path.join(app.instance_path, url.database))
+    return create_engine(url, **options)
+
+def replica_lag(engine, now=None):
+    """Seconds the replica is behind the primary (0 when it has every change); raises if unreachable"""
+    with engine.connect() as connection:
+        replicated = connection.execute(select(func.max(TaskChange.id))).scalar() or 0
+    with db.engine.connect() as connection:
+        oldest_missing = connection.execute(
+            select(func.min(TaskChange.changed_at)).where(TaskChange.id > replicated)).scalar()
+    if oldest_missing is None:
+        return 0.0
+    return max(((now or datetime.utcnow()) - oldest_missing).total_seconds(), 0.0)
+
+class ReplicaRouter:
+    """Replica engines of one app, their health (refreshed at most every check_seconds per
+    process) and round-robin choice between the healthy ones"""
+    
+    def __init__(self, engines, max_lag_seconds, check_seconds):
+        self.engines = dict(engines)  # name -> engine
+        self.max_lag_seconds = max_lag_seconds
+        self.check_seconds = check_seconds
+        self.lag = {}  # name -> seconds behind, None if unreachable
+        self._healthy = []
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+    
+    def check(self):
+        lag = {}
+        for name, engine in self.engines.items():
+            try:
+                lag[name] = replica_lag(engine)
+            except Exception as e:
+                current_app.logger.warning(f'Replica {name} unavailable, reading from the primary: {e}')
+                lag[name] = None
+        self.lag = lag
+        self._healthy = [name for name in self.engines if lag[name] is not None and lag[name] <= self.max_lag_seconds]
+        self._checked_at = time.monotonic()
+        return lag
+    
+    def choose(self):
+        """Engine of a replica to read from, or None for the primary"""
+        if not self.engines:
+            return None
+        if self._checked_at is None or time.monotonic() - self._checked_at >= self.check_seconds:
+            # One thread refreshes; the others use the previous result meanwhile
+            if self._lock.acquire(blocking=self._checked_at is None):
+                try:
+                    self.check()
+                finally:
+                    self._lock.release()
+        healthy = self._healthy
+        if not healthy:
+            return None
+        return self.engines[healthy[next(self._turn) % len(healthy)]]
+
+def init_replicas(app):
+    """Replica engines from DATABASE_REPLICA_URLS, and read-your-writes stickiness after writes"""
+    urls = app.config.get('DATABASE_REPLICA_URLS') or []
+    app.extensions['replica_router'] = ReplicaRouter(
+        {f'replica_{index}': create_replica_engine(app, url) for index, url in enumerate(urls)},
+        max_lag_seconds=app.config.get('REPLICA_MAX_LAG_SECONDS', 30),
+        check_seconds=app.config.get('REPLICA_LAG_CHECK_SECONDS', 5),
+    )
+
+    @app.before_request
+    def forget_earlier_writes():
+        db.session.info.pop(WROTE_INFO_KEY, None)
+    
+    @app.after_request
+    def remember_primary_write(response):
+        wrote = db.session.info.pop(WROTE_INFO_KEY, False)
+        if wrote and app.extensions['replica_router'].engines:
+            session[STICKY_SESSION_KEY] = time.time() + app.config.get('REPLICA_STICKY_SECONDS', 10)
+        return response
+
+def reading_from_replica():
+    """True while a @replica_read view runs on a replica (rows may lag behind the primary)"""
+    return db.session.info.get(REPLICA_INFO_KEY) is not None
+
+def get_replica_router():
+    return current_app.extensions['replica_router']
+
+def replica_read(f):
+    """Run a read-only GET view against a replica when one is configured, healthy and the user
+    has not written recently. Place it after login/role checks."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        engine = None
+        if request.method in ('GET', 'HEAD') and session.get(STICKY_SESSION_KEY, 0) <= time.time():
+            engine = get_replica_router().choose()
+        if engine is None:
+            return f(*args, **kwargs)
+        db.session.info[REPLICA_INFO_KEY] = engine
+        try:
+            return f(*args, **kwargs)
+        finally:
+            db.session.info.pop(REPLICA_INFO_KEY, None)
+    return decorated_function
@@ -0,0 +1,40 @@
+from flask import Blueprint, request, jsonify
+from flask_login import login_required, current_user
+from models import db, Task, ActivityEvent
+from utils import can_access_task
+from activity import ACTIVITY_PAGE_SIZE, activity_feed
+
+activity_bp = Blueprint('activity', __name__)
+
+def _page_args():
+    limit = min(max(request.args.get('limit', ACTIVITY_PAGE_SIZE, type=int), 1), ACTIVITY_PAGE_SIZE)
+    return request.args.get('before', type=int), limit
+
+@activity_bp.route('/tasks/<int:task_id>', methods=['GET'])
+@login_required
+def task_activity(task_id):
+    """Activity of one task, newest first. Page with ?before=<id> (the previous page's next_before).
+    The history of a deleted task is only visible to admins."""
+    task = db.session.get(Task, task_id)
+    allowed = can_access_task(current_user, task) if task is not None else current_user.role == 'admin'
+    if not allowed:
+        return jsonify({'success': False, 'message': 'You do not have permission to access this task'}), 403
+    criteria = [ActivityEvent.task_id == task_id]
+    if task is not None:
+        # Events of an earlier task that had the same id (ids of databases created before
+        # AUTOINCREMENT can be reused) are older than this task
+        criteria.append(ActivityEvent.created_at >= task.created_at)
+    before, limit = _page_args()
+    events, next_before = activity_feed(*criteria, before=before, limit=limit)
+    return jsonify({'success': True, 'events': events, 'next_before': next_before}), 200
+
+@activity_bp.route('/departments/<int:department_id>', methods=['GET'])
+@login_required
+def department_activity(department_id):
+    """Activity of the tasks of one department, newest first (admins and that department's head)"""
+    if not (current_user.role == 'admin' or
+            (current_user.role == 'department_head' and current_user.department_id == department_id)):
+        return jsonify({'success': False, 'message': 'You do not have permission to access this department'}), 403
+    before, limit = _page_args()
+    events, next_before = activity_feed(ActivityEvent.department_id == department_id, before=before, limit=limit)
+    return jsonify({'success': True, 'events': events, 'next_before': next_before}), 200
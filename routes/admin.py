@@ -1,14 +1,25 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
-from models import db, User, Department, Task, TaskAssignment, Subtask, TaskDepartmentAssignment, DepartmentTaskCompletion, TaskApprovalRequest
+from models import db, User, Department, Task, TaskAssignment, Subtask, TaskDepartmentAssignment, DepartmentTaskCompletion, TaskApprovalRequest, TaskApprovalRequestDepartment, RecurringTask, RecurringTaskAssignee, ArchivedTask, TASK_STATUSES, TASK_PRIORITIES
 from extensions import bcrypt
-from utils import admin_required
-from datetime import datetime
-from sqlalchemy import or_
-import json
+from task_status import set_task_statuses, flow_analytics
+from activity import record_activity, record_task_activities, record_status_changes, changed_fields
+from archive import search_archived_tasks
+from replicas import replica_read
+from idempotency import new_idempotency_key, request_idempotency_key, find_idempotent_result, remember_idempotent_result, commit_or_replay
+from utils import admin_required, parse_id_list, filter_accessible_task_ids, update_task_completion_statuses, conditional_view, overdue_tasks_clause, get_pending_approvals_count, adjust_pending_approvals_count, user_workloads, conflict_response
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.exc import IntegrityError
 
 admin_bp = Blueprint('admin', __name__)
 
+APPROVALS_PAGE_SIZE = 50
+# Databases created before the ON DELETE rules were added refuse to delete tasks with child rows
+TASK_DELETE_SCHEMA_ERROR = 'Could not delete: the database schema is out of date. Run "flask upgrade-db" and try again.'
+TASK_EDIT_FIELDS = ['task_name', 'description', 'priority', 'department_id', 'client_name', 'remark', 'deadline']
+
 def _update_task_completion_status(task):
     """Update task status to COMPLETED only if all assigned departments have completed"""
     dept_assignments = TaskDepartmentAssignment.query.filter_by(task_id=task.id).all()
@@ -39,6 +50,8 @@ def _update_task_completion_status(task):
 @admin_bp.route('/dashboard')
 @login_required
 @admin_required
+@replica_read
+@conditional_view
 def dashboard():
     # Get all tasks with filters
     tasks_query = Task.query
@@ -49,6 +62,7 @@ def dashboard():
     department_id = request.args.get('department_id', '')
     client_name = request.args.get('client_name', '')
     priority = request.args.get('priority', '')
+    overdue = request.args.get('overdue', '')
     
     if task_name:
         tasks_query = tasks_query.filter(Task.task_name.ilike(f'%{task_name}%'))
@@ -60,22 +74,27 @@ def dashboard():
         tasks_query = tasks_query.filter(Task.client_name.ilike(f'%{client_name}%'))
     if priority:
         tasks_query = tasks_query.filter(Task.priority == priority)
+    if overdue:
+        tasks_query = tasks_query.filter(overdue_tasks_clause())
     
     tasks = tasks_query.order_by(Task.created_at.desc()).all()
     departments = Department.query.all()
+    users = User.query.filter(User.role.in_(['department_head', 'team_member'])).all()
     
     # Analytics data
     total_tasks = Task.query.count()
     completed_tasks = Task.query.filter_by(status='COMPLETED').count()
     pending_tasks = Task.query.filter_by(status='PENDING').count()
     
-    # Pending approvals count
-    pending_approvals = TaskApprovalRequest.query.filter_by(status='PENDING').count()
+    # Pending approvals count (maintained counter, no scan)
+    pending_approvals = get_pending_approvals_count()
     urgent_tasks = Task.query.filter_by(priority='URGENT').count()
     
     return render_template('admin/dashboard.html', 
                          tasks=tasks, 
                          departments=departments,
+                         users=users,
+                         task_statuses=TASK_STATUSES,
                          total_tasks=total_tasks,
                          completed_tasks=completed_tasks,
                          pending_tasks=pending_tasks,
@@ -86,7 +105,8 @@ def dashboard():
                              'status': status,
                              'department_id': department_id,
                              'client_name': client_name,
-                             'priority': priority
+                             'priority': priority,
+                             'overdue': overdue
                          })
 
 @admin_bp.route('/departments')
@@ -180,7 +200,23 @@ def edit_department(dept_id):
 @admin_required
 def delete_department(dept_id):
     dept = Department.query.get_or_404(dept_id)
+    
+    # Task.department_id is required, so owned tasks must be moved or deleted first
+    owned_tasks = Task.query.filter_by(department_id=dept_id).count()
+    if owned_tasks:
+        flash(f'Cannot delete department: it still owns {owned_tasks} task(s). Reassign or delete them first.', 'error')
+        return redirect(url_for('admin.departments'))
+    
+    # Tasks this department was involved in need their completion status recomputed
+    involved_task_ids = {row.task_id for row in TaskDepartmentAssignment.query.with_entities(
+        TaskDepartmentAssignment.task_id
+    ).filter_by(department_id=dept_id).all()}
+    
+    # Members are detached (SET NULL) and department assignments/completions
+    # are removed by ON DELETE rules in the database
     db.session.delete(dept)
+    db.session.flush()
+    update_task_completion_statuses(involved_task_ids)
     db.session.commit()
     flash('Department deleted successfully', 'success')
     return redirect(url_for('admin.departments'))
@@ -238,8 +274,15 @@ def delete_user(user_id):
         return redirect(url_for('admin.users'))
     
     user = User.query.get_or_404(user_id)
+    # Assignments and devices are removed by ON DELETE CASCADE in a single statement
     db.session.delete(user)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Tasks, subtasks or assignments created by this user still reference them
+        db.session.rollback()
+        flash('Cannot delete a user who created or assigned tasks. Deactivate the account instead.', 'error')
+        return redirect(url_for('admin.users'))
     flash('User deleted successfully', 'success')
     return redirect(url_for('admin.users'))
 
@@ -248,6 +291,12 @@ def delete_user(user_id):
 @admin_required
 def create_task():
     if request.method == 'POST':
+        # A repeated submit (double-click, retry) gets the task created the first time
+        idempotency_key = request_idempotency_key()
+        if find_idempotent_result(idempotency_key) is not None:
+            flash('This task was already created', 'info')
+            return redirect(url_for('admin.dashboard'))
+        
         task_name = request.form.get('task_name')
         description = request.form.get('description', '')
         priority = request.form.get('priority')
@@ -272,6 +321,7 @@ def create_task():
         )
         db.session.add(task)
         db.session.flush()
+        remember_idempotent_result(idempotency_key, task.id)
         
         assigned_users = []
         
@@ -323,7 +373,11 @@ def create_task():
                     db.session.add(assignment)
                     assigned_users.append(user)
         
-        db.session.commit()
+        record_activity('task_created', task, details={'task_name': task.task_name, 'priority': task.priority,
+                                                       'assigned_user_ids': [user.id for user in assigned_users]})
+        if not commit_or_replay(idempotency_key):
+            flash('This task was already created', 'info')
+            return redirect(url_for('admin.dashboard'))
         
         # Log task creation
         from flask import current_app
@@ -332,10 +386,10 @@ def create_task():
             current_app.logger.info(f"Task CREATED - ID: {task.id}, Name: '{task.task_name}', Priority: {task.priority}, Department ID: {task.department_id}, Created by: {current_user.email} (ID: {current_user.id}){assigned_info}")
         
         # Send FCM notifications to assigned users
-        from utils import send_task_assignment_notification
+        from notification_queue import queue_task_assignment_notification
         if assigned_users:
             for user in assigned_users:
-                send_task_assignment_notification(user, task, current_user)
+                queue_task_assignment_notification(user, task, current_user)
         else:
             # Log when no users are assigned (no notifications sent)
             from flask import current_app
@@ -347,7 +401,9 @@ def create_task():
     
     departments = Department.query.all()
     users = User.query.filter(User.role.in_(['department_head', 'team_member'])).all()
-    return render_template('admin/create_task.html', departments=departments, users=users)
+    workloads = user_workloads(user_ids=[user.id for user in users])
+    return render_template('admin/create_task.html', departments=departments, users=users, workloads=workloads,
+                         idempotency_key=new_idempotency_key())
 
 @admin_bp.route('/tasks/<int:task_id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -356,6 +412,11 @@ def edit_task(task_id):
     task = Task.query.get_or_404(task_id)
     
     if request.method == 'POST':
+        # The form carries the version it was rendered from; saving a stale form would silently
+        # undo whatever changed since
+        seen_version = request.form.get('version', type=int)
+        if seen_version is not None and seen_version != task.version_id:
+            return conflict_response(task_id)
         task.task_name = request.form.get('task_name')
         task.description = request.form.get('description', '')
         task.priority = request.form.get('priority')
@@ -364,11 +425,19 @@ def edit_task(task_id):
         task.remark = request.form.get('remark', '')
         deadline_str = request.form.get('deadline', '')
         
+        previous_deadline = task.deadline
         if deadline_str:
             task.deadline = datetime.strptime(deadline_str, '%Y-%m-%dT%H:%M')
         else:
             task.deadline = None
+        if task.deadline != previous_deadline:
+            # Announce the new deadline again
+            task.deadline_reminder_sent_at = None
+            task.overdue_notified_at = None
         
+        changes = changed_fields(task, TASK_EDIT_FIELDS)
+        if changes:
+            record_activity('task_updated', task, details=changes)
         db.session.commit()
         
         # Log task update
@@ -387,11 +456,18 @@ def edit_task(task_id):
 @admin_required
 def delete_task(task_id):
     task = Task.query.get_or_404(task_id)
-    db.session.delete(task)
     task_name = task.task_name
     task_id = task.id
+    # Child rows are removed by ON DELETE CASCADE in the database
+    _release_pending_approvals([task_id])
+    record_activity('task_deleted', task, details={'task_name': task_name})
     db.session.delete(task)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        flash(TASK_DELETE_SCHEMA_ERROR, 'error')
+        return redirect(url_for('admin.dashboard'))
     
     # Log task deletion
     from flask import current_app
@@ -401,6 +477,151 @@ def delete_task(task_id):
     flash('Task deleted successfully', 'success')
     return redirect(url_for('admin.dashboard'))
 
+def _release_pending_approvals(task_ids):
+    """Keep the pending approvals counter right when tasks (and their requests) are deleted"""
+    pending = TaskApprovalRequest.query.filter(
+        TaskApprovalRequest.task_id.in_(list(task_ids)),
+        TaskApprovalRequest.status == 'PENDING'
+    ).count()
+    adjust_pending_approvals_count(-pending)
+
+def _delete_tasks(task_ids):
+    """Delete tasks with one statement; child rows are removed by ON DELETE CASCADE"""
+    _release_pending_approvals(task_ids)
+    return Task.query.filter(Task.id.in_(list(task_ids))).delete(synchronize_session=False)
+
+@admin_bp.route('/tasks/bulk', methods=['POST'])
+@login_required
+@admin_required
+def bulk_tasks():
+    """Apply a status change, assignment or deletion to many selected tasks in one request"""
+    action = request.form.get('action')
+    task_ids = filter_accessible_task_ids(current_user, parse_id_list(request.form.getlist('task_ids[]')))
+    
+    if not task_ids:
+        flash('No tasks selected', 'error')
+        return redirect(url_for('admin.dashboard'))
+    
+    from flask import current_app
+    
+    if action == 'status':
+        new_status = request.form.get('status')
+        if new_status not in TASK_STATUSES:
+            flash('Invalid status selected', 'error')
+            return redirect(url_for('admin.dashboard'))
+        
+        record_status_changes(set_task_statuses(task_ids, new_status), {'bulk': True})
+        # Tasks split across departments follow their department completions
+        record_status_changes(update_task_completion_statuses(task_ids), {'bulk': True})
+        db.session.commit()
+        
+        if current_app:
+            current_app.logger.info(f"Tasks BULK STATUS - {len(task_ids)} task(s) set to '{new_status}' by {current_user.email} (ID: {current_user.id}), Task IDs: {sorted(task_ids)}")
+        flash(f'Status updated for {len(task_ids)} task(s)', 'success')
+    
+    elif action == 'assign':
+        # Target is encoded as "user:<id>" or "department:<id>"
+        target_type, _, target_id = request.form.get('assign_target', '').partition(':')
+        if not target_id.isdigit():
+            flash('Please select a user or department to assign', 'error')
+            return redirect(url_for('admin.dashboard'))
+        
+        notify = []  # (user, task_id) pairs for newly created assignments
+        
+        if target_type == 'user':
+            user = User.query.get(int(target_id))
+            if not user:
+                flash('Invalid user selected', 'error')
+                return redirect(url_for('admin.dashboard'))
+            
+            already_assigned = {row.task_id for row in TaskAssignment.query.with_entities(TaskAssignment.task_id).filter(
+                TaskAssignment.task_id.in_(task_ids),
+                TaskAssignment.user_id == user.id
+            ).all()}
+            new_task_ids = task_ids - already_assigned
+            db.session.add_all([
+                TaskAssignment(task_id=task_id, user_id=user.id, assigned_by_id=current_user.id)
+                for task_id in new_task_ids
+            ])
+            notify = [(user, task_id) for task_id in new_task_ids]
+        
+        elif target_type == 'department':
+            dept = Department.query.get(int(target_id))
+            if not dept:
+                flash('Invalid department selected', 'error')
+                return redirect(url_for('admin.dashboard'))
+            
+            already_involved = {row.task_id for row in TaskDepartmentAssignment.query.with_entities(TaskDepartmentAssignment.task_id).filter(
+                TaskDepartmentAssignment.task_id.in_(task_ids),
+                TaskDepartmentAssignment.department_id == dept.id
+            ).all()}
+            new_task_ids = task_ids - already_involved
+            
+            # Create TaskDepartmentAssignment records and initialize completion status
+            db.session.add_all([
+                TaskDepartmentAssignment(task_id=task_id, department_id=dept.id, assigned_by_id=current_user.id)
+                for task_id in new_task_ids
+            ])
+            db.session.add_all([
+                DepartmentTaskCompletion(task_id=task_id, department_id=dept.id, is_completed=False)
+                for task_id in new_task_ids
+            ])
+            
+            # Auto-assign to department head, skipping tasks the head already has
+            dept_head = User.query.filter_by(department_id=dept.id, role='department_head').first()
+            if dept_head and new_task_ids:
+                head_assigned = {row.task_id for row in TaskAssignment.query.with_entities(TaskAssignment.task_id).filter(
+                    TaskAssignment.task_id.in_(new_task_ids),
+                    TaskAssignment.user_id == dept_head.id
+                ).all()}
+                head_task_ids = new_task_ids - head_assigned
+                db.session.add_all([
+                    TaskAssignment(task_id=task_id, user_id=dept_head.id, assigned_by_id=current_user.id)
+                    for task_id in head_task_ids
+                ])
+                notify = [(dept_head, task_id) for task_id in head_task_ids]
+            
+            # A newly involved department reopens tasks that were completed
+            db.session.flush()
+            update_task_completion_statuses(new_task_ids)
+        else:
+            flash('Please select a user or department to assign', 'error')
+            return redirect(url_for('admin.dashboard'))
+        
+        record_task_activities('task_assigned', new_task_ids, {f'{target_type}_id': int(target_id), 'bulk': True})
+        db.session.commit()
+        
+        if current_app:
+            current_app.logger.info(f"Tasks BULK ASSIGN - {len(task_ids)} task(s) assigned to {target_type} {target_id} by {current_user.email} (ID: {current_user.id}), Task IDs: {sorted(task_ids)}")
+        
+        # Send FCM notifications for newly created assignments
+        if notify:
+            from notification_queue import queue_task_assignment_notification
+            tasks_by_id = {t.id: t for t in Task.query.filter(Task.id.in_({task_id for _, task_id in notify})).all()}
+            for user, task_id in notify:
+                queue_task_assignment_notification(user, tasks_by_id[task_id], current_user)
+        
+        flash(f'Assignments updated for {len(task_ids)} task(s)', 'success')
+    
+    elif action == 'delete':
+        record_task_activities('task_deleted', task_ids, {'bulk': True})
+        try:
+            deleted = _delete_tasks(task_ids)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash(TASK_DELETE_SCHEMA_ERROR, 'error')
+            return redirect(url_for('admin.dashboard'))
+        
+        if current_app:
+            current_app.logger.info(f"Tasks BULK DELETED - {deleted} task(s) deleted by {current_user.email} (ID: {current_user.id}), Task IDs: {sorted(task_ids)}")
+        flash(f'{deleted} task(s) deleted successfully', 'success')
+    
+    else:
+        flash('Unknown bulk action', 'error')
+    
+    return redirect(url_for('admin.dashboard'))
+
 @admin_bp.route('/tasks/<int:task_id>/assign', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -464,12 +685,13 @@ def assign_task(task_id):
                             db.session.add(assignment)
                             assigned_users.append(dept_head)
         
+        record_activity('task_assigned', task, details={'user_ids': [user.id for user in assigned_users]})
         db.session.commit()
         
         # Send FCM notifications to assigned users
-        from utils import send_task_assignment_notification
+        from notification_queue import queue_task_assignment_notification
         for user in assigned_users:
-            send_task_assignment_notification(user, task, current_user)
+            queue_task_assignment_notification(user, task, current_user)
         
         flash('Task assignments updated successfully', 'success')
         return redirect(url_for('admin.dashboard'))
@@ -481,7 +703,8 @@ def assign_task(task_id):
                          task=task, 
                          departments=departments, 
                          users=users,
-                         current_assignments=current_assignments)
+                         current_assignments=current_assignments,
+                         workloads=user_workloads(user_ids=[user.id for user in users]))
 
 @admin_bp.route('/tasks/<int:task_id>/reassign', methods=['GET', 'POST'])
 @login_required
@@ -549,6 +772,7 @@ def reassign_task(task_id):
         # Update overall task status based on department completions
         _update_task_completion_status(task)
         
+        record_activity('task_reassigned', task, details={'department_ids': sorted(checked_dept_ids)})
         db.session.commit()
         
         # Log task reassignment
@@ -558,9 +782,9 @@ def reassign_task(task_id):
             current_app.logger.info(f"Task REASSIGNED - ID: {task.id}, Name: '{task.task_name}', Reassigned by: {current_user.email} (ID: {current_user.id}){dept_info}")
         
         # Send FCM notifications to newly assigned department heads
-        from utils import send_task_assignment_notification
+        from notification_queue import queue_task_assignment_notification
         for user in assigned_users:
-            send_task_assignment_notification(user, task, current_user)
+            queue_task_assignment_notification(user, task, current_user)
         
         flash('Task reassigned to departments successfully', 'success')
         return redirect(url_for('admin.dashboard'))
@@ -574,112 +798,290 @@ def reassign_task(task_id):
                          departments=departments,
                          current_dept_ids=current_dept_ids)
 
-@admin_bp.route('/approvals')
+WEEKDAY_NAMES = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+@admin_bp.route('/recurring-tasks', methods=['GET', 'POST'])
 @login_required
 @admin_required
-def approvals():
-    """View all pending approval requests"""
-    pending_requests = TaskApprovalRequest.query.filter_by(status='PENDING').order_by(TaskApprovalRequest.created_at.desc()).all()
+def recurring_tasks():
+    """List recurring task templates and create new ones (instances are made by `flask generate-recurring-tasks`)"""
+    if request.method == 'POST':
+        frequency = request.form.get('frequency', 'DAILY')
+        weekdays = sorted(parse_id_list(request.form.getlist('weekdays[]')) & set(range(7)))
+        if frequency not in ('DAILY', 'WEEKLY'):
+            flash('Invalid frequency', 'error')
+            return redirect(url_for('admin.recurring_tasks'))
+        if frequency == 'WEEKLY' and not weekdays:
+            flash('Select at least one weekday for a weekly task', 'error')
+            return redirect(url_for('admin.recurring_tasks'))
+        
+        task_name = (request.form.get('task_name') or '').strip()
+        if not task_name:
+            flash('Task name is required', 'error')
+            return redirect(url_for('admin.recurring_tasks'))
+        priority = request.form.get('priority', 'DAILY TASK')
+        if priority not in TASK_PRIORITIES:
+            flash('Invalid priority selected', 'error')
+            return redirect(url_for('admin.recurring_tasks'))
+        department_id = request.form.get('department_id', type=int)
+        if not department_id or db.session.get(Department, department_id) is None:
+            flash('Invalid department selected', 'error')
+            return redirect(url_for('admin.recurring_tasks'))
+        deadline_str = request.form.get('deadline_time', '')
+        try:
+            deadline_time = datetime.strptime(deadline_str, '%H:%M').time() if deadline_str else None
+        except ValueError:
+            flash('Invalid deadline time, use HH:MM', 'error')
+            return redirect(url_for('admin.recurring_tasks'))
+        assignee_ids = parse_id_list(request.form.getlist('assignee_ids[]'))
+        if assignee_ids and db.session.query(User.id).filter(User.id.in_(assignee_ids)).count() != len(assignee_ids):
+            flash('Invalid user selected', 'error')
+            return redirect(url_for('admin.recurring_tasks'))
+        
+        template = RecurringTask(
+            task_name=task_name,
+            description=request.form.get('description', ''),
+            priority=priority,
+            department_id=department_id,
+            created_by_id=current_user.id,
+            client_name=request.form.get('client_name', ''),
+            remark=request.form.get('remark', ''),
+            frequency=frequency,
+            weekdays=','.join(str(day) for day in weekdays) if frequency == 'WEEKLY' else None,
+            deadline_time=deadline_time
+        )
+        template.assignees = [RecurringTaskAssignee(user_id=user_id) for user_id in sorted(assignee_ids)]
+        db.session.add(template)
+        db.session.commit()
+        
+        from flask import current_app
+        if current_app:
+            current_app.logger.info(f"Recurring task CREATED - ID: {template.id}, Name: '{template.task_name}', Frequency: {template.frequency}, Department ID: {template.department_id}, Created by: {current_user.email} (ID: {current_user.id})")
+        flash('Recurring task created successfully', 'success')
+        return redirect(url_for('admin.recurring_tasks'))
+    
+    templates = RecurringTask.query.options(
+        joinedload(RecurringTask.department),
+        selectinload(RecurringTask.assignees).joinedload(RecurringTaskAssignee.user)
+    ).order_by(RecurringTask.created_at.desc()).all()
     departments = Department.query.all()
-    return render_template('admin/approvals.html', requests=pending_requests, departments=departments)
+    users = User.query.filter(User.role.in_(['department_head', 'team_member'])).all()
+    return render_template('admin/recurring_tasks.html',
+                         templates=templates,
+                         departments=departments,
+                         users=users,
+                         weekday_names=WEEKDAY_NAMES)
 
-@admin_bp.route('/approvals/<int:request_id>/approve', methods=['POST'])
+@admin_bp.route('/recurring-tasks/<int:template_id>/toggle', methods=['POST'])
 @login_required
 @admin_required
-def approve_request(request_id):
-    """Approve a pending request"""
-    approval_request = TaskApprovalRequest.query.get_or_404(request_id)
+def toggle_recurring_task(template_id):
+    template = RecurringTask.query.get_or_404(template_id)
+    template.is_active = not template.is_active
+    db.session.commit()
+    flash(f"Recurring task {'resumed' if template.is_active else 'paused'}", 'success')
+    return redirect(url_for('admin.recurring_tasks'))
+
+@admin_bp.route('/recurring-tasks/<int:template_id>/delete', methods=['POST'])
+@login_required
+@admin_required
+def delete_recurring_task(template_id):
+    template = RecurringTask.query.get_or_404(template_id)
+    # Tasks already generated are kept (recurring_task_id is set to NULL)
+    Task.query.filter_by(recurring_task_id=template_id).update(
+        {Task.recurring_task_id: None}, synchronize_session=False
+    )
+    db.session.delete(template)
+    db.session.commit()
+    flash('Recurring task deleted successfully', 'success')
+    return redirect(url_for('admin.recurring_tasks'))
+
+@admin_bp.route('/approvals')
+@login_required
+@admin_required
+def approvals():
+    """View pending approval requests, newest first, one page at a time"""
+    request_type = request.args.get('request_type', '')
+    department_id = request.args.get('department_id', type=int)
+    min_age_days = request.args.get('min_age_days', type=int)
+    before = request.args.get('before', type=int)
     
-    if approval_request.status != 'PENDING':
-        flash('This request has already been processed', 'error')
-        return redirect(url_for('admin.approvals'))
+    query = TaskApprovalRequest.query.filter(TaskApprovalRequest.status == 'PENDING')
+    if request_type:
+        query = query.filter(TaskApprovalRequest.request_type == request_type)
+    if department_id:
+        query = query.join(User, User.id == TaskApprovalRequest.requested_by_id).filter(User.department_id == department_id)
+    if min_age_days:
+        query = query.filter(TaskApprovalRequest.created_at <= datetime.utcnow() - timedelta(days=min_age_days))
+    if before:
+        # Keyset pagination on (status, id): no OFFSET scan however deep the queue is
+        query = query.filter(TaskApprovalRequest.id < before)
     
-    task = approval_request.task
-    assigned_users = []  # Track users to notify
+    # Everything the page shows is loaded up front: a fixed number of queries per page
+    pending_requests = query.options(
+        joinedload(TaskApprovalRequest.task),
+        joinedload(TaskApprovalRequest.requested_by).joinedload(User.department),
+        joinedload(TaskApprovalRequest.new_dept_head).joinedload(User.department),
+        selectinload(TaskApprovalRequest.requested_departments).joinedload(TaskApprovalRequestDepartment.department),
+    ).order_by(TaskApprovalRequest.id.desc()).limit(APPROVALS_PAGE_SIZE + 1).all()
     
-    if approval_request.request_type == 'reassign':
-        # Reassign task to new department head
-        new_dept_head = approval_request.new_dept_head
-        if not new_dept_head or new_dept_head.role != 'department_head':
-            flash('Invalid department head in request', 'error')
-            return redirect(url_for('admin.approvals'))
-        
-        # Update task department
-        task.department_id = new_dept_head.department_id
-        
-        # Remove old assignments and assign to new department head
-        TaskAssignment.query.filter_by(task_id=task.id).delete()
-        assignment = TaskAssignment(
-            task_id=task.id,
-            user_id=new_dept_head.id,
-            assigned_by_id=approval_request.requested_by_id
-        )
-        db.session.add(assignment)
-        
-    elif approval_request.request_type == 'assign_departments':
-        # Get requested department IDs
-        requested_dept_ids = json.loads(approval_request.requested_department_ids) if approval_request.requested_department_ids else []
-        
-        # Get current department assignments
-        current_dept_assignments = TaskDepartmentAssignment.query.filter_by(task_id=task.id).all()
-        current_dept_ids = {a.department_id for a in current_dept_assignments}
+    next_before = None
+    if len(pending_requests) > APPROVALS_PAGE_SIZE:
+        pending_requests = pending_requests[:APPROVALS_PAGE_SIZE]
+        next_before = pending_requests[-1].id
+    
+    filters = {
+        'request_type': request_type,
+        'department_id': department_id,
+        'min_age_days': min_age_days,
+    }
+    return render_template('admin/approvals.html',
+                         requests=pending_requests,
+                         departments=Department.query.order_by(Department.name).all(),
+                         pending_approvals=get_pending_approvals_count(),
+                         filters=filters,
+                         is_first_page=before is None,
+                         next_before=next_before)
+
+def _process_approval_requests(request_ids, approve, notes=''):
+    """Approve or reject pending approval requests in a single transaction.
+
+    Rows are locked (SELECT ... FOR UPDATE) so concurrent admins cannot process a request
+    twice. Department heads and existing assignments are preloaded with one query each,
+    completion is recomputed once per task, and newly assigned users are returned as
+    {user: [tasks]} so each recipient gets one notification. Requests that are no longer
+    pending are skipped; reassign requests with an invalid department head are left pending.
+    Returns (processed, invalid, notifications).
+    """
+    requests = TaskApprovalRequest.query.filter(
+        TaskApprovalRequest.id.in_(list(request_ids)),
+        TaskApprovalRequest.status == 'PENDING'
+    ).order_by(TaskApprovalRequest.created_at).with_for_update().all()
+    if not requests:
+        return [], [], {}
+    
+    processed, invalid, notifications = [], [], {}
+    if approve:
+        # Preload everything the requests touch with set-based queries
+        task_ids = {r.task_id for r in requests}
+        tasks = {t.id: t for t in Task.query.filter(Task.id.in_(task_ids)).all()}
+        requested = TaskApprovalRequestDepartment.query.filter(
+            TaskApprovalRequestDepartment.approval_request_id.in_([r.id for r in requests])
+        ).all()
+        requested_dept_ids = {}
+        for row in requested:
+            requested_dept_ids.setdefault(row.approval_request_id, []).append(row.department_id)
+        new_head_ids = {r.new_dept_head_id for r in requests if r.new_dept_head_id}
+        all_dept_ids = {d for ids in requested_dept_ids.values() for d in ids}
+        heads = User.query.filter(
+            or_(User.id.in_(new_head_ids), and_(User.department_id.in_(all_dept_ids), User.role == 'department_head'))
+        ).order_by(User.id).all()
+        users_by_id = {u.id: u for u in heads}
+        dept_heads = {}
+        for user in heads:
+            if user.role == 'department_head' and user.department_id is not None:
+                dept_heads.setdefault(user.department_id, user)  # First head per department, as before
+        dept_pairs = set(db.session.query(TaskDepartmentAssignment.task_id, TaskDepartmentAssignment.department_id)
+                         .filter(TaskDepartmentAssignment.task_id.in_(task_ids)).all())
+        completion_pairs = set(db.session.query(DepartmentTaskCompletion.task_id, DepartmentTaskCompletion.department_id)
+                               .filter(DepartmentTaskCompletion.task_id.in_(task_ids)).all())
+        assignment_pairs = set(db.session.query(TaskAssignment.task_id, TaskAssignment.user_id)
+                               .filter(TaskAssignment.task_id.in_(task_ids)).all())
         
-        # Add assignments for requested departments that don't have one yet
-        for dept_id in requested_dept_ids:
-            if dept_id not in current_dept_ids:
-                dept_assignment = TaskDepartmentAssignment(
+        reassigned_task_ids = set()
+        recompute_task_ids = set()
+        for approval_request in requests:
+            task = tasks[approval_request.task_id]
+            if approval_request.request_type == 'reassign':
+                new_dept_head = users_by_id.get(approval_request.new_dept_head_id)
+                if not new_dept_head or new_dept_head.role != 'department_head' or task.id in reassigned_task_ids:
+                    invalid.append(approval_request)
+                    continue
+                reassigned_task_ids.add(task.id)
+                task.department_id = new_dept_head.department_id
+                # Remove old assignments and assign to new department head
+                TaskAssignment.query.filter_by(task_id=task.id).delete(synchronize_session=False)
+                assignment_pairs = {pair for pair in assignment_pairs if pair[0] != task.id}
+                db.session.add(TaskAssignment(
                     task_id=task.id,
-                    department_id=dept_id,
+                    user_id=new_dept_head.id,
                     assigned_by_id=approval_request.requested_by_id
-                )
-                db.session.add(dept_assignment)
-                
-                # Initialize completion status
-                completion = DepartmentTaskCompletion(
-                    task_id=task.id,
-                    department_id=dept_id,
-                    is_completed=False
-                )
-                db.session.add(completion)
-                
-                # Auto-assign to department head
-                dept_head = User.query.filter_by(department_id=dept_id, role='department_head').first()
-                if dept_head:
-                    # Check if department head is already assigned (avoid duplicate)
-                    existing_assignment = TaskAssignment.query.filter_by(
+                ))
+                assignment_pairs.add((task.id, new_dept_head.id))
+                notifications.setdefault(new_dept_head, []).append(task)
+            
+            elif approval_request.request_type == 'assign_departments':
+                for dept_id in requested_dept_ids.get(approval_request.id, []):
+                    if (task.id, dept_id) in dept_pairs:
+                        continue
+                    db.session.add(TaskDepartmentAssignment(
                         task_id=task.id,
-                        user_id=dept_head.id
-                    ).first()
-                    if not existing_assignment:
-                        assignment = TaskAssignment(
+                        department_id=dept_id,
+                        assigned_by_id=approval_request.requested_by_id
+                    ))
+                    dept_pairs.add((task.id, dept_id))
+                    # Initialize completion status
+                    if (task.id, dept_id) not in completion_pairs:
+                        db.session.add(DepartmentTaskCompletion(task_id=task.id, department_id=dept_id, is_completed=False))
+                        completion_pairs.add((task.id, dept_id))
+                    # Auto-assign to department head
+                    dept_head = dept_heads.get(dept_id)
+                    if dept_head and (task.id, dept_head.id) not in assignment_pairs:
+                        db.session.add(TaskAssignment(
                             task_id=task.id,
                             user_id=dept_head.id,
                             assigned_by_id=approval_request.requested_by_id
-                        )
-                        db.session.add(assignment)
-                        assigned_users.append(dept_head)
+                        ))
+                        assignment_pairs.add((task.id, dept_head.id))
+                        notifications.setdefault(dept_head, []).append(task)
+                recompute_task_ids.add(task.id)
+            processed.append(approval_request)
         
+        db.session.flush()
         # Update overall task status based on department completions
-        _update_task_completion_status(task)
-    
-    # Update approval request
-    approval_request.status = 'APPROVED'
-    approval_request.approved_by_id = current_user.id
-    approval_request.approval_notes = request.form.get('notes', '')
-    approval_request.updated_at = datetime.utcnow()
+        update_task_completion_statuses(recompute_task_ids)
+    else:
+        processed = requests
+        tasks = {t.id: t for t in Task.query.filter(Task.id.in_({r.task_id for r in requests})).all()}
     
+    now = datetime.utcnow()
+    for approval_request in processed:
+        approval_request.status = 'APPROVED' if approve else 'REJECTED'
+        approval_request.approved_by_id = current_user.id
+        approval_request.approval_notes = notes
+        approval_request.updated_at = now
+        record_activity('approval_approved' if approve else 'approval_rejected', tasks[approval_request.task_id],
+                        details={'request_id': approval_request.id, 'request_type': approval_request.request_type})
+    adjust_pending_approvals_count(-len(processed))
     db.session.commit()
+    return processed, invalid, notifications
+
+def _send_approval_notifications(notifications):
+    """Send one notification per newly assigned user, however many tasks they received"""
+    from utils import send_task_assignments_notification
+    for user, tasks in notifications.items():
+        send_task_assignments_notification(user, tasks, current_user)
+
+@admin_bp.route('/approvals/<int:request_id>/approve', methods=['POST'])
+@login_required
+@admin_required
+def approve_request(request_id):
+    """Approve a pending request"""
+    approval_request = TaskApprovalRequest.query.get_or_404(request_id)
     
-    # Send FCM notifications to newly assigned department heads
-    if approval_request.request_type == 'assign_departments' and assigned_users:
-        from utils import send_task_assignment_notification
-        for user in assigned_users:
-            send_task_assignment_notification(user, task, current_user)
-    elif approval_request.request_type == 'reassign':
-        # Send notification to new department head
-        from utils import send_task_assignment_notification
-        send_task_assignment_notification(approval_request.new_dept_head, task, current_user)
+    if approval_request.status != 'PENDING':
+        flash('This request has already been processed', 'error')
+        return redirect(url_for('admin.approvals'))
+    
+    processed, invalid, notifications = _process_approval_requests([request_id], approve=True, notes=request.form.get('notes', ''))
+    if invalid:
+        flash('Invalid department head in request', 'error')
+        return redirect(url_for('admin.approvals'))
+    if not processed:
+        flash('This request has already been processed', 'error')
+        return redirect(url_for('admin.approvals'))
     
+    _send_approval_notifications(notifications)
     flash('Request approved successfully', 'success')
     return redirect(url_for('admin.approvals'))
 
@@ -694,19 +1096,47 @@ def reject_request(request_id):
         flash('This request has already been processed', 'error')
         return redirect(url_for('admin.approvals'))
     
-    # Update approval request
-    approval_request.status = 'REJECTED'
-    approval_request.approved_by_id = current_user.id
-    approval_request.approval_notes = request.form.get('notes', '')
-    approval_request.updated_at = datetime.utcnow()
-    
-    db.session.commit()
+    _process_approval_requests([request_id], approve=False, notes=request.form.get('notes', ''))
     flash('Request rejected', 'info')
     return redirect(url_for('admin.approvals'))
 
+@admin_bp.route('/approvals/batch', methods=['POST'])
+@login_required
+@admin_required
+def batch_approvals():
+    """Approve or reject many pending requests in one transaction"""
+    action = request.form.get('action')
+    request_ids = parse_id_list(request.form.getlist('request_ids[]'))
+    
+    if not request_ids:
+        flash('No requests selected', 'error')
+        return redirect(url_for('admin.approvals'))
+    if action not in ('approve', 'reject'):
+        flash('Unknown batch action', 'error')
+        return redirect(url_for('admin.approvals'))
+    
+    processed, invalid, notifications = _process_approval_requests(
+        request_ids, approve=action == 'approve', notes=request.form.get('notes', '')
+    )
+    _send_approval_notifications(notifications)
+    
+    from flask import current_app
+    if current_app:
+        current_app.logger.info(f"Approvals BATCH {action.upper()} - {len(processed)} request(s) by {current_user.email} (ID: {current_user.id}), Request IDs: {sorted(r.id for r in processed)}")
+    
+    verb = 'approved' if action == 'approve' else 'rejected'
+    flash(f'{len(processed)} request(s) {verb}', 'success' if processed else 'info')
+    skipped = len(request_ids) - len(processed) - len(invalid)
+    if invalid:
+        flash(f'{len(invalid)} request(s) left pending: invalid or duplicate department head reassignment', 'error')
+    if skipped:
+        flash(f'{skipped} request(s) skipped because they were already processed', 'info')
+    return redirect(url_for('admin.approvals'))
+
 @admin_bp.route('/analytics')
 @login_required
 @admin_required
+@replica_read
 def analytics():
     # Task statistics
     total_tasks = Task.query.count()
@@ -743,6 +1173,11 @@ def analytics():
         else:
             stat['medal'] = ''
     
+    # Lead time, cycle time and time in status from the status history
+    from flask import current_app
+    flow_days = current_app.config.get('FLOW_ANALYTICS_DAYS', 30)
+    flow_stats = flow_analytics(days=flow_days)
+    
     # User statistics
     total_users = User.query.count()
     admins = User.query.filter_by(role='admin').count()
@@ -758,8 +1193,109 @@ def analytics():
                          important_tasks=important_tasks,
                          daily_tasks=daily_tasks,
                          dept_stats=dept_stats,
+                         flow_stats=flow_stats,
+                         flow_days=flow_days,
+                         flow_statuses=[status for status in TASK_STATUSES if status != 'COMPLETED'],
                          total_users=total_users,
                          admins=admins,
                          dept_heads=dept_heads,
                          team_members=team_members)
 
+@admin_bp.route('/analytics/flow')
+@login_required
+@admin_required
+@replica_read
+def flow_analytics_json():
+    """Lead time, cycle time and time-in-status percentiles per department: ?days=30&department_id=1"""
+    from flask import current_app
+    days = request.args.get('days', type=int) or current_app.config.get('FLOW_ANALYTICS_DAYS', 30)
+    days = min(max(days, 1), 366)
+    department_id = request.args.get('department_id', type=int)
+    return jsonify({'days': days, 'departments': flow_analytics(days=days, department_id=department_id)})
+
+@admin_bp.route('/pool-health')
+@login_required
+@admin_required
+def pool_health():
+    """Connection pool occupancy, checkout waits and pre-ping failures of the worker process that
+    answers (pools are per process), with the lag of each read replica"""
+    import os
+    from flask import current_app
+    from db_pool import pool_status
+    from replicas import get_replica_router
+    router = get_replica_router()
+    engines = {'primary': pool_status(db.engine)}
+    for name, engine in router.engines.items():
+        engines[name] = dict(pool_status(engine), lag_seconds=router.lag.get(name))
+    return jsonify({
+        'pid': os.getpid(),
+        'workers': current_app.config.get('WEB_CONCURRENCY'),
+        'threads': current_app.config.get('WEB_THREADS'),
+        'configured': {key: current_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}).get(key)
+                       for key in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_pre_ping')},
+        'engines': engines,
+    })
+
+
+def _parse_day(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+
+@admin_bp.route('/archive')
+@login_required
+@admin_required
+@replica_read
+def archive():
+    """Search archived tasks (moved out of the live tables by `flask archive-tasks`), newest first"""
+    q = request.args.get('q', '').strip()
+    department_id = request.args.get('department_id', type=int)
+    completed_from = request.args.get('completed_from', '')
+    completed_to = request.args.get('completed_to', '')
+    before = request.args.get('before', type=int)
+    
+    to_day = _parse_day(completed_to)
+    tasks, next_before = search_archived_tasks(
+        q=q,
+        department_id=department_id,
+        completed_from=_parse_day(completed_from),
+        completed_to=to_day + timedelta(days=1) if to_day else None,  # Inclusive end day
+        before=before,
+    )
+    departments = Department.query.order_by(Department.name).all()
+    filters = {
+        'q': q,
+        'department_id': department_id,
+        'completed_from': completed_from,
+        'completed_to': completed_to,
+    }
+    return render_template('admin/archive.html',
+                         tasks=tasks,
+                         departments=departments,
+                         department_names={dept.id: dept.name for dept in departments},
+                         filters=filters,
+                         is_first_page=before is None,
+                         next_before=next_before)
+
+@admin_bp.route('/archive/<int:archived_id>')
+@login_required
+@admin_required
+@replica_read
+def archived_task(archived_id):
+    """One archived task with its assignments, subtasks, completions, approvals and status history"""
+    task = ArchivedTask.query.get_or_404(archived_id)
+    children = task.children
+    user_ids = {task.created_by_id}
+    for key, fields in (('assignments', ('user_id', 'assigned_by_id')), ('subtasks', ('created_by_id',)),
+                        ('completions', ('completed_by_id',)), ('approval_requests', ('requested_by_id', 'approved_by_id')),
+                        ('status_history', ('changed_by_id',))):
+        user_ids.update(row.get(field) for row in children.get(key, []) for field in fields)
+    user_ids.discard(None)
+    user_names = dict(db.session.query(User.id, User.full_name).filter(User.id.in_(user_ids)).all())
+    department_names = dict(db.session.query(Department.id, Department.name).all())
+    return render_template('admin/archived_task.html',
+                         task=task,
+                         children=children,
+                         user_names=user_names,
+                         department_names=department_names)
@@ -1,17 +1,23 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
-from models import db, User, Department, Task, TaskAssignment, Subtask, TaskDepartmentAssignment, DepartmentTaskCompletion, TaskApprovalRequest
+from models import db, User, Department, Task, TaskAssignment, Subtask, TaskDepartmentAssignment, DepartmentTaskCompletion, TaskApprovalRequest, TASK_STATUSES, TASK_PRIORITIES
 from extensions import bcrypt
-from utils import dept_head_required
+from task_status import set_task_statuses
+from activity import record_activity, record_task_activities, record_status_changes
+from replicas import replica_read
+from idempotency import new_idempotency_key, request_idempotency_key, find_idempotent_result, remember_idempotent_result, commit_or_replay
+from utils import dept_head_required, parse_id_list, filter_accessible_task_ids, update_task_completion_statuses, conditional_view, overdue_tasks_clause, adjust_pending_approvals_count, user_workloads, empty_workload, insert_ignore, conflict_response
 from datetime import datetime
 from sqlalchemy import or_
-import json
+from sqlalchemy.exc import IntegrityError
 
 dept_head_bp = Blueprint('dept_head', __name__)
 
 @dept_head_bp.route('/dashboard')
 @login_required
 @dept_head_required
+@replica_read
+@conditional_view
 def dashboard():
     # Get tasks for department head's department
     dept_id = current_user.department_id
@@ -40,6 +46,7 @@ def dashboard():
     status = request.args.get('status', '')
     priority = request.args.get('priority', '')
     client_name = request.args.get('client_name', '')
+    overdue = request.args.get('overdue', '')
     
     if task_name:
         tasks_query = tasks_query.filter(Task.task_name.ilike(f'%{task_name}%'))
@@ -49,16 +56,22 @@ def dashboard():
         tasks_query = tasks_query.filter(Task.priority == priority)
     if client_name:
         tasks_query = tasks_query.filter(Task.client_name.ilike(f'%{client_name}%'))
+    if overdue:
+        tasks_query = tasks_query.filter(overdue_tasks_clause())
     
     tasks = tasks_query.order_by(Task.created_at.desc()).all()
+    members = User.query.filter_by(department_id=dept_id, role='team_member').all()
     
     return render_template('dept_head/dashboard.html', 
                          tasks=tasks,
+                         members=members,
+                         task_statuses=TASK_STATUSES,
                          filters={
                              'task_name': task_name,
                              'status': status,
                              'priority': priority,
-                             'client_name': client_name
+                             'client_name': client_name,
+                             'overdue': overdue
                          })
 
 @dept_head_bp.route('/team-members')
@@ -73,6 +86,49 @@ def team_members():
     members = User.query.filter_by(department_id=dept_id, role='team_member').all()
     return render_template('dept_head/team_members.html', members=members)
 
+def _department_workload(dept_id):
+    """The department's head and team members with their open-task counts (one GROUP BY)"""
+    users = User.query.filter(
+        User.department_id == dept_id,
+        User.role.in_(['department_head', 'team_member'])
+    ).order_by(User.full_name).all()
+    workloads = user_workloads(department_id=dept_id)
+    return [dict(workloads.get(user.id, empty_workload()), user_id=user.id, name=user.full_name, role=user.role)
+            for user in users]
+
+def _workload_department_id():
+    # Admins pick the department, department heads see their own
+    if current_user.role == 'admin':
+        return request.args.get('department_id', type=int)
+    return current_user.department_id
+
+@dept_head_bp.route('/workload')
+@login_required
+@dept_head_required
+@replica_read
+def workload():
+    """Open tasks per department member by priority and overdue state"""
+    dept_id = _workload_department_id()
+    if not dept_id:
+        flash('You are not assigned to any department', 'error')
+        return redirect(url_for('dept_head.dashboard'))
+    department = Department.query.get_or_404(dept_id)
+    return render_template('dept_head/workload.html',
+                         department=department,
+                         members=_department_workload(dept_id),
+                         priorities=TASK_PRIORITIES)
+
+@dept_head_bp.route('/workload/counts')
+@login_required
+@dept_head_required
+@replica_read
+def workload_counts():
+    """JSON version of the workload page: ?department_id= for admins"""
+    dept_id = _workload_department_id()
+    if not dept_id:
+        return jsonify({'success': False, 'message': 'No department selected'}), 400
+    return jsonify({'success': True, 'department_id': dept_id, 'members': _department_workload(dept_id)})
+
 @dept_head_bp.route('/team-members/add', methods=['GET', 'POST'])
 @login_required
 @dept_head_required
@@ -125,8 +181,15 @@ def delete_team_member(user_id):
         flash('You can only remove team members', 'error')
         return redirect(url_for('dept_head.team_members'))
     
+    # Assignments and devices are removed by ON DELETE CASCADE in a single statement
     db.session.delete(member)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Tasks or subtasks created by this member still reference them
+        db.session.rollback()
+        flash('Cannot remove a team member who created tasks or subtasks. Ask an admin to deactivate the account instead.', 'error')
+        return redirect(url_for('dept_head.team_members'))
     flash('Team member removed successfully', 'success')
     return redirect(url_for('dept_head.team_members'))
 
@@ -140,6 +203,12 @@ def create_task():
         return redirect(url_for('dept_head.dashboard'))
     
     if request.method == 'POST':
+        # A repeated submit (double-click, retry) gets the task created the first time
+        idempotency_key = request_idempotency_key()
+        if find_idempotent_result(idempotency_key) is not None:
+            flash('This task was already created', 'info')
+            return redirect(url_for('dept_head.dashboard'))
+        
         task_name = request.form.get('task_name')
         description = request.form.get('description', '')
         priority = request.form.get('priority')
@@ -163,6 +232,8 @@ def create_task():
         )
         db.session.add(task)
         db.session.flush()
+        remember_idempotent_result(idempotency_key, task.id)
+        record_activity('task_created', task, details={'task_name': task.task_name, 'priority': task.priority})
         
         # Assign to team members
         assigned_users = []
@@ -215,21 +286,28 @@ def create_task():
                 task_id=task.id,
                 request_type='assign_departments',
                 requested_by_id=current_user.id,
-                requested_department_ids=json.dumps(list(selected_dept_ids)),  # All selected (own + others)
                 status='PENDING'
             )
+            approval_request.set_requested_departments(selected_dept_ids)  # All selected (own + others)
             db.session.add(approval_request)
-            db.session.commit()
+            adjust_pending_approvals_count(1)
+            record_activity('approval_requested', task, details={'request_type': 'assign_departments',
+                                                                 'department_ids': sorted(selected_dept_ids)})
+            if not commit_or_replay(idempotency_key):
+                flash('This task was already created', 'info')
+                return redirect(url_for('dept_head.dashboard'))
             
             # Send FCM notifications to assigned users
-            from utils import send_task_assignment_notification
+            from notification_queue import queue_task_assignment_notification
             for user in assigned_users:
-                send_task_assignment_notification(user, task, current_user)
+                queue_task_assignment_notification(user, task, current_user)
             
             flash('Task created successfully. Request to involve other departments submitted. Waiting for admin approval.', 'info')
         else:
             # No other departments, just commit
-            db.session.commit()
+            if not commit_or_replay(idempotency_key):
+                flash('This task was already created', 'info')
+                return redirect(url_for('dept_head.dashboard'))
             
             # Log task creation
             from flask import current_app
@@ -238,9 +316,9 @@ def create_task():
                 current_app.logger.info(f"Task CREATED (Dept Head) - ID: {task.id}, Name: '{task.task_name}', Priority: {task.priority}, Department ID: {task.department_id}, Created by: {current_user.email} (ID: {current_user.id}){assigned_info}")
             
             # Send FCM notifications to assigned users
-            from utils import send_task_assignment_notification
+            from notification_queue import queue_task_assignment_notification
             for user in assigned_users:
-                send_task_assignment_notification(user, task, current_user)
+                queue_task_assignment_notification(user, task, current_user)
             
             flash('Task created successfully', 'success')
         
@@ -248,7 +326,9 @@ def create_task():
     
     members = User.query.filter_by(department_id=dept_id, role='team_member').all()
     departments = Department.query.all()
-    return render_template('dept_head/create_task.html', members=members, departments=departments)
+    workloads = user_workloads(user_ids=[member.id for member in members])
+    return render_template('dept_head/create_task.html', members=members, departments=departments, workloads=workloads,
+                         idempotency_key=new_idempotency_key())
 
 @dept_head_bp.route('/tasks/<int:task_id>/reassign', methods=['GET', 'POST'])
 @login_required
@@ -293,6 +373,8 @@ def reassign_task(task_id):
                 status='PENDING'
             )
             db.session.add(approval_request)
+            adjust_pending_approvals_count(1)
+        record_activity('approval_requested', task, details={'request_type': 'reassign', 'new_dept_head_id': new_dept_head.id})
         
         db.session.commit()
         flash('Reassignment request submitted. Waiting for admin approval.', 'info')
@@ -365,19 +447,23 @@ def forward_task(task_id):
                 db.session.add(assignment)
                 assigned_users.append(member)
         
+        record_activity('task_assigned', task, department_id=current_user.department_id,
+                        details={'user_ids': sorted(checked_user_ids)})
         db.session.commit()
         
         # Send FCM notifications to newly assigned team members
-        from utils import send_task_assignment_notification
+        from notification_queue import queue_task_assignment_notification
         for user in assigned_users:
-            send_task_assignment_notification(user, task, current_user)
+            queue_task_assignment_notification(user, task, current_user)
         
         flash('Task forwarded successfully', 'success')
         return redirect(url_for('dept_head.dashboard'))
     
     members = User.query.filter_by(department_id=current_user.department_id, role='team_member').all()
     current_assignments = [a.user_id for a in task.assignments]
-    return render_template('dept_head/forward_task.html', task=task, members=members, current_assignments=current_assignments)
+    workloads = user_workloads(user_ids=[member.id for member in members])
+    return render_template('dept_head/forward_task.html', task=task, members=members,
+                         current_assignments=current_assignments, workloads=workloads)
 
 @dept_head_bp.route('/tasks/<int:task_id>/assign-departments', methods=['GET', 'POST'])
 @login_required
@@ -440,7 +526,7 @@ def assign_departments(task_id):
             
             if pending_request:
                 # Update existing request with new department IDs
-                pending_request.requested_department_ids = json.dumps(list(checked_dept_ids))
+                pending_request.set_requested_departments(checked_dept_ids)
                 pending_request.updated_at = datetime.utcnow()
             else:
                 # Create new approval request
@@ -448,16 +534,21 @@ def assign_departments(task_id):
                     task_id=task.id,
                     request_type='assign_departments',
                     requested_by_id=current_user.id,
-                    requested_department_ids=json.dumps(list(checked_dept_ids)),
                     status='PENDING'
                 )
+                approval_request.set_requested_departments(checked_dept_ids)
                 db.session.add(approval_request)
+                adjust_pending_approvals_count(1)
+            record_activity('approval_requested', task, department_id=current_user.department_id,
+                            details={'request_type': 'assign_departments', 'department_ids': sorted(checked_dept_ids)})
             
             db.session.commit()
             flash('Request to add departments submitted. Waiting for admin approval. Removed departments have been unassigned.', 'info')
         else:
             # No new departments to add, just removals (already processed above)
             _update_task_completion_status(task)
+            record_activity('departments_updated', task, department_id=current_user.department_id,
+                            details={'department_ids': sorted(checked_dept_ids)})
             db.session.commit()
             flash('Department assignments updated successfully', 'success')
         
@@ -534,7 +625,14 @@ def update_task_status(task_id):
         flash('You can only update tasks from your department or tasks assigned to your department', 'error')
         return redirect(url_for('dept_head.dashboard'))
     
+    seen_version = request.form.get('version', type=int)
+    if seen_version is not None and seen_version != task.version_id:
+        return conflict_response(task_id)
+    
     new_status = request.form.get('status')
+    if task.status != new_status:
+        record_activity('status_changed', task, department_id=current_user.department_id,
+                        details={'status': [task.status, new_status]})
     task.status = new_status
     
     # If setting to COMPLETED and task has department assignments, 
@@ -543,6 +641,109 @@ def update_task_status(task_id):
     flash('Task status updated successfully', 'success')
     return redirect(url_for('tasks.view_task', task_id=task_id))
 
+@dept_head_bp.route('/tasks/bulk', methods=['POST'])
+@login_required
+@dept_head_required
+def bulk_tasks():
+    """Change status, forward or mark department completion for many selected tasks in one request"""
+    dept_id = current_user.department_id
+    if not dept_id:
+        flash('You are not assigned to any department', 'error')
+        return redirect(url_for('dept_head.dashboard'))
+    
+    action = request.form.get('action')
+    # Only tasks from this department or assigned to it (checked in one query)
+    task_ids = filter_accessible_task_ids(current_user, parse_id_list(request.form.getlist('task_ids[]')))
+    
+    if not task_ids:
+        flash('No tasks selected', 'error')
+        return redirect(url_for('dept_head.dashboard'))
+    
+    from flask import current_app
+    
+    if action == 'status':
+        new_status = request.form.get('status')
+        if new_status not in TASK_STATUSES:
+            flash('Invalid status selected', 'error')
+            return redirect(url_for('dept_head.dashboard'))
+        
+        record_status_changes(set_task_statuses(task_ids, new_status), {'bulk': True}, department_id=dept_id)
+        # Tasks split across departments follow their department completions
+        record_status_changes(update_task_completion_statuses(task_ids), {'bulk': True}, department_id=dept_id)
+        db.session.commit()
+        
+        if current_app:
+            current_app.logger.info(f"Tasks BULK STATUS (Dept Head) - {len(task_ids)} task(s) set to '{new_status}' by {current_user.email} (ID: {current_user.id}), Task IDs: {sorted(task_ids)}")
+        flash(f'Status updated for {len(task_ids)} task(s)', 'success')
+    
+    elif action == 'forward':
+        member_id = request.form.get('member_id', '')
+        member = User.query.get(int(member_id)) if member_id.isdigit() else None
+        if not member or member.department_id != dept_id or member.role != 'team_member':
+            flash('Please select a team member from your department', 'error')
+            return redirect(url_for('dept_head.dashboard'))
+        
+        already_assigned = {row.task_id for row in TaskAssignment.query.with_entities(TaskAssignment.task_id).filter(
+            TaskAssignment.task_id.in_(task_ids),
+            TaskAssignment.user_id == member.id
+        ).all()}
+        new_task_ids = task_ids - already_assigned
+        db.session.add_all([
+            TaskAssignment(task_id=task_id, user_id=member.id, assigned_by_id=current_user.id)
+            for task_id in new_task_ids
+        ])
+        record_task_activities('task_assigned', new_task_ids, {'user_id': member.id, 'bulk': True}, department_id=dept_id)
+        db.session.commit()
+        
+        # Send FCM notifications for newly forwarded tasks
+        if new_task_ids:
+            from notification_queue import queue_task_assignment_notification
+            for task in Task.query.filter(Task.id.in_(new_task_ids)).all():
+                queue_task_assignment_notification(member, task, current_user)
+        
+        flash(f'{len(new_task_ids)} task(s) forwarded to {member.full_name}', 'success')
+    
+    elif action == 'mark_department_complete':
+        # Only tasks this department is actually assigned to
+        involved_ids = {row.task_id for row in TaskDepartmentAssignment.query.with_entities(TaskDepartmentAssignment.task_id).filter(
+            TaskDepartmentAssignment.task_id.in_(task_ids),
+            TaskDepartmentAssignment.department_id == dept_id
+        ).all()}
+        if not involved_ids:
+            flash('Your department is not assigned to any of the selected tasks', 'error')
+            return redirect(url_for('dept_head.dashboard'))
+        
+        now = datetime.utcnow()
+        # Create missing completion rows, then complete them all with one versioned UPDATE
+        insert_ignore(DepartmentTaskCompletion, [
+            {'task_id': task_id, 'department_id': dept_id, 'is_completed': False}
+            for task_id in involved_ids
+        ])
+        DepartmentTaskCompletion.query.filter(
+            DepartmentTaskCompletion.task_id.in_(involved_ids),
+            DepartmentTaskCompletion.department_id == dept_id,
+            DepartmentTaskCompletion.is_completed == False
+        ).update({
+            DepartmentTaskCompletion.is_completed: True,
+            DepartmentTaskCompletion.completed_at: now,
+            DepartmentTaskCompletion.completed_by_id: current_user.id,
+            DepartmentTaskCompletion.version_id: DepartmentTaskCompletion.version_id + 1
+        }, synchronize_session=False)
+        
+        # Update overall task status once per affected task
+        update_task_completion_statuses(involved_ids)
+        record_task_activities('department_completed', involved_ids, {'bulk': True}, department_id=dept_id)
+        db.session.commit()
+        
+        if current_app:
+            current_app.logger.info(f"Tasks BULK DEPARTMENT COMPLETE - Department ID: {dept_id}, {len(involved_ids)} task(s) by {current_user.email} (ID: {current_user.id}), Task IDs: {sorted(involved_ids)}")
+        flash(f'Your department has been marked as completed for {len(involved_ids)} task(s)', 'success')
+    
+    else:
+        flash('Unknown bulk action', 'error')
+    
+    return redirect(url_for('dept_head.dashboard'))
+
 @dept_head_bp.route('/tasks/<int:task_id>/mark-department-complete', methods=['POST'])
 @login_required
 @dept_head_required
@@ -563,34 +764,46 @@ def mark_department_complete(task_id):
         flash('Your department is not assigned to this task', 'error')
         return redirect(url_for('dept_head.dashboard'))
     
-    # Get or create completion record
-    completion = DepartmentTaskCompletion.query.filter_by(
+    # Get or create completion record; a concurrent insert of the same row is skipped, not an error
+    completion_query = DepartmentTaskCompletion.query.filter_by(
         task_id=task_id,
         department_id=current_user.department_id
-    ).first()
-    
+    )
+    completion = completion_query.first()
     if not completion:
-        completion = DepartmentTaskCompletion(
-            task_id=task.id,
-            department_id=current_user.department_id,
-            is_completed=False
-        )
-        db.session.add(completion)
+        insert_ignore(DepartmentTaskCompletion, [
+            {'task_id': task.id, 'department_id': current_user.department_id, 'is_completed': False}
+        ])
+        completion = completion_query.first()
+    
+    # The form carries the version it was rendered from (0 before the row existed, which is the
+    # same state as a fresh row); toggling from a stale page would undo someone else's click
+    seen_version = request.form.get('version', type=int)
+    if seen_version is not None and max(seen_version, 1) != completion.version_id:
+        db.session.rollback()
+        return conflict_response(task_id)
     
     # Toggle completion status
     completion.is_completed = not completion.is_completed
     if completion.is_completed:
         completion.completed_at = datetime.utcnow()
         completion.completed_by_id = current_user.id
-        flash('Your department has been marked as completed for this task', 'success')
     else:
         completion.completed_at = None
         completion.completed_by_id = None
-        flash('Your department completion status has been removed', 'info')
     
-    # Update overall task status
+    # Update overall task status. Touching the task bumps its version too, so two departments
+    # completing at the same time cannot both compute the overall status from stale rows.
     _update_task_completion_status(task)
+    task.updated_at = datetime.utcnow()
     
+    record_activity('department_completed' if completion.is_completed else 'department_reopened', task,
+                    department_id=current_user.department_id)
+    # A lost race raises StaleDataError here, answered by the app's conflict handler
     db.session.commit()
+    if completion.is_completed:
+        flash('Your department has been marked as completed for this task', 'success')
+    else:
+        flash('Your department completion status has been removed', 'info')
     return redirect(url_for('tasks.view_task', task_id=task_id))
 
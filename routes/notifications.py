@@ -1,7 +1,8 @@
 from flask import Blueprint, request, jsonify
 from flask_login import login_required, current_user
-from models import db, User, FCMDevice
-from utils import role_required
+from models import db, User, FCMDevice, Notification
+from utils import role_required, parse_id_list
+from inbox import serialize_notification
 from datetime import datetime
 
 notifications_bp = Blueprint('notifications', __name__)
@@ -101,3 +102,65 @@ def get_user_devices():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+
+NOTIFICATIONS_PAGE_SIZE = 50
+
+@notifications_bp.route('', methods=['GET'])
+@login_required
+def list_notifications():
+    """Inbox of the current user, newest first. Page with ?before=<id> (the previous page's next_before)."""
+    limit = min(max(request.args.get('limit', NOTIFICATIONS_PAGE_SIZE, type=int), 1), NOTIFICATIONS_PAGE_SIZE)
+    before = request.args.get('before', type=int)
+    
+    query = Notification.query.filter(Notification.user_id == current_user.id)
+    if request.args.get('unread'):
+        query = query.filter(Notification.read_at.is_(None))
+    if before:
+        query = query.filter(Notification.id < before)
+    # One extra row tells whether another page exists
+    notifications = query.order_by(Notification.id.desc()).limit(limit + 1).all()
+    has_more = len(notifications) > limit
+    notifications = notifications[:limit]
+    
+    return jsonify({
+        'success': True,
+        'notifications': [serialize_notification(n) for n in notifications],
+        'next_before': notifications[-1].id if has_more else None,
+    }), 200
+
+@notifications_bp.route('/<int:notification_id>', methods=['GET'])
+@login_required
+def get_notification(notification_id):
+    """One notification, for pushes that only carry its id"""
+    notification = Notification.query.filter_by(id=notification_id, user_id=current_user.id).first()
+    if notification is None:
+        return jsonify({'success': False, 'message': 'Notification not found'}), 404
+    return jsonify({'success': True, 'notification': serialize_notification(notification)}), 200
+
+@notifications_bp.route('/unread-count', methods=['GET'])
+@login_required
+def unread_count():
+    """Unread notifications of the current user, counted on the (user_id, read_at) index"""
+    count = Notification.query.filter(
+        Notification.user_id == current_user.id,
+        Notification.read_at.is_(None)
+    ).count()
+    return jsonify({'success': True, 'unread': count}), 200
+
+@notifications_bp.route('/mark-read', methods=['POST'])
+@login_required
+def mark_read():
+    """Mark notifications as read in one UPDATE: {"ids": [1, 2]} or {"all": true}"""
+    data = request.get_json(silent=True) or {}
+    query = Notification.query.filter(
+        Notification.user_id == current_user.id,
+        Notification.read_at.is_(None)
+    )
+    if not data.get('all'):
+        ids = parse_id_list(data.get('ids') or [])
+        if not ids:
+            return jsonify({'success': False, 'message': 'ids or all is required'}), 400
+        query = query.filter(Notification.id.in_(ids))
+    updated = query.update({Notification.read_at: datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return jsonify({'success': True, 'updated': updated}), 200
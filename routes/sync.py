@@ -0,0 +1,232 @@
+import json
+import queue
+import time
+from datetime import datetime, timedelta
+from flask import Blueprint, Response, current_app, request, jsonify
+from flask_login import login_required, current_user
+from sqlalchemy import func
+from events import get_event_broker, event_for_user
+from models import db, Task, TaskAssignment, Subtask, DepartmentTaskCompletion, TaskChange
+from utils import accessible_tasks_clause, filter_accessible_task_ids
+
+sync_bp = Blueprint('sync', __name__)
+
+MAX_CHANGES_PER_PAGE = 500
+
+# Changes that alter the task itself or can grant/revoke access send the whole task
+AGGREGATE_ENTITY_TYPES = {'task', 'assignment', 'department_assignment'}
+ROW_ENTITY_TYPES = {'assignment', 'subtask', 'completion'}
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+def _serialize_task(task):
+    return {
+        'id': task.id,
+        'task_name': task.task_name,
+        'description': task.description,
+        'priority': task.priority,
+        'status': task.status,
+        'department_id': task.department_id,
+        'created_by_id': task.created_by_id,
+        'client_name': task.client_name,
+        'deadline': _isoformat(task.deadline),
+        'remark': task.remark,
+        'subtasks_total': task.subtasks_total,
+        'subtasks_done': task.subtasks_done,
+        'created_at': _isoformat(task.created_at),
+        'updated_at': _isoformat(task.updated_at),
+    }
+
+def _serialize_assignment(assignment):
+    return {
+        'id': assignment.id,
+        'task_id': assignment.task_id,
+        'user_id': assignment.user_id,
+        'assigned_by_id': assignment.assigned_by_id,
+        'assigned_at': _isoformat(assignment.assigned_at),
+    }
+
+def _serialize_subtask(subtask):
+    return {
+        'id': subtask.id,
+        'task_id': subtask.task_id,
+        'subtask_name': subtask.subtask_name,
+        'description': subtask.description,
+        'status': subtask.status,
+        'created_by_id': subtask.created_by_id,
+        'created_at': _isoformat(subtask.created_at),
+        'updated_at': _isoformat(subtask.updated_at),
+    }
+
+def _serialize_completion(completion):
+    return {
+        'id': completion.id,
+        'task_id': completion.task_id,
+        'department_id': completion.department_id,
+        'is_completed': completion.is_completed,
+        'completed_at': _isoformat(completion.completed_at),
+        'completed_by_id': completion.completed_by_id,
+    }
+
+def _settled_before():
+    """Changes logged after this time are not handed out yet: a transaction that took a lower id
+    may still be committing, and a cursor past it would skip that change for good"""
+    return datetime.utcnow() - timedelta(seconds=current_app.config.get('SYNC_SAFETY_WINDOW_SECONDS', 5))
+
+def _load_payload(task_ids, row_ids=None):
+    """Load whole tasks for task_ids plus individual child rows from row_ids, one query per type"""
+    row_ids = row_ids or {}
+    payload = {'tasks': [], 'assignments': [], 'subtasks': [], 'completions': []}
+
+    children = (
+        ('assignments', 'assignment', TaskAssignment, _serialize_assignment),
+        ('subtasks', 'subtask', Subtask, _serialize_subtask),
+        ('completions', 'completion', DepartmentTaskCompletion, _serialize_completion),
+    )
+    if task_ids:
+        payload['tasks'] = [_serialize_task(t) for t in Task.query.filter(Task.id.in_(task_ids)).all()]
+    for key, entity_type, model, serialize in children:
+        ids = row_ids.get(entity_type, set())
+        if not task_ids and not ids:
+            continue
+        query = model.query.filter(db.or_(model.task_id.in_(task_ids), model.id.in_(ids)))
+        payload[key] = [serialize(row) for row in query.all()]
+    return payload
+
+@sync_bp.route('/changes', methods=['GET'])
+@login_required
+def task_changes():
+    """Incremental task sync for the mobile app.
+
+    Without `since` returns a full snapshot of the visible tasks; otherwise returns the
+    tasks, assignments, subtasks and completions changed after the cursor, plus
+    tombstones for deleted rows and for tasks the user could see before and no longer can. Changes younger
+    than SYNC_SAFETY_WINDOW_SECONDS are left for the next call. A cursor older than the oldest
+    kept change (see `flask purge-task-changes`) gets 410 Gone: sync again without `since`.
+    """
+    since = request.args.get('since', type=int)
+    limit = max(1, min(request.args.get('limit', MAX_CHANGES_PER_PAGE, type=int), MAX_CHANGES_PER_PAGE))
+
+    settled_before = _settled_before()
+    if since is None:
+        # Take the cursor first so changes made during the snapshot are not missed (changes
+        # inside the safety window are sent again; applying them twice is harmless)
+        cursor = db.session.query(func.max(TaskChange.id)).filter(TaskChange.changed_at <= settled_before).scalar()
+        if cursor is None:
+            cursor = max((db.session.query(func.min(TaskChange.id)).scalar() or 1) - 1, 0)
+        query = Task.query.with_entities(Task.id)
+        clause = accessible_tasks_clause(current_user)
+        if clause is not None:
+            query = query.filter(clause)
+        payload = _load_payload({row.id for row in query.all()})
+        return jsonify({'success': True, 'cursor': cursor, 'has_more': False, 'deleted': [], **payload}), 200
+
+    oldest = db.session.query(func.min(TaskChange.id)).scalar()
+    if oldest is not None and since < oldest - 1:
+        return jsonify({'success': False, 'resync_required': True,
+                        'message': 'Changes after this cursor were purged; sync again without since'}), 410
+
+    changes = TaskChange.query.filter(TaskChange.id > since).order_by(TaskChange.id).limit(limit + 1).all()
+    # Stop at the first change inside the safety window; the client picks it up next time
+    settled = next((index for index, change in enumerate(changes) if change.changed_at > settled_before), len(changes))
+    changes = changes[:settled]
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    cursor = changes[-1].id if changes else since
+
+    # Only the latest operation per entity matters; who may have lost access is collected over all of them
+    latest = {}
+    former_audiences = {}
+    for change in changes:
+        latest[(change.entity_type, change.entity_id)] = change
+        if change.task_id is not None and change.former_audience:
+            former = former_audiences.setdefault(change.task_id, (set(), set()))
+            audience = json.loads(change.former_audience)
+            former[0].update(audience.get('department_ids', ()))
+            former[1].update(audience.get('user_ids', ()))
+
+    def could_see(task_id):
+        """Whether the user was in the task's audience before these changes (event_for_user's rules)"""
+        department_ids, user_ids = former_audiences.get(task_id, (set(), set()))
+        event = {'task_id': task_id, 'status': None, 'created': False, 'deleted': True,
+                 'department_ids': set(), 'user_ids': set(),
+                 'former_department_ids': department_ids, 'former_user_ids': user_ids}
+        return event_for_user(event, current_user.id, current_user.role, current_user.department_id) is not None
+
+    visible_task_ids = filter_accessible_task_ids(
+        current_user, {c.task_id for c in latest.values() if c.task_id is not None}
+    )
+
+    deleted_tasks = set()
+    deleted_rows = []
+    aggregate_task_ids = set()
+    row_ids = {}
+    for (entity_type, entity_id), change in latest.items():
+        if entity_type == 'task' and change.operation == 'delete':
+            if could_see(entity_id):
+                deleted_tasks.add(entity_id)
+        elif change.task_id not in visible_task_ids:
+            # This change may have revoked access; only users who could see the task are told
+            if entity_type in AGGREGATE_ENTITY_TYPES and could_see(change.task_id):
+                deleted_tasks.add(change.task_id)
+        elif change.operation == 'delete':
+            if entity_type in ROW_ENTITY_TYPES:
+                deleted_rows.append({'type': entity_type, 'id': entity_id})
+        elif entity_type in AGGREGATE_ENTITY_TYPES:
+            aggregate_task_ids.add(change.task_id)
+        elif entity_type in ROW_ENTITY_TYPES:
+            row_ids.setdefault(entity_type, set()).add(entity_id)
+
+    payload = _load_payload(aggregate_task_ids, row_ids)
+    deleted = [{'type': 'task', 'id': task_id} for task_id in sorted(deleted_tasks)] + deleted_rows
+
+    return jsonify({'success': True, 'cursor': cursor, 'has_more': has_more, 'deleted': deleted, **payload}), 200
+
+@sync_bp.route('/events', methods=['GET'])
+@login_required
+def task_events():
+    """Server-sent events stream of task changes visible to the current user.
+
+    Each message is a batch of {task_id, status, created, deleted, removed} objects. The stream
+    closes after EVENTS_MAX_STREAM_SECONDS and the browser reconnects on its own. With
+    EVENTS_MAX_STREAMS_PER_WORKER streams already open in this process it answers 503 with Retry-After.
+    """
+    # Plain values: the stream runs after the request context (and DB session) is gone
+    user_id, role, department_id = current_user.id, current_user.role, current_user.department_id
+    config = current_app.config
+    heartbeat = config.get('EVENTS_HEARTBEAT_SECONDS', 15)
+    max_duration = config.get('EVENTS_MAX_STREAM_SECONDS', 300)
+    broker = get_event_broker()
+    subscription = broker.subscribe(limit=config.get('EVENTS_MAX_STREAMS_PER_WORKER', 0))
+    if subscription is None:
+        retry_after = config.get('EVENTS_RETRY_AFTER_SECONDS', 30)
+        return jsonify({'success': False, 'message': 'Too many live update streams, try again later'}), 503, {
+            'Retry-After': str(retry_after)}
+
+    def stream():
+        try:
+            yield 'retry: 5000\n\n'
+            deadline = time.monotonic() + max_duration
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    events = subscription.get(timeout=min(heartbeat, remaining))
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                visible = [e for e in (event_for_user(e, user_id, role, department_id) for e in events) if e]
+                if visible:
+                    yield f'event: tasks\ndata: {json.dumps(visible)}\n\n'
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Disable proxy buffering (nginx)
+    })
+    # Also frees the slot when the client leaves before the stream started
+    response.call_on_close(lambda: broker.unsubscribe(subscription))
+    return response
@@ -1,11 +1,13 @@
-from flask import Blueprint, request, redirect, url_for, flash, jsonify, render_template
+from flask import Blueprint, abort, request, redirect, url_for, flash, jsonify, render_template
 from flask_login import login_required, current_user
-from models import db, Task, Subtask, TaskDepartmentAssignment, DepartmentTaskCompletion, TaskApprovalRequest
-from utils import can_access_task
+from models import db, Task, Subtask
+from utils import can_access_task, conditional_view, load_task_detail, refresh_subtask_counts, parse_id_list, SUBTASK_STATUSES
 from datetime import datetime
 
 tasks_bp = Blueprint('tasks', __name__)
 
+SUBTASK_BATCH_LIMIT = 200
+
 @tasks_bp.route('/<int:task_id>/subtasks/add', methods=['POST'])
 @login_required
 def add_subtask(task_id):
@@ -25,6 +27,8 @@ def add_subtask(task_id):
         created_by_id=current_user.id
     )
     db.session.add(subtask)
+    db.session.flush()
+    refresh_subtask_counts([task.id])
     db.session.commit()
     flash('Subtask added successfully', 'success')
     
@@ -48,6 +52,8 @@ def update_subtask_status(subtask_id):
     
     new_status = request.form.get('status')
     subtask.status = new_status
+    db.session.flush()
+    refresh_subtask_counts([task.id])
     db.session.commit()
     flash('Subtask status updated successfully', 'success')
     
@@ -59,27 +65,84 @@ def update_subtask_status(subtask_id):
     else:
         return redirect(url_for('team_member.dashboard'))
 
+@tasks_bp.route('/<int:task_id>/subtasks/batch', methods=['POST'])
+@login_required
+def batch_subtasks(task_id):
+    """Create and update many subtasks of a task in one transaction.
+    Body: {"create": [{"subtask_name": ..., "description": ...}], "update": [{"id": ..., "status": ...}]}"""
+    task = Task.query.get_or_404(task_id)
+    if not can_access_task(current_user, task):
+        return jsonify({'success': False, 'message': 'You do not have permission to access this task'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    creates = data.get('create') or []
+    updates = data.get('update') or []
+    if not isinstance(creates, list) or not isinstance(updates, list) or not (creates or updates):
+        return jsonify({'success': False, 'message': 'create or update is required'}), 400
+    if len(creates) + len(updates) > SUBTASK_BATCH_LIMIT:
+        return jsonify({'success': False, 'message': f'At most {SUBTASK_BATCH_LIMIT} subtasks per batch'}), 400
+    
+    new_subtasks = []
+    for item in creates:
+        name = (item.get('subtask_name') or '').strip() if isinstance(item, dict) else ''
+        if not name:
+            return jsonify({'success': False, 'message': 'subtask_name is required'}), 400
+        new_subtasks.append(Subtask(task_id=task.id, subtask_name=name,
+                                    description=item.get('description', ''), created_by_id=current_user.id))
+    
+    # Group status changes so each status is a single UPDATE
+    ids_by_status = {}
+    for item in updates:
+        status = item.get('status') if isinstance(item, dict) else None
+        ids = parse_id_list([item.get('id')]) if isinstance(item, dict) else []
+        if status not in SUBTASK_STATUSES or not ids:
+            return jsonify({'success': False, 'message': f'Each update needs an id and a status in {", ".join(SUBTASK_STATUSES)}'}), 400
+        ids_by_status.setdefault(status, set()).update(ids)
+    requested = set().union(*ids_by_status.values()) if ids_by_status else set()
+    if len(requested) != len(updates):
+        return jsonify({'success': False, 'message': 'Each subtask can be updated once per batch'}), 400
+    if requested:
+        found = {row[0] for row in db.session.query(Subtask.id).filter(Subtask.task_id == task.id, Subtask.id.in_(requested))}
+        if found != requested:
+            return jsonify({'success': False, 'message': f'Subtasks not found on this task: {sorted(requested - found)}'}), 400
+    
+    db.session.add_all(new_subtasks)
+    db.session.flush()
+    updated = 0
+    for status, ids in ids_by_status.items():
+        updated += Subtask.query.filter(Subtask.id.in_(ids), Subtask.status != status).update(
+            {Subtask.status: status}, synchronize_session=False
+        )
+    refresh_subtask_counts([task.id])
+    db.session.commit()
+    
+    return jsonify({
+        'success': True,
+        'created': [subtask.id for subtask in new_subtasks],
+        'updated': updated,
+        'subtasks_total': task.subtasks_total,
+        'subtasks_done': task.subtasks_done,
+    }), 200
+
 @tasks_bp.route('/<int:task_id>')
 @login_required
+@conditional_view
 def view_task(task_id):
-    task = Task.query.get_or_404(task_id)
+    task = load_task_detail(task_id)
+    if task is None:
+        abort(404)
     
     if not can_access_task(current_user, task):
         flash('You do not have permission to access this task', 'error')
         return redirect(url_for('index'))
     
-    # Get department assignments and completion status
-    dept_assignments = TaskDepartmentAssignment.query.filter_by(task_id=task_id).all()
-    dept_completions = {}
-    for dept_assignment in dept_assignments:
-        completion = DepartmentTaskCompletion.query.filter_by(
-            task_id=task_id,
-            department_id=dept_assignment.department_id
-        ).first()
-        dept_completions[dept_assignment.department_id] = completion
-    
-    # Get approval requests for this task (both pending and processed)
-    approval_requests = TaskApprovalRequest.query.filter_by(task_id=task_id).order_by(TaskApprovalRequest.created_at.desc()).all()
+    # Department assignments and completion status, from the loaded collections
+    dept_assignments = sorted(task.department_assignments, key=lambda a: a.id)
+    completions = {c.department_id: c for c in task.department_completions}
+    dept_completions = {a.department_id: completions.get(a.department_id) for a in dept_assignments}
+    
+    # Approval requests for this task (both pending and processed), newest first
+    approval_requests = sorted(task.approval_requests, key=lambda r: (r.created_at, r.id), reverse=True)
     
     return render_template('shared/task_detail.html', 
                          task=task, 
@@ -1,12 +1,19 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
-from models import db, Task, TaskAssignment, Subtask, TaskDepartmentAssignment, DepartmentTaskCompletion
+from models import db, Task, TaskAssignment, Subtask, TaskDepartmentAssignment, DepartmentTaskCompletion, TASK_STATUSES
+from task_status import set_task_statuses
+from activity import record_activity, record_status_changes
+from replicas import replica_read
+from idempotency import new_idempotency_key, request_idempotency_key, find_idempotent_result, remember_idempotent_result, commit_or_replay
+from utils import parse_id_list, filter_accessible_task_ids, update_task_completion_statuses, conditional_view, overdue_tasks_clause, conflict_response
 from datetime import datetime
 
 team_member_bp = Blueprint('team_member', __name__)
 
 @team_member_bp.route('/dashboard')
 @login_required
+@replica_read
+@conditional_view
 def dashboard():
     # Get tasks assigned to current user
     assigned_task_ids = [a.task_id for a in TaskAssignment.query.filter_by(user_id=current_user.id).all()]
@@ -30,16 +37,20 @@ def dashboard():
             tasks_query = tasks_query.filter(Task.priority == priority)
         if client_name:
             tasks_query = tasks_query.filter(Task.client_name.ilike(f'%{client_name}%'))
+        if request.args.get('overdue'):
+            tasks_query = tasks_query.filter(overdue_tasks_clause())
         
         tasks = tasks_query.order_by(Task.created_at.desc()).all()
     
     return render_template('team_member/dashboard.html', 
                          tasks=tasks,
+                         task_statuses=TASK_STATUSES,
                          filters={
                              'task_name': request.args.get('task_name', ''),
                              'status': request.args.get('status', ''),
                              'priority': request.args.get('priority', ''),
-                             'client_name': request.args.get('client_name', '')
+                             'client_name': request.args.get('client_name', ''),
+                             'overdue': request.args.get('overdue', '')
                          })
 
 @team_member_bp.route('/tasks/create', methods=['GET', 'POST'])
@@ -50,6 +61,12 @@ def create_task():
         return redirect(url_for('team_member.dashboard'))
     
     if request.method == 'POST':
+        # A repeated submit (double-click, retry) gets the task created the first time
+        idempotency_key = request_idempotency_key()
+        if find_idempotent_result(idempotency_key) is not None:
+            flash('This task was already created', 'info')
+            return redirect(url_for('team_member.dashboard'))
+        
         task_name = request.form.get('task_name')
         description = request.form.get('description', '')
         priority = request.form.get('priority')
@@ -73,6 +90,7 @@ def create_task():
         )
         db.session.add(task)
         db.session.flush()  # Flush to get task.id without committing
+        remember_idempotent_result(idempotency_key, task.id)
         
         # Auto-assign task to the team member who created it
         assignment = TaskAssignment(
@@ -81,7 +99,10 @@ def create_task():
             assigned_by_id=current_user.id
         )
         db.session.add(assignment)
-        db.session.commit()
+        record_activity('task_created', task, details={'task_name': task.task_name, 'priority': task.priority})
+        if not commit_or_replay(idempotency_key):
+            flash('This task was already created', 'info')
+            return redirect(url_for('team_member.dashboard'))
         
         # Log task creation
         from flask import current_app
@@ -89,13 +110,13 @@ def create_task():
             current_app.logger.info(f"Task CREATED (Team Member) - ID: {task.id}, Name: '{task.task_name}', Priority: {task.priority}, Department ID: {task.department_id}, Created by: {current_user.email} (ID: {current_user.id})")
         
         # Send FCM notification to self (since task is auto-assigned)
-        from utils import send_task_assignment_notification
-        send_task_assignment_notification(current_user, task, current_user)
+        from notification_queue import queue_task_assignment_notification
+        queue_task_assignment_notification(current_user, task, current_user)
         
         flash('Task created successfully', 'success')
         return redirect(url_for('team_member.dashboard'))
     
-    return render_template('team_member/create_task.html')
+    return render_template('team_member/create_task.html', idempotency_key=new_idempotency_key())
 
 @team_member_bp.route('/tasks/<int:task_id>/update-status', methods=['POST'])
 @login_required
@@ -108,8 +129,15 @@ def update_task_status(task_id):
         flash('You are not assigned to this task', 'error')
         return redirect(url_for('team_member.dashboard'))
     
+    # The form carries the version it was rendered from, so a stale page cannot overwrite a newer change
+    seen_version = request.form.get('version', type=int)
+    if seen_version is not None and seen_version != task.version_id:
+        return conflict_response(task_id)
+    
     new_status = request.form.get('status')
     
+    if task.status != new_status:
+        record_activity('status_changed', task, details={'status': [task.status, new_status]})
     task.status = new_status
     
     # If task has department assignments and status is COMPLETED,
@@ -137,3 +165,35 @@ def update_task_status(task_id):
     db.session.commit()
     return redirect(url_for('team_member.dashboard'))
 
+@team_member_bp.route('/tasks/bulk', methods=['POST'])
+@login_required
+def bulk_tasks():
+    """Update the status of many assigned tasks in one request"""
+    action = request.form.get('action')
+    # Only tasks assigned to the current user (checked in one query)
+    task_ids = filter_accessible_task_ids(current_user, parse_id_list(request.form.getlist('task_ids[]')))
+    
+    if not task_ids:
+        flash('No tasks selected', 'error')
+        return redirect(url_for('team_member.dashboard'))
+    
+    if action != 'status':
+        flash('Unknown bulk action', 'error')
+        return redirect(url_for('team_member.dashboard'))
+    
+    new_status = request.form.get('status')
+    if new_status not in TASK_STATUSES:
+        flash('Invalid status selected', 'error')
+        return redirect(url_for('team_member.dashboard'))
+    
+    record_status_changes(set_task_statuses(task_ids, new_status), {'bulk': True})
+    # Tasks split across departments follow their department completions
+    record_status_changes(update_task_completion_statuses(task_ids), {'bulk': True})
+    db.session.commit()
+    
+    from flask import current_app
+    if current_app:
+        current_app.logger.info(f"Tasks BULK STATUS (Team Member) - {len(task_ids)} task(s) set to '{new_status}' by {current_user.email} (ID: {current_user.id}), Task IDs: {sorted(task_ids)}")
+    
+    flash(f'Status updated for {len(task_ids)} task(s)', 'success')
+    return redirect(url_for('team_member.dashboard'))
@@ -0,0 +1,317 @@
+"""
+Change tracking for tasks and their child rows.
+
+Every flush and every ORM bulk UPDATE/DELETE on a tracked model appends TaskChange
+rows in the same transaction, so TaskChange.id is a monotonically increasing cursor
+for incremental sync (see routes/sync.py). Bulk INSERTs are logged explicitly with
+record_bulk_inserts(). User and department edits are logged with
+no task_id; they only advance the page version used for conditional GETs.
+
+The same capture builds one live event per touched task, routed to the departments
+and users that can see it, and publishes them once the transaction commits (see events.py).
+Each change also stores the departments and users that may have lost access through it, so
+sync only sends task tombstones to users who could see the task before.
+"""
+import json
+from datetime import datetime
+from sqlalchemy import event, inspect, null, select
+from sqlalchemy.sql.expression import ColumnClause
+from extensions import db
+from models import User, Department, Task, TaskAssignment, Subtask, TaskDepartmentAssignment, DepartmentTaskCompletion, TaskApprovalRequest, TaskChange
+
+TRACKED_ENTITIES = {
+    Task: 'task',
+    TaskAssignment: 'assignment',
+    Subtask: 'subtask',
+    DepartmentTaskCompletion: 'completion',
+    TaskDepartmentAssignment: 'department_assignment',
+    TaskApprovalRequest: 'approval',
+    User: 'user',
+    Department: 'department',
+}
+
+# Entities that are not rows of a single task
+DIRECTORY_ENTITIES = {'user', 'department'}
+
+# Rows removed by ON DELETE CASCADE when a user or department is deleted. The ORM never
+# sees them, so they are looked up before the delete runs. Children of a deleted task
+# are not logged: clients drop them together with the task tombstone.
+CASCADED_CHILDREN = {
+    User: ((TaskAssignment, TaskAssignment.user_id),),
+    Department: ((TaskDepartmentAssignment, TaskDepartmentAssignment.department_id),
+                 (DepartmentTaskCompletion, DepartmentTaskCompletion.department_id)),
+}
+
+# Child rows that grant visibility by themselves; whoever they point at must also get
+# the live event when the row is removed (and is then told the task left their scope)
+AUDIENCE_HINTS = {
+    TaskAssignment: 'user_id',
+    TaskDepartmentAssignment: 'department_id',
+    DepartmentTaskCompletion: 'department_id',
+}
+
+TASK_CHANGE_COLUMNS = ('entity_type', 'entity_id', 'task_id', 'operation', 'changed_at', 'former_audience')
+
+# Bookkeeping columns clients never see: bulk UPDATEs that only set these (e.g. the deadline
+# reminder markers, see jobs.send_deadline_reminders) are not logged and publish no events
+UNTRACKED_COLUMNS = {
+    Task: {'deadline_reminder_sent_at', 'overdue_notified_at'},
+}
+
+def init_change_tracking():
+    """Attach the change capture listeners to the Flask-SQLAlchemy session (idempotent)"""
+    for name, listener in (('before_flush', _before_flush),
+                           ('after_flush', _after_flush),
+                           ('do_orm_execute', _capture_bulk_changes),
+                           ('after_commit', _publish_events),
+                           ('after_rollback', _discard_events)):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
+
+def _task_id_of(entity_type, obj):
+    if entity_type == 'task':
+        return obj.id
+    if entity_type in DIRECTORY_ENTITIES:
+        return None
+    return obj.task_id
+
+def _task_id_column(model):
+    if model is Task:
+        return model.id
+    if TRACKED_ENTITIES[model] in DIRECTORY_ENTITIES:
+        return null()
+    return model.task_id
+
+def _hint_column(model):
+    return getattr(model, AUDIENCE_HINTS[model]) if model in AUDIENCE_HINTS else null()
+
+def _hint_of(obj):
+    column = AUDIENCE_HINTS.get(type(obj))
+    return (column, obj.__dict__.get(column)) if column else None
+
+def _change_row(entity_type, entity_id, task_id, operation, changed_at, hint=None, created=False, former=None):
+    return {
+        'entity_type': entity_type,
+        'entity_id': entity_id,
+        'task_id': task_id,
+        'operation': operation,
+        'changed_at': changed_at,
+        # Stored with the hint as former_audience; the hint also routes live events
+        'former': former,
+        'hint': hint,
+        'created': created,
+    }
+
+def _former_audience(row):
+    """JSON of the departments and users that may no longer see the row's task, or None"""
+    former = row['former'] or {}
+    department_ids = set(former.get('department_ids', ()))
+    user_ids = set(former.get('user_ids', ()))
+    if row['hint'] and row['hint'][1] is not None:
+        column, value = row['hint']
+        (user_ids if column == 'user_id' else department_ids).add(value)
+    department_ids.discard(None)
+    if not (department_ids or user_ids):
+        return None
+    return json.dumps({'department_ids': sorted(department_ids), 'user_ids': sorted(user_ids)})
+
+def _cascaded_deletes(connection, model, ids, changed_at):
+    """Change rows for children the database will remove when rows of model are deleted"""
+    rows = []
+    for child, parent_column in CASCADED_CHILDREN.get(model, ()):
+        query = select(child.id, child.task_id, _hint_column(child)).where(parent_column.in_(ids))
+        for child_id, task_id, hint_value in connection.execute(query):
+            rows.append(_change_row(TRACKED_ENTITIES[child], child_id, task_id, 'delete', changed_at,
+                                    hint=(AUDIENCE_HINTS[child], hint_value)))
+    return rows
+
+def _write_changes(connection, rows):
+    if rows:
+        connection.execute(TaskChange.__table__.insert(), [
+            {**{column: row[column] for column in TASK_CHANGE_COLUMNS if column != 'former_audience'},
+             'former_audience': _former_audience(row)} for row in rows])
+
+def _task_audiences(connection, task_ids):
+    """Current status, departments and assignees of tasks, used to route live events"""
+    audiences = {}
+    task_ids = {task_id for task_id in task_ids if task_id is not None}
+    if not task_ids:
+        return audiences
+    for task_id, department_id, status in connection.execute(
+            select(Task.id, Task.department_id, Task.status).where(Task.id.in_(task_ids))):
+        audiences[task_id] = {'status': status, 'department_ids': {department_id}, 'user_ids': set()}
+    if not audiences:
+        return audiences
+    for task_id, department_id in connection.execute(
+            select(TaskDepartmentAssignment.task_id, TaskDepartmentAssignment.department_id)
+            .where(TaskDepartmentAssignment.task_id.in_(audiences))):
+        audiences[task_id]['department_ids'].add(department_id)
+    for task_id, user_id in connection.execute(
+            select(TaskAssignment.task_id, TaskAssignment.user_id).where(TaskAssignment.task_id.in_(audiences))):
+        audiences[task_id]['user_ids'].add(user_id)
+    return audiences
+
+def _queue_events(session, rows, audiences):
+    """Merge change rows into one pending live event per task (published after commit)"""
+    events = session.info.setdefault('task_events', {})
+    for row in rows:
+        task_id = row['task_id']
+        if task_id is None:
+            continue
+        event = events.setdefault(task_id, {
+            'task_id': task_id, 'status': None, 'created': False, 'deleted': False,
+            'department_ids': set(), 'user_ids': set(),
+            'former_department_ids': set(), 'former_user_ids': set(),
+        })
+        audience = audiences.get(task_id)
+        if audience:
+            # Later flushes in the transaction see the newer state
+            event['status'] = audience['status']
+            event['department_ids'] = set(audience['department_ids'])
+            event['user_ids'] = set(audience['user_ids'])
+        if row['hint'] and row['hint'][1] is not None:
+            # May have lost access through this row; told so when not in the current audience
+            column, value = row['hint']
+            event['former_user_ids' if column == 'user_id' else 'former_department_ids'].add(value)
+        if row['entity_type'] == 'task':
+            event['created'] = event['created'] or row['created']
+            event['deleted'] = row['operation'] == 'delete'
+
+def _before_flush(session, flush_context, instances):
+    # Cascaded children and the audience of deleted tasks must be captured while they still exist
+    deleted_ids = {}
+    for obj in session.deleted:
+        if type(obj) in CASCADED_CHILDREN or type(obj) is Task:
+            deleted_ids.setdefault(type(obj), []).append(obj.id)
+    if not deleted_ids:
+        return
+    connection = session.connection()
+    changed_at = datetime.utcnow()
+    pending = session.info.setdefault('pending_task_changes', [])
+    for model, ids in deleted_ids.items():
+        pending.extend(_cascaded_deletes(connection, model, ids, changed_at))
+    if Task in deleted_ids:
+        session.info.setdefault('deleted_task_audiences', {}).update(_task_audiences(connection, deleted_ids[Task]))
+
+def _after_flush(session, flush_context):
+    changed_at = datetime.utcnow()
+    rows = session.info.pop('pending_task_changes', [])
+    audiences = session.info.pop('deleted_task_audiences', {})
+
+    for obj in session.new:
+        entity_type = TRACKED_ENTITIES.get(type(obj))
+        if entity_type:
+            rows.append(_change_row(entity_type, obj.id, _task_id_of(entity_type, obj), 'upsert', changed_at,
+                                    hint=_hint_of(obj), created=entity_type == 'task'))
+
+    for obj in session.dirty:
+        entity_type = TRACKED_ENTITIES.get(type(obj))
+        if entity_type and session.is_modified(obj, include_collections=False):
+            former = None
+            if entity_type == 'task':
+                # Moving a task to another department hides it from the previous one
+                previous = inspect(obj).attrs.department_id.history.deleted
+                former = {'department_ids': set(previous)} if previous else None
+            rows.append(_change_row(entity_type, obj.id, _task_id_of(entity_type, obj), 'upsert', changed_at,
+                                    hint=_hint_of(obj), former=former))
+
+    for obj in session.deleted:
+        entity_type = TRACKED_ENTITIES.get(type(obj))
+        if entity_type:
+            # The row is gone, so read the loaded state instead of triggering a refresh
+            entity_id = inspect(obj).identity[0]
+            task_id = entity_id if entity_type == 'task' else obj.__dict__.get('task_id')
+            rows.append(_change_row(entity_type, entity_id, task_id, 'delete', changed_at, hint=_hint_of(obj),
+                                    former=audiences.get(entity_id) if entity_type == 'task' else None))
+
+    connection = session.connection()
+    _write_changes(connection, rows)
+    live_task_ids = {row['task_id'] for row in rows} - set(audiences)
+    _queue_events(session, rows, {**_task_audiences(connection, live_task_ids), **audiences})
+
+def _updated_columns(statement):
+    """Names of the columns an UPDATE sets, leaving out columns set to themselves"""
+    values = statement._values or dict(statement._ordered_values or ())
+    names = set()
+    for column, value in values.items():
+        name = column if isinstance(column, str) else column.key
+        if not (isinstance(value, ColumnClause) and value.key == name):
+            names.add(name)
+    return names
+
+def _capture_bulk_changes(orm_execute_state):
+    """Log rows touched by Query.update()/Query.delete(), which bypass the flush"""
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    model = mapper.class_ if mapper is not None else None
+    if model not in TRACKED_ENTITIES:
+        return
+    if orm_execute_state.is_update and model in UNTRACKED_COLUMNS:
+        if _updated_columns(orm_execute_state.statement) <= UNTRACKED_COLUMNS[model]:
+            return
+
+    where = orm_execute_state.statement.whereclause
+    session = orm_execute_state.session
+    connection = session.connection()
+    changed_at = datetime.utcnow()
+    is_delete = orm_execute_state.is_delete
+    hint_name = AUDIENCE_HINTS.get(model)
+
+    query = select(model.id, _task_id_column(model), _hint_column(model))
+    if where is not None:
+        query = query.where(where)
+    rows = [_change_row(TRACKED_ENTITIES[model], entity_id, task_id, 'delete' if is_delete else 'upsert', changed_at,
+                        hint=(hint_name, hint_value) if hint_name else None)
+            for entity_id, task_id, hint_value in connection.execute(query)]
+    if not rows:
+        return
+    if is_delete and model in CASCADED_CHILDREN:
+        rows.extend(_cascaded_deletes(connection, model, [row['entity_id'] for row in rows], changed_at))
+
+    task_ids = {row['task_id'] for row in rows}
+    if is_delete:
+        # Route events by the state before the delete
+        audiences = _task_audiences(connection, task_ids)
+        if model is Task:
+            for row in rows:
+                row['former'] = audiences.get(row['entity_id'])
+        _write_changes(connection, rows)
+        result = orm_execute_state.invoke_statement()
+    else:
+        if model is Task and 'department_id' in _updated_columns(orm_execute_state.statement):
+            # Moving tasks to another department hides them from the previous one
+            previous = dict(connection.execute(select(Task.id, Task.department_id).where(Task.id.in_(task_ids))).all())
+            for row in rows:
+                row['former'] = {'department_ids': {previous.get(row['entity_id'])}}
+        _write_changes(connection, rows)
+        # Route events by the state after the update, which also carries the new status
+        result = orm_execute_state.invoke_statement()
+        audiences = _task_audiences(connection, task_ids)
+    _queue_events(session, rows, audiences)
+    return result
+
+def record_bulk_inserts(session, model, *criteria):
+    """Log rows added with session.execute(insert(model), rows), which bypasses the flush.
+    criteria must match exactly the inserted rows; call it before the commit."""
+    connection = session.connection()
+    changed_at = datetime.utcnow()
+    entity_type = TRACKED_ENTITIES[model]
+    hint_name = AUDIENCE_HINTS.get(model)
+    query = select(model.id, _task_id_column(model), _hint_column(model)).where(*criteria)
+    rows = [_change_row(entity_type, entity_id, task_id, 'upsert', changed_at,
+                        hint=(hint_name, hint_value) if hint_name else None, created=model is Task)
+            for entity_id, task_id, hint_value in connection.execute(query)]
+    _write_changes(connection, rows)
+    _queue_events(session, rows, _task_audiences(connection, {row['task_id'] for row in rows}))
+
+def _publish_events(session):
+    events = session.info.pop('task_events', None)
+    if events:
+        from events import publish_task_events
+        publish_task_events(list(events.values()))
+
+def _discard_events(session):
+    session.info.pop('task_events', None)
+    session.info.pop('pending_task_changes', None)
+    session.info.pop('deleted_task_audiences', None)
@@ -0,0 +1,250 @@
+"""
+Task status history and flow metrics.
+
+Every status transition is appended to TaskStatusEvent from here: task creations and ORM
+changes of Task.status are picked up in the flush, bulk status changes go through
+set_task_statuses(), and bulk task inserts call record_created_tasks() (see
+jobs.generate_recurring_tasks).
+
+Lead time (creation to completion), cycle time (first move to a working status such as
+PENDING, to completion) and time in each status are computed from one indexed range scan over
+a window of transitions plus the histories of the tasks involved. `flask rollup-task-flow` stores each day's numbers in
+TaskFlowDailyStat as histograms, which flow_analytics() merges into percentiles.
+"""
+import json
+from bisect import bisect_left
+from datetime import datetime, time, timedelta
+from flask import has_request_context
+from sqlalchemy import event, func, insert, inspect, select
+from extensions import db
+from models import Department, Task, TaskStatusEvent, TaskFlowDailyStat
+
+# Upper bounds of the duration histogram buckets; the last bucket holds everything longer
+DURATION_BUCKETS_HOURS = (0.25, 0.5, 1, 2, 4, 8, 12, 24, 48, 72, 120, 168, 336, 720)
+HISTORY_CHUNK_SIZE = 500
+
+def init_status_history():
+    """Attach the status history listeners to the Flask-SQLAlchemy session (idempotent)"""
+    for name, listener in (('before_flush', _before_flush), ('after_flush', _after_flush)):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
+
+def _current_user_id():
+    if not has_request_context():
+        return None
+    from flask_login import current_user
+    return current_user.id if current_user.is_authenticated else None
+
+def _write_events(connection, transitions):
+    """Insert (task_id, department_id, from_status, to_status) transitions"""
+    if not transitions:
+        return
+    changed_at = datetime.utcnow()
+    changed_by_id = _current_user_id()
+    connection.execute(insert(TaskStatusEvent), [{
+        'task_id': task_id,
+        'department_id': department_id,
+        'from_status': from_status,
+        'to_status': to_status,
+        'changed_at': changed_at,
+        'changed_by_id': changed_by_id,
+    } for task_id, department_id, from_status, to_status in transitions])
+
+def _before_flush(session, flush_context, instances):
+    # Old statuses must be read before the flush overwrites them
+    changed = {}
+    for obj in session.dirty:
+        if type(obj) is Task and obj not in session.deleted:
+            history = inspect(obj).attrs.status.history
+            if history.added:
+                changed[obj.id] = (obj, history.deleted[0] if history.deleted else None)
+    if not changed:
+        return
+    unknown = [task_id for task_id, (_, old) in changed.items() if old is None]
+    if unknown:
+        # Status was assigned without being loaded first
+        old_statuses = dict(session.connection().execute(select(Task.id, Task.status).where(Task.id.in_(unknown))).all())
+        changed.update({task_id: (changed[task_id][0], old_statuses.get(task_id)) for task_id in unknown})
+    session.info.setdefault('pending_status_transitions', []).extend(
+        (obj.id, obj.department_id, old, obj.status) for obj, old in changed.values() if old != obj.status)
+
+def _after_flush(session, flush_context):
+    transitions = session.info.pop('pending_status_transitions', [])
+    transitions.extend((obj.id, obj.department_id, None, obj.status) for obj in session.new if type(obj) is Task)
+    _write_events(session.connection(), transitions)
+
+def set_task_statuses(task_ids, status, *criteria):
+    """Set the status of tasks (optionally narrowed by criteria) in one UPDATE and record each
+    transition. Tasks already in status are left alone. Returns the transitions made as
+    (task_id, department_id, old_status, new_status) tuples."""
+    task_ids = set(task_ids)
+    if not task_ids:
+        return []
+    rows = db.session.query(Task.id, Task.department_id, Task.status).filter(
+        Task.id.in_(task_ids), Task.status != status, *criteria
+    ).all()
+    if not rows:
+        return []
+    # Bulk UPDATEs bypass version_id_col, so the version is bumped here
+    Task.query.filter(Task.id.in_([row.id for row in rows])).update(
+        {Task.status: status, Task.version_id: Task.version_id + 1}, synchronize_session='fetch')
+    transitions = [(row.id, row.department_id, row.status, status) for row in rows]
+    _write_events(db.session.connection(), transitions)
+    return transitions
+
+def record_created_tasks(session, *criteria):
+    """Record the initial status of tasks added with a bulk insert (criteria must match exactly those rows)"""
+    connection = session.connection()
+    rows = connection.execute(select(Task.id, Task.department_id, Task.status, Task.created_at).where(*criteria)).all()
+    if rows:
+        connection.execute(insert(TaskStatusEvent), [{
+            'task_id': task_id,
+            'department_id': department_id,
+            'from_status': None,
+            'to_status': status,
+            'changed_at': created_at,
+            'changed_by_id': None,
+        } for task_id, department_id, status, created_at in rows])
+
+# Duration statistics
+
+def _new_stat():
+    return {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'histogram': [0] * (len(DURATION_BUCKETS_HOURS) + 1)}
+
+def _add_duration(stat, seconds):
+    seconds = max(seconds, 0.0)
+    stat['count'] += 1
+    stat['total_seconds'] += seconds
+    stat['max_seconds'] = max(stat['max_seconds'], seconds)
+    stat['histogram'][bisect_left(DURATION_BUCKETS_HOURS, seconds / 3600)] += 1
+
+def _merge_stat(stat, other):
+    stat['count'] += other['count']
+    stat['total_seconds'] += other['total_seconds']
+    stat['max_seconds'] = max(stat['max_seconds'], other['max_seconds'])
+    stat['histogram'] = [a + b for a, b in zip(stat['histogram'], other['histogram'])]
+
+def duration_percentile(stat, fraction):
+    """Estimate a percentile in seconds by interpolating inside the histogram bucket that holds it"""
+    if not stat['count']:
+        return None
+    target = fraction * stat['count']
+    seen = 0
+    for index, bucket_count in enumerate(stat['histogram']):
+        if bucket_count and seen + bucket_count >= target:
+            lower = DURATION_BUCKETS_HOURS[index - 1] * 3600 if index else 0.0
+            upper = DURATION_BUCKETS_HOURS[index] * 3600 if index < len(DURATION_BUCKETS_HOURS) else stat['max_seconds']
+            estimate = lower + (upper - lower) * (target - seen) / bucket_count
+            return min(estimate, stat['max_seconds'])
+        seen += bucket_count
+    return stat['max_seconds']
+
+def summarize_stat(stat):
+    """Count, average and p50/p90/p95 in hours"""
+    def hours(seconds):
+        return round(seconds / 3600, 2) if seconds is not None else None
+    return {
+        'count': stat['count'],
+        'avg_hours': hours(stat['total_seconds'] / stat['count']) if stat['count'] else None,
+        'p50_hours': hours(duration_percentile(stat, 0.50)),
+        'p90_hours': hours(duration_percentile(stat, 0.90)),
+        'p95_hours': hours(duration_percentile(stat, 0.95)),
+    }
+
+def compute_flow_stats(start, end):
+    """Flow statistics for the transitions in [start, end), keyed by (department_id, metric, status).
+    Each transition closes the time spent in the previous status; completions add lead and cycle times."""
+    events = db.session.query(TaskStatusEvent.task_id).filter(
+        TaskStatusEvent.changed_at >= start, TaskStatusEvent.changed_at < end
+    ).distinct().all()
+    task_ids = sorted(row.task_id for row in events)
+    stats = {}
+
+    def add(department_id, metric, status, seconds):
+        key = (department_id, metric, status)
+        if key not in stats:
+            stats[key] = _new_stat()
+        _add_duration(stats[key], seconds)
+
+    for offset in range(0, len(task_ids), HISTORY_CHUNK_SIZE):
+        chunk = task_ids[offset:offset + HISTORY_CHUNK_SIZE]
+        created = dict(db.session.query(Task.id, Task.created_at).filter(Task.id.in_(chunk)).all())
+        histories = {}
+        for row in db.session.query(TaskStatusEvent).filter(
+                TaskStatusEvent.task_id.in_(chunk), TaskStatusEvent.changed_at < end
+        ).order_by(TaskStatusEvent.task_id, TaskStatusEvent.changed_at, TaskStatusEvent.id):
+            histories.setdefault(row.task_id, []).append(row)
+
+        for task_id, history in histories.items():
+            created_at = created.get(task_id)
+            started_at = None
+            for index, transition in enumerate(history):
+                previous = history[index - 1] if index else None
+                if (started_at is None and transition.from_status is not None
+                        and transition.to_status not in ('ASSIGNED', 'COMPLETED')):
+                    started_at = transition.changed_at
+                if transition.changed_at < start:
+                    continue
+                if previous is not None:
+                    add(transition.department_id, 'time_in_status', previous.to_status,
+                        (transition.changed_at - previous.changed_at).total_seconds())
+                elif transition.from_status is not None and created_at:
+                    # History starts after the task was created (task predates the history table)
+                    add(transition.department_id, 'time_in_status', transition.from_status,
+                        (transition.changed_at - created_at).total_seconds())
+                if transition.to_status == 'COMPLETED':
+                    if created_at:
+                        add(transition.department_id, 'lead_time', '', (transition.changed_at - created_at).total_seconds())
+                    if started_at:
+                        add(transition.department_id, 'cycle_time', '', (transition.changed_at - started_at).total_seconds())
+    return stats
+
+def day_bounds(day):
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+def flow_analytics(days=30, department_id=None, now=None):
+    """Per-department lead time, cycle time and time-in-status summaries for the last days (UTC).
+    Rolled-up days come from TaskFlowDailyStat; days after the latest rollup are computed live."""
+    now = now or datetime.utcnow()
+    first_day = now.date() - timedelta(days=days - 1)
+    merged = {}
+
+    def merge(key, stat):
+        if key not in merged:
+            merged[key] = _new_stat()
+        _merge_stat(merged[key], stat)
+
+    last_rollup = db.session.query(func.max(TaskFlowDailyStat.day)).scalar()
+    live_from = first_day
+    if last_rollup and last_rollup >= first_day:
+        query = TaskFlowDailyStat.query.filter(TaskFlowDailyStat.day >= first_day, TaskFlowDailyStat.day <= last_rollup)
+        if department_id:
+            query = query.filter(TaskFlowDailyStat.department_id == department_id)
+        for row in query:
+            merge((row.department_id, row.metric, row.status), {
+                'count': row.count, 'total_seconds': row.total_seconds,
+                'max_seconds': row.max_seconds, 'histogram': json.loads(row.histogram),
+            })
+        live_from = last_rollup + timedelta(days=1)
+    if live_from <= now.date():
+        for key, stat in compute_flow_stats(day_bounds(live_from)[0], now).items():
+            if not department_id or key[0] == department_id:
+                merge(key, stat)
+
+    department_names = dict(db.session.query(Department.id, Department.name).filter(
+        Department.id.in_({key[0] for key in merged})).all()) if merged else {}
+    results = {}
+    for (dept_id, metric, status), stat in merged.items():
+        entry = results.setdefault(dept_id, {
+            'department_id': dept_id,
+            'department': department_names.get(dept_id, 'N/A'),
+            'lead_time': summarize_stat(_new_stat()),
+            'cycle_time': summarize_stat(_new_stat()),
+            'time_in_status': {},
+        })
+        if metric == 'time_in_status':
+            entry['time_in_status'][status] = summarize_stat(stat)
+        else:
+            entry[metric] = summarize_stat(stat)
+    return sorted(results.values(), key=lambda entry: entry['department'])
@@ -11,6 +11,11 @@ class TestConfig(Config):
     WTF_CSRF_ENABLED = False
     # Remove MySQL-specific settings for test database
     SQLALCHEMY_ENGINE_OPTIONS = {}
+    # Send notifications synchronously instead of from a timer thread, to the in-process fake
+    NOTIFICATION_COALESCE_SECONDS = 0
+    NOTIFICATION_TRANSPORT = 'fake'
+    # Changes are synced as soon as they are committed
+    SYNC_SAFETY_WINDOW_SECONDS = 0
 
 @pytest.fixture
 def app():
@@ -137,4 +137,715 @@ class TestAdminFunctionality:
         })
         response = client.get('/admin/analytics')
         assert response.status_code == 200
+    
+    def test_bulk_status_and_delete(self, client, admin_user, department):
+        """Test bulk status change and bulk delete of selected tasks."""
+        with client.application.app_context():
+            from extensions import db
+            dept = Department.query.filter_by(name='Test Department').first()
+            admin = User.query.filter_by(email='admin@test.com').first()
+            tasks = [Task(task_name=f'Bulk Task {i}', priority='URGENT', status='ASSIGNED',
+                          department_id=dept.id, created_by_id=admin.id) for i in range(5)]
+            db.session.add_all(tasks)
+            db.session.commit()
+            task_ids = [t.id for t in tasks]
+        
+        client.post('/auth/login', data={
+            'email': 'admin@test.com',
+            'password': 'admin123'
+        })
+        response = client.post('/admin/tasks/bulk', data={
+            'action': 'status',
+            'status': 'PENDING',
+            'task_ids[]': [str(task_id) for task_id in task_ids]
+        }, follow_redirects=True)
+        assert response.status_code == 200
+        with client.application.app_context():
+            assert Task.query.filter(Task.id.in_(task_ids), Task.status == 'PENDING').count() == 5
+        
+        response = client.post('/admin/tasks/bulk', data={
+            'action': 'delete',
+            'task_ids[]': [str(task_id) for task_id in task_ids[:3]]
+        }, follow_redirects=True)
+        assert response.status_code == 200
+        with client.application.app_context():
+            assert Task.query.filter(Task.id.in_(task_ids)).count() == 2
+    
+    def test_bulk_status_follows_department_completions(self, client, admin_user, department):
+        """Test bulk status change recomputes tasks split across departments from their completions."""
+        with client.application.app_context():
+            from extensions import db
+            from models import TaskDepartmentAssignment, DepartmentTaskCompletion
+            dept = Department.query.filter_by(name='Test Department').first()
+            other = Department(name='Other Department')
+            admin = User.query.filter_by(email='admin@test.com').first()
+            unfinished = Task(task_name='Unfinished', priority='URGENT', status='ASSIGNED',
+                              department_id=dept.id, created_by_id=admin.id)
+            finished = Task(task_name='Finished', priority='URGENT', status='COMPLETED',
+                            department_id=dept.id, created_by_id=admin.id)
+            db.session.add_all([other, unfinished, finished])
+            db.session.flush()
+            for t, done in ((unfinished, False), (finished, True)):
+                for d in (dept, other):
+                    db.session.add(TaskDepartmentAssignment(task_id=t.id, department_id=d.id, assigned_by_id=admin.id))
+                    db.session.add(DepartmentTaskCompletion(task_id=t.id, department_id=d.id,
+                                                            is_completed=done or d is dept))
+            db.session.commit()
+            unfinished_id, finished_id = unfinished.id, finished.id
+        
+        client.post('/auth/login', data={
+            'email': 'admin@test.com',
+            'password': 'admin123'
+        })
+        for status, task_id in (('COMPLETED', unfinished_id), ('PENDING', finished_id)):
+            response = client.post('/admin/tasks/bulk', data={
+                'action': 'status',
+                'status': status,
+                'task_ids[]': [str(task_id)]
+            }, follow_redirects=True)
+            assert response.status_code == 200
+        with client.application.app_context():
+            from models import DepartmentTaskCompletion
+            assert Task.query.get(unfinished_id).status == 'ASSIGNED'
+            assert Task.query.get(finished_id).status == 'COMPLETED'
+            assert DepartmentTaskCompletion.query.filter_by(task_id=unfinished_id, is_completed=False).count() == 1
+            assert DepartmentTaskCompletion.query.filter_by(task_id=finished_id, is_completed=True).count() == 2
+    
+    def test_bulk_assign_department(self, client, admin_user, department_head, task):
+        """Test bulk assigning tasks to a department assigns its head."""
+        client.post('/auth/login', data={
+            'email': 'admin@test.com',
+            'password': 'admin123'
+        })
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            head = User.query.filter_by(email='head@test.com').first()
+            task_id = t.id
+            head_id = head.id
+            dept_id = head.department_id
+        response = client.post('/admin/tasks/bulk', data={
+            'action': 'assign',
+            'assign_target': f'department:{dept_id}',
+            'task_ids[]': [str(task_id)]
+        }, follow_redirects=True)
+        assert response.status_code == 200
+        with client.application.app_context():
+            from models import TaskDepartmentAssignment
+            assert TaskDepartmentAssignment.query.filter_by(task_id=task_id, department_id=dept_id).count() == 1
+            assert TaskAssignment.query.filter_by(task_id=task_id, user_id=head_id).count() == 1
+    
+    def test_delete_department_with_tasks_is_refused(self, client, admin_user, task):
+        """Test a department that still owns tasks cannot be deleted."""
+        client.post('/auth/login', data={
+            'email': 'admin@test.com',
+            'password': 'admin123'
+        })
+        with client.application.app_context():
+            dept_id = Department.query.filter_by(name='Test Department').first().id
+        response = client.post(f'/admin/departments/{dept_id}/delete', follow_redirects=True)
+        assert response.status_code == 200
+        with client.application.app_context():
+            assert Department.query.get(dept_id) is not None
+    
+    def test_delete_department_detaches_members(self, client, admin_user, team_member):
+        """Test deleting a department clears its members' department."""
+        client.post('/auth/login', data={
+            'email': 'admin@test.com',
+            'password': 'admin123'
+        })
+        with client.application.app_context():
+            dept_id = Department.query.filter_by(name='Test Department').first().id
+        response = client.post(f'/admin/departments/{dept_id}/delete', follow_redirects=True)
+        assert response.status_code == 200
+        with client.application.app_context():
+            assert Department.query.get(dept_id) is None
+            member = User.query.filter_by(email='member@test.com').first()
+            assert member.department_id is None
 
+    
+    def test_approve_assign_departments_request(self, client, admin_user, department_head, task):
+        """Test an assign_departments request lists department names and assigns them on approval."""
+        with client.application.app_context():
+            from extensions import db
+            other = Department(name='Design Department')
+            db.session.add(other)
+            db.session.commit()
+            other_id = other.id
+            task_id = Task.query.filter_by(task_name='Test Task').first().id
+        
+        client.post('/auth/login', data={'email': 'head@test.com', 'password': 'head123'})
+        client.post(f'/dept-head/tasks/{task_id}/assign-departments', data={
+            'assign_to_dept[]': [str(other_id)]
+        })
+        client.get('/auth/logout')
+        
+        client.post('/auth/login', data={'email': 'admin@test.com', 'password': 'admin123'})
+        response = client.get('/admin/approvals')
+        assert b'Design Department' in response.data
+        with client.application.app_context():
+            from models import TaskApprovalRequest, TaskDepartmentAssignment
+            approval = TaskApprovalRequest.query.filter_by(task_id=task_id).first()
+            assert approval.requested_department_id_list == [other_id]
+            approval_id = approval.id
+        
+        client.post(f'/admin/approvals/{approval_id}/approve', data={'notes': ''})
+        with client.application.app_context():
+            assert TaskApprovalRequest.query.get(approval_id).status == 'APPROVED'
+            assert TaskDepartmentAssignment.query.filter_by(task_id=task_id, department_id=other_id).count() == 1
+    
+    def test_upgrade_db_backfills_approval_request_departments(self, app, admin_user, department, task):
+        """Test the legacy JSON department list is copied into the association table once."""
+        from extensions import db
+        from models import TaskApprovalRequest, TaskApprovalRequestDepartment
+        dept_id = Department.query.filter_by(name='Test Department').first().id
+        approval = TaskApprovalRequest(
+            task_id=Task.query.filter_by(task_name='Test Task').first().id,
+            request_type='assign_departments',
+            requested_by_id=User.query.filter_by(email='admin@test.com').first().id,
+            requested_department_ids=f'[{dept_id}, 9999]'
+        )
+        db.session.add(approval)
+        db.session.commit()
+        
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['upgrade-db'])
+        assert '1 approval request department(s) backfilled' in result.output
+        assert runner.invoke(args=['upgrade-db']).output.count('0 approval request department(s) backfilled') == 1
+        assert [d.department_id for d in TaskApprovalRequestDepartment.query.all()] == [dept_id]
+    
+    def test_batch_approve_and_reject(self, client, admin_user, department_head, task):
+        """Test batch approval assigns departments once per task and skips processed requests."""
+        from extensions import db
+        from models import TaskApprovalRequest, TaskDepartmentAssignment
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            head = User.query.filter_by(email='head@test.com').first()
+            other = Department(name='Design Department')
+            second = Task(task_name='Second Task', priority='URGENT', status='ASSIGNED',
+                          department_id=t.department_id, created_by_id=t.created_by_id)
+            db.session.add_all([other, second])
+            db.session.flush()
+            design_head = User(email='design@test.com', username='design', password_hash='x',
+                               full_name='Design Head', role='department_head', department_id=other.id)
+            db.session.add(design_head)
+            approvals = []
+            for task_id in (t.id, second.id, second.id):
+                approval = TaskApprovalRequest(task_id=task_id, request_type='assign_departments', requested_by_id=head.id)
+                approval.set_requested_departments([t.department_id, other.id])
+                approvals.append(approval)
+            db.session.add_all(approvals)
+            db.session.commit()
+            task_ids = (t.id, second.id)
+            other_id, design_head_id = other.id, design_head.id
+            first_id, second_id, rejected_id = [a.id for a in approvals]
+        
+        client.post('/auth/login', data={'email': 'admin@test.com', 'password': 'admin123'})
+        client.post('/admin/approvals/batch', data={'action': 'reject', 'request_ids[]': [str(rejected_id)]})
+        response = client.post('/admin/approvals/batch', data={
+            'action': 'approve',
+            'request_ids[]': [str(first_id), str(second_id), str(rejected_id)]
+        }, follow_redirects=True)
+        assert b'2 request(s) approved' in response.data
+        assert b'1 request(s) skipped' in response.data
+        
+        with client.application.app_context():
+            assert TaskApprovalRequest.query.get(rejected_id).status == 'REJECTED'
+            assert TaskApprovalRequest.query.get(first_id).status == 'APPROVED'
+            for task_id in task_ids:
+                assert TaskDepartmentAssignment.query.filter_by(task_id=task_id, department_id=other_id).count() == 1
+                assert TaskAssignment.query.filter_by(task_id=task_id, user_id=design_head_id).count() == 1
+    
+    def test_pending_approvals_counter(self, client, admin_user, department_head, task):
+        """Test the pending approvals counter follows create, reject and task delete."""
+        from models import Counter
+        from utils import get_pending_approvals_count, PENDING_APPROVALS_COUNTER
+        # Before upgrade-db the badge counts the table and page views do not create the counter
+        client.post('/auth/login', data={'email': 'admin@test.com', 'password': 'admin123'})
+        assert client.get('/admin/dashboard').status_code == 200
+        client.get('/auth/logout')
+        with client.application.app_context():
+            assert Counter.query.count() == 0
+        assert '0 pending approval(s) counted' in client.application.test_cli_runner().invoke(args=['upgrade-db']).output
+        with client.application.app_context():
+            other = Department(name='Design Department')
+            from extensions import db
+            db.session.add(other)
+            db.session.commit()
+            other_id = other.id
+            t = Task.query.filter_by(task_name='Test Task').first()
+            second = Task(task_name='Second Task', priority='URGENT', status='ASSIGNED',
+                          department_id=t.department_id, created_by_id=t.created_by_id)
+            db.session.add(second)
+            db.session.commit()
+            task_ids = [t.id, second.id]
+        
+        client.post('/auth/login', data={'email': 'head@test.com', 'password': 'head123'})
+        for task_id in task_ids:
+            client.post(f'/dept-head/tasks/{task_id}/assign-departments', data={'assign_to_dept[]': [str(other_id)]})
+        # Updating a pending request does not count twice
+        client.post(f'/dept-head/tasks/{task_ids[0]}/assign-departments', data={'assign_to_dept[]': [str(other_id)]})
+        client.get('/auth/logout')
+        with client.application.app_context():
+            from models import TaskApprovalRequest
+            assert get_pending_approvals_count() == 2
+            assert db.session.get(Counter, PENDING_APPROVALS_COUNTER).value == 2
+            first_request = TaskApprovalRequest.query.filter_by(task_id=task_ids[0]).first().id
+        
+        client.post('/auth/login', data={'email': 'admin@test.com', 'password': 'admin123'})
+        client.post(f'/admin/approvals/{first_request}/reject', data={'notes': ''})
+        client.post(f'/admin/tasks/{task_ids[1]}/delete')
+        with client.application.app_context():
+            assert get_pending_approvals_count() == 0
+    
+    def test_approvals_keyset_pagination_and_filters(self, client, admin_user, department_head, task, monkeypatch):
+        """Test the approvals queue pages with a before cursor and filters by type."""
+        from extensions import db
+        from models import TaskApprovalRequest
+        import routes.admin
+        monkeypatch.setattr(routes.admin, 'APPROVALS_PAGE_SIZE', 2)
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            head = User.query.filter_by(email='head@test.com').first()
+            for request_type in ('assign_departments', 'assign_departments', 'reassign'):
+                db.session.add(TaskApprovalRequest(task_id=t.id, request_type=request_type, requested_by_id=head.id))
+            db.session.commit()
+            ids = sorted(r.id for r in TaskApprovalRequest.query.all())
+        
+        client.post('/auth/login', data={'email': 'admin@test.com', 'password': 'admin123'})
+        response = client.get('/admin/approvals')
+        assert f'#{ids[2]}'.encode() in response.data and f'#{ids[1]}'.encode() in response.data
+        assert f'#{ids[0]}<'.encode() not in response.data
+        assert f'before={ids[1]}'.encode() in response.data
+        
+        response = client.get(f'/admin/approvals?before={ids[1]}')
+        assert f'#{ids[0]}<'.encode() in response.data
+        
+        response = client.get('/admin/approvals?request_type=reassign')
+        assert f'#{ids[2]}<'.encode() in response.data
+        assert f'#{ids[1]}<'.encode() not in response.data
+    
+    def test_expire_approvals_job(self, app, admin_user, department_head, task, monkeypatch):
+        """Test stale requests are escalated or expired in batches with one admin digest."""
+        from datetime import datetime, timedelta
+        from extensions import db
+        from models import TaskApprovalRequest
+        from utils import get_pending_approvals_count, recount_pending_approvals
+        import utils
+        digests = []
+        monkeypatch.setattr(utils, 'send_stale_approvals_notification',
+                            lambda admins, escalated, expired: digests.append((len(admins), escalated, expired)))
+        app.config.update(APPROVAL_ESCALATION_DAYS=3, APPROVAL_EXPIRY_DAYS=14, APPROVAL_JOB_BATCH_SIZE=2)
+        
+        t = Task.query.filter_by(task_name='Test Task').first()
+        head = User.query.filter_by(email='head@test.com').first()
+        now = datetime.utcnow()
+        ages = [20, 20, 20, 5, 1]
+        approvals = [TaskApprovalRequest(task_id=t.id, request_type='reassign', requested_by_id=head.id,
+                                         created_at=now - timedelta(days=age)) for age in ages]
+        approvals[0].approval_notes = 'Please hurry'
+        db.session.add_all(approvals)
+        recount_pending_approvals()
+        db.session.commit()
+        ids = [a.id for a in approvals]
+        
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['expire-approvals'])
+        assert '1 approval request(s) escalated, 3 expired' in result.output
+        assert digests == [(1, 1, 3)]
+        db.session.expire_all()
+        statuses = [TaskApprovalRequest.query.get(i).status for i in ids]
+        assert statuses == ['EXPIRED', 'EXPIRED', 'EXPIRED', 'PENDING', 'PENDING']
+        notes = TaskApprovalRequest.query.get(ids[0]).approval_notes
+        assert notes.startswith('Please hurry\n') and 'Expired automatically' in notes
+        assert TaskApprovalRequest.query.get(ids[3]).escalated_at is not None
+        assert TaskApprovalRequest.query.get(ids[4]).escalated_at is None
+        assert get_pending_approvals_count() == 2
+        from models import ActivityEvent
+        actions = {event.action for event in ActivityEvent.query.filter_by(task_id=t.id)}
+        assert actions == {'approval_expired', 'approval_escalated'}
+        
+        # Nothing left to do: no second digest
+        assert '0 approval request(s) escalated, 0 expired' in runner.invoke(args=['expire-approvals']).output
+        assert len(digests) == 1
+    
+    def test_recurring_tasks_are_generated_once_per_day(self, client, admin_user, department_head, team_member, monkeypatch):
+        """Test recurring templates are materialized in bulk, idempotently, with one digest per assignee."""
+        from datetime import date, timedelta
+        from models import RecurringTask, TaskDepartmentAssignment, TaskChange
+        import utils
+        digests = []
+        monkeypatch.setattr(utils, 'send_task_assignments_notification',
+                            lambda user, tasks, assigned_by: digests.append((user.email, sorted(t.task_name for t in tasks))))
+        client.post('/auth/login', data={'email': 'admin@test.com', 'password': 'admin123'})
+        with client.application.app_context():
+            dept_id = Department.query.filter_by(name='Test Department').first().id
+            member_id = User.query.filter_by(email='member@test.com').first().id
+        monday = date(2026, 10, 19)
+        client.post('/admin/recurring-tasks', data={
+            'task_name': 'Daily Standup', 'priority': 'DAILY TASK', 'department_id': dept_id,
+            'frequency': 'DAILY', 'deadline_time': '18:00', 'assignee_ids[]': [str(member_id)]
+        })
+        client.post('/admin/recurring-tasks', data={
+            'task_name': 'Weekly Report', 'priority': 'IMPORTANT', 'department_id': dept_id,
+            'frequency': 'WEEKLY', 'weekdays[]': [str(monday.weekday())]
+        })
+        response = client.get('/admin/recurring-tasks')
+        assert b'Daily Standup' in response.data and b'Weekly: Mon' in response.data
+        
+        runner = client.application.test_cli_runner()
+        result = runner.invoke(args=['generate-recurring-tasks', '--date', monday.isoformat()])
+        assert '2 recurring task(s) created, 2 user(s) notified' in result.output
+        assert sorted(digests) == [('head@test.com', ['Daily Standup', 'Weekly Report']),
+                                   ('member@test.com', ['Daily Standup'])]
+        assert '0 recurring task(s) created' in runner.invoke(args=['generate-recurring-tasks', '--date', monday.isoformat()]).output
+        # Only the daily template runs on Tuesday
+        assert '1 recurring task(s) created' in runner.invoke(
+            args=['generate-recurring-tasks', '--date', (monday + timedelta(days=1)).isoformat()]).output
+        
+        with client.application.app_context():
+            standup = Task.query.filter_by(task_name='Daily Standup', occurrence_date=monday).one()
+            assert standup.deadline.hour == 18 and standup.status == 'ASSIGNED'
+            assert TaskAssignment.query.filter_by(task_id=standup.id).count() == 2
+            assert TaskDepartmentAssignment.query.filter_by(task_id=standup.id, department_id=dept_id).count() == 1
+            # Bulk inserts still reach the sync change feed
+            assert TaskChange.query.filter_by(entity_type='task', task_id=standup.id).count() == 1
+            from models import ActivityEvent
+            assert ActivityEvent.query.filter_by(task_id=standup.id, action='task_created').count() == 1
+            template_id = RecurringTask.query.filter_by(task_name='Daily Standup').one().id
+        
+        client.post(f'/admin/recurring-tasks/{template_id}/delete')
+        with client.application.app_context():
+            assert Task.query.filter_by(task_name='Daily Standup').count() == 2
+    
+    def test_recurring_task_form_rejects_bad_input(self, client, admin_user, department):
+        """Test recurring task templates with a missing name, unknown department or bad deadline are rejected."""
+        from models import RecurringTask
+        client.post('/auth/login', data={'email': 'admin@test.com', 'password': 'admin123'})
+        with client.application.app_context():
+            dept_id = Department.query.filter_by(name='Test Department').first().id
+        valid = {'task_name': 'Daily Standup', 'priority': 'DAILY TASK', 'department_id': dept_id,
+                 'frequency': 'DAILY', 'deadline_time': '18:00'}
+        for changes, message in (({'task_name': '  '}, b'Task name is required'),
+                                 ({'department_id': dept_id + 100}, b'Invalid department selected'),
+                                 ({'department_id': ''}, b'Invalid department selected'),
+                                 ({'priority': 'SOMEDAY'}, b'Invalid priority selected'),
+                                 ({'deadline_time': '6pm'}, b'Invalid deadline time'),
+                                 ({'assignee_ids[]': ['999']}, b'Invalid user selected')):
+            response = client.post('/admin/recurring-tasks', data={**valid, **changes}, follow_redirects=True)
+            assert response.status_code == 200 and message in response.data
+        with client.application.app_context():
+            assert RecurringTask.query.count() == 0
+        client.post('/admin/recurring-tasks', data=valid)
+        with client.application.app_context():
+            assert RecurringTask.query.count() == 1
+    
+    def test_status_history_and_flow_analytics(self, client, admin_user, task):
+        """Test every status transition is recorded and rolled up into flow metrics."""
+        from datetime import datetime, timedelta
+        from extensions import db
+        from models import TaskStatusEvent, TaskFlowDailyStat
+        client.post('/auth/login', data={'email': 'admin@test.com', 'password': 'admin123'})
+        with client.application.app_context():
+            task_id = Task.query.filter_by(task_name='Test Task').first().id
+            admin_id = User.query.filter_by(email='admin@test.com').first().id
+        client.post('/admin/tasks/bulk', data={'action': 'status', 'status': 'PENDING', 'task_ids[]': [str(task_id)]})
+        client.post('/admin/tasks/bulk', data={'action': 'status', 'status': 'PENDING', 'task_ids[]': [str(task_id)]})
+        with client.application.app_context():
+            t = db.session.get(Task, task_id)
+            t.status = 'COMPLETED'
+            db.session.commit()
+            events = TaskStatusEvent.query.filter_by(task_id=task_id).order_by(TaskStatusEvent.id).all()
+            assert [(e.from_status, e.to_status) for e in events] == [
+                (None, 'ASSIGNED'), ('ASSIGNED', 'PENDING'), ('PENDING', 'COMPLETED')]
+            assert events[1].changed_by_id == admin_id
+            
+            # Replay the history on a fixed timeline: created, started after 2h, completed 10h later
+            day = datetime.utcnow().date() - timedelta(days=1)
+            created = datetime.combine(day, datetime.min.time()) + timedelta(hours=1)
+            t.created_at = created
+            for event, hours in zip(events, (0, 2, 12)):
+                event.changed_at = created + timedelta(hours=hours)
+            db.session.commit()
+        
+        runner = client.application.test_cli_runner()
+        assert '4 task flow statistic(s) stored' in runner.invoke(args=['rollup-task-flow']).output
+        assert '4 task flow statistic(s) stored' in runner.invoke(args=['rollup-task-flow']).output
+        with client.application.app_context():
+            assert TaskFlowDailyStat.query.count() == 4
+        
+        data = client.get('/admin/analytics/flow?days=7').get_json()
+        [dept] = data['departments']
+        # Percentiles are estimated within histogram buckets (..., 1-2h, ..., 8-12h, ...)
+        assert dept['lead_time']['count'] == 1 and dept['lead_time']['avg_hours'] == 12
+        assert 8 < dept['lead_time']['p50_hours'] <= dept['lead_time']['p95_hours'] <= 12
+        assert 8 < dept['cycle_time']['p50_hours'] <= 12
+        assert 1 < dept['time_in_status']['ASSIGNED']['p50_hours'] <= 2
+        assert 8 < dept['time_in_status']['PENDING']['p50_hours'] <= 12
+        assert client.get('/admin/analytics').status_code == 200
+    
+    def test_stale_edit_form_conflicts(self, client, admin_user, task):
+        """Test saving an edit form rendered before another change answers 409, and subtask changes bump the version."""
+        client.post('/auth/login', data={'email': 'admin@test.com', 'password': 'admin123'})
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            task_id, dept_id, version = t.id, t.department_id, t.version_id
+        assert f'name="version" value="{version}"'.encode() in client.get(f'/admin/tasks/{task_id}/edit').data
+        
+        # Someone adds a subtask after the form was rendered
+        client.post(f'/tasks/{task_id}/subtasks/add', data={'subtask_name': 'Step 1'})
+        with client.application.app_context():
+            assert Task.query.get(task_id).version_id == version + 1
+        
+        form = {'task_name': 'Renamed Task', 'priority': 'URGENT', 'department_id': dept_id, 'description': '',
+                'client_name': '', 'remark': '', 'deadline': ''}
+        response = client.post(f'/admin/tasks/{task_id}/edit', data={**form, 'version': str(version)},
+                               headers={'Accept': 'application/json'})
+        assert response.status_code == 409 and response.get_json()['conflict']
+        with client.application.app_context():
+            assert Task.query.get(task_id).task_name == 'Test Task'
+        
+        client.post(f'/admin/tasks/{task_id}/edit', data={**form, 'version': str(version + 1)})
+        with client.application.app_context():
+            assert Task.query.get(task_id).task_name == 'Renamed Task'
+    
+    def test_activity_feed(self, client, admin_user, department, team_member):
+        """Test task changes are logged and paged newest first, and outlive a deleted task."""
+        client.post('/auth/login', data={'email': 'admin@test.com', 'password': 'admin123'})
+        with client.application.app_context():
+            dept_id = Department.query.filter_by(name='Test Department').first().id
+        client.post('/admin/tasks/create', data={
+            'task_name': 'Logged Task', 'priority': 'URGENT', 'department_id': dept_id
+        })
+        with client.application.app_context():
+            task_id = Task.query.filter_by(task_name='Logged Task').first().id
+        client.post(f'/admin/tasks/{task_id}/edit', data={
+            'task_name': 'Logged Task', 'priority': 'IMPORTANT', 'department_id': dept_id,
+            'description': '', 'client_name': '', 'remark': '', 'deadline': ''
+        })
+        client.post('/admin/tasks/bulk', data={'action': 'status', 'status': 'PENDING', 'task_ids[]': [str(task_id)]})
+        # Already PENDING: nothing changes, nothing is logged
+        client.post('/admin/tasks/bulk', data={'action': 'status', 'status': 'PENDING', 'task_ids[]': [str(task_id)]})
+        
+        data = client.get(f'/api/activity/tasks/{task_id}').get_json()
+        assert [e['action'] for e in data['events']] == ['status_changed', 'task_updated', 'task_created']
+        assert data['events'][0]['details'] == {'status': ['ASSIGNED', 'PENDING'], 'bulk': True}
+        assert data['events'][1]['details'] == {'priority': ['URGENT', 'IMPORTANT']}
+        assert data['events'][0]['actor'] == 'Admin User' and data['next_before'] is None
+        
+        page = client.get(f'/api/activity/tasks/{task_id}?limit=2').get_json()
+        assert len(page['events']) == 2 and page['next_before'] == page['events'][-1]['id']
+        rest = client.get(f'/api/activity/tasks/{task_id}?limit=2&before={page["next_before"]}').get_json()
+        assert [e['action'] for e in rest['events']] == ['task_created'] and rest['next_before'] is None
+        
+        # Not assigned, so not visible to the team member
+        client.get('/auth/logout')
+        client.post('/auth/login', data={'email': 'member@test.com', 'password': 'member123'})
+        assert client.get(f'/api/activity/tasks/{task_id}').status_code == 403
+        assert client.get(f'/api/activity/departments/{dept_id}').status_code == 403
+        client.get('/auth/logout')
+        
+        client.post('/auth/login', data={'email': 'admin@test.com', 'password': 'admin123'})
+        client.post(f'/admin/tasks/{task_id}/delete')
+        data = client.get(f'/api/activity/tasks/{task_id}').get_json()
+        assert data['events'][0]['action'] == 'task_deleted' and len(data['events']) == 4
+        data = client.get(f'/api/activity/departments/{dept_id}').get_json()
+        assert {e['task_id'] for e in data['events']} == {task_id}
+        
+        # A later task that gets the same id (databases created before AUTOINCREMENT) starts a fresh history
+        from extensions import db
+        with client.application.app_context():
+            admin_id = User.query.filter_by(email='admin@test.com').first().id
+            db.session.add(Task(id=task_id, task_name='Reused Id', priority='LOW', department_id=dept_id,
+                                created_by_id=admin_id))
+            db.session.commit()
+        assert client.get(f'/api/activity/tasks/{task_id}').get_json()['events'] == []
+    
+    def test_archive_completed_tasks(self, client, admin_user, department_head, task):
+        """Test old completed tasks move to the archive with their child rows and can be searched."""
+        from datetime import datetime, timedelta
+        from extensions import db
+        from models import ArchivedTask, Subtask, TaskApprovalRequest, TaskChange
+        client.post('/auth/login', data={'email': 'admin@test.com', 'password': 'admin123'})
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            task_id, admin_id = t.id, t.created_by_id
+            head_id = User.query.filter_by(email='head@test.com').first().id
+            db.session.add(TaskAssignment(task_id=task_id, user_id=head_id, assigned_by_id=admin_id))
+            db.session.add(Subtask(task_id=task_id, subtask_name='Step 1', status='COMPLETED', created_by_id=admin_id))
+            # A completed task with a pending request stays live
+            busy = Task(task_name='Busy Task', priority='URGENT', status='COMPLETED',
+                        department_id=t.department_id, created_by_id=admin_id)
+            db.session.add(busy)
+            db.session.flush()
+            db.session.add(TaskApprovalRequest(task_id=busy.id, request_type='reassign', requested_by_id=head_id))
+            t.status = 'COMPLETED'
+            db.session.commit()
+            busy_id = busy.id
+            Task.query.update({Task.updated_at: datetime.utcnow() - timedelta(days=400)}, synchronize_session=False)
+            db.session.commit()
+        
+        runner = client.application.test_cli_runner()
+        assert '1 task(s) archived' in runner.invoke(args=['archive-tasks']).output
+        assert '0 task(s) archived' in runner.invoke(args=['archive-tasks']).output
+        with client.application.app_context():
+            assert db.session.get(Task, task_id) is None and db.session.get(Task, busy_id) is not None
+            assert Subtask.query.count() == 0
+            assert TaskChange.query.filter_by(entity_type='task', entity_id=task_id, operation='delete').count() == 1
+            archived = ArchivedTask.query.filter_by(task_id=task_id).one()
+            archived_id = archived.id
+            assert archived.status == 'COMPLETED'
+            assert [s['subtask_name'] for s in archived.children['subtasks']] == ['Step 1']
+            assert [a['user_id'] for a in archived.children['assignments']] == [head_id]
+            assert [e['to_status'] for e in archived.children['status_history']] == ['ASSIGNED', 'COMPLETED']
+        
+        response = client.get('/admin/archive?q=test')
+        assert response.status_code == 200 and b'Test Task' in response.data
+        assert b'Test Task' not in client.get('/admin/archive?q=nothing').data
+        response = client.get(f'/admin/archive/{archived_id}')
+        assert response.status_code == 200 and b'Step 1' in response.data
+        assert client.get(f'/api/activity/tasks/{task_id}').get_json()['events'][0]['action'] == 'task_archived'
+    
+    def test_archive_again_after_new_tasks(self, client, admin_user, task):
+        """Test task ids are not reused after archiving and a reused id can still be archived again."""
+        from datetime import datetime, timedelta
+        from extensions import db
+        from models import ArchivedTask
+        runner = client.application.test_cli_runner()
+        
+        def complete_and_age_all():
+            Task.query.update({Task.status: 'COMPLETED'}, synchronize_session=False)
+            Task.query.update({Task.updated_at: datetime.utcnow() - timedelta(days=400)}, synchronize_session=False)
+            db.session.commit()
+        
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            task_id, department_id, admin_id = t.id, t.department_id, t.created_by_id
+            complete_and_age_all()
+        assert '1 task(s) archived' in runner.invoke(args=['archive-tasks']).output
+        
+        with client.application.app_context():
+            newer = Task(task_name='Newer Task', priority='LOW', department_id=department_id, created_by_id=admin_id)
+            # A database created before AUTOINCREMENT hands out the archived task's id again
+            reused = Task(id=task_id, task_name='Reused Task', priority='LOW', department_id=department_id,
+                          created_by_id=admin_id)
+            db.session.add(newer)
+            db.session.flush()
+            assert newer.id > task_id
+            db.session.add(reused)
+            db.session.commit()
+            complete_and_age_all()
+        assert '2 task(s) archived' in runner.invoke(args=['archive-tasks']).output
+        
+        with client.application.app_context():
+            rows = ArchivedTask.query.filter_by(task_id=task_id).order_by(ArchivedTask.id).all()
+            assert [row.task_name for row in rows] == ['Test Task', 'Reused Task']
+            assert ArchivedTask.query.count() == 3
+    
+    def test_pool_sizing_and_health(self, tmp_path, monkeypatch):
+        """Test pools sized from workers/threads and the pool health report."""
+        import sqlite3
+        from app import create_app
+        from config import pool_options
+        from db_pool import _dispose_after_fork
+        from extensions import db, bcrypt
+        from tests.conftest import TestConfig
+        
+        assert pool_options(2, 8) == {'pool_size': 8, 'max_overflow': 4}
+        # 16 workers x 5 would exceed 40 server connections
+        assert pool_options(16, 8, max_connections=40) == {'pool_size': 2, 'max_overflow': 0}
+        
+        class FileConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "pool.db"}'
+            SQLALCHEMY_ENGINE_OPTIONS = {'pool_pre_ping': True}
+        
+        app = create_app(FileConfig)
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(email='admin@test.com', username='admin', full_name='Admin User', role='admin',
+                                password_hash=bcrypt.generate_password_hash('admin123').decode('utf-8')))
+            db.session.commit()
+            db.session.remove()
+            
+            client = app.test_client()
+            client.post('/auth/login', data={'email': 'admin@test.com', 'password': 'admin123'})
+            primary = client.get('/admin/pool-health').get_json()['engines']['primary']
+            assert primary['pool'] == 'MonitoredQueuePool' and primary['checkouts'] > 0
+            assert primary['checked_out'] == 1 and primary['pre_ping_failures'] == 0
+            
+            # A connection the database dropped is caught by the pre-ping and counted
+            def dropped(dbapi_connection):
+                raise sqlite3.OperationalError('server has gone away')
+            monkeypatch.setattr(db.engine.dialect, 'do_ping', dropped)
+            monkeypatch.setattr(db.engine.dialect, 'is_disconnect', lambda *args: True)
+            db.session.remove()
+            assert User.query.count() == 1
+            primary = client.get('/admin/pool-health').get_json()['engines']['primary']
+            assert primary['pre_ping_failures'] == 1 and primary['invalidations'] >= 1
+            monkeypatch.undo()
+            
+            # A forked worker starts with fresh pools
+            db.session.remove()
+            pool = db.engine.pool
+            _dispose_after_fork()
+            assert db.engine.pool is not pool and db.engine.pool.stats.checkouts == 0
+            db.drop_all()
+    
+    def test_delete_task_on_legacy_sqlite_schema(self, tmp_path):
+        """Test deleting tasks before upgrade-db flashes the fix instead of failing, and upgrade-db rebuilds the foreign keys."""
+        from sqlalchemy import inspect
+        from app import create_app
+        from extensions import db, bcrypt
+        from tests.conftest import TestConfig
+        
+        class FileConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "legacy.db"}'
+        
+        app = create_app(FileConfig)
+        with app.app_context():
+            db.create_all()
+            # A table created before the ON DELETE rules were added to the models
+            with db.engine.connect() as conn:
+                conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+                ddl = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'task_assignment'").scalar()
+                conn.exec_driver_sql('DROP TABLE task_assignment')
+                conn.exec_driver_sql(ddl.replace(' ON DELETE CASCADE', ''))
+                conn.exec_driver_sql('PRAGMA foreign_keys=ON')
+                conn.commit()
+            admin = User(email='admin@test.com', username='admin', full_name='Admin User', role='admin',
+                         password_hash=bcrypt.generate_password_hash('admin123').decode('utf-8'))
+            dept = Department(name='Legacy Department')
+            db.session.add_all([admin, dept])
+            db.session.flush()
+            tasks = [Task(task_name=f'Legacy Task {i}', priority='URGENT', status='ASSIGNED',
+                          department_id=dept.id, created_by_id=admin.id) for i in range(2)]
+            db.session.add_all(tasks)
+            db.session.flush()
+            db.session.add_all([TaskAssignment(task_id=t.id, user_id=admin.id, assigned_by_id=admin.id) for t in tasks])
+            db.session.commit()
+            task_ids = [t.id for t in tasks]
+            db.session.remove()
+            
+            client = app.test_client()
+            client.post('/auth/login', data={'email': 'admin@test.com', 'password': 'admin123'})
+            response = client.post(f'/admin/tasks/{task_ids[0]}/delete', follow_redirects=True)
+            assert response.status_code == 200 and b'flask upgrade-db' in response.data
+            response = client.post('/admin/tasks/bulk', data={
+                'action': 'delete', 'task_ids[]': [str(task_id) for task_id in task_ids]
+            }, follow_redirects=True)
+            assert response.status_code == 200 and b'flask upgrade-db' in response.data
+            assert Task.query.count() == 2
+            db.session.remove()
+            
+            result = app.test_cli_runner().invoke(args=['upgrade-db'])
+            assert 'task_assignment(task_id) -> ON DELETE CASCADE' in result.output
+            assert '2 foreign key(s) updated' in result.output
+            rules = {fk['constrained_columns'][0]: fk['options'].get('ondelete')
+                     for fk in inspect(db.engine).get_foreign_keys('task_assignment')}
+            assert rules == {'task_id': 'CASCADE', 'user_id': 'CASCADE', 'assigned_by_id': None}
+            assert TaskAssignment.query.count() == 2
+            
+            client.post(f'/admin/tasks/{task_ids[0]}/delete')
+            client.post('/admin/tasks/bulk', data={'action': 'delete', 'task_ids[]': [str(task_ids[1])]})
+            assert Task.query.count() == 0 and TaskAssignment.query.count() == 0
+            db.session.remove()
+            db.drop_all()
@@ -104,4 +104,315 @@ class TestDepartmentHeadFunctionality:
         response = client.post(f'/admin/tasks/{task_id}/delete', follow_redirects=True)
         # Should either 403 or redirect (no access)
         assert response.status_code in [403, 404, 302]
+    
+    def test_bulk_mark_department_complete(self, client, department_head, task):
+        """Test bulk marking department completion recomputes task status."""
+        with client.application.app_context():
+            from extensions import db
+            from models import TaskDepartmentAssignment, DepartmentTaskCompletion
+            t = Task.query.filter_by(task_name='Test Task').first()
+            head = User.query.filter_by(email='head@test.com').first()
+            db.session.add(TaskDepartmentAssignment(task_id=t.id, department_id=head.department_id, assigned_by_id=head.id))
+            db.session.add(DepartmentTaskCompletion(task_id=t.id, department_id=head.department_id, is_completed=False))
+            db.session.commit()
+            task_id = t.id
+        
+        client.post('/auth/login', data={
+            'email': 'head@test.com',
+            'password': 'head123'
+        })
+        response = client.post('/dept-head/tasks/bulk', data={
+            'action': 'mark_department_complete',
+            'task_ids[]': [str(task_id)]
+        }, follow_redirects=True)
+        assert response.status_code == 200
+        with client.application.app_context():
+            from models import DepartmentTaskCompletion
+            completion = DepartmentTaskCompletion.query.filter_by(task_id=task_id).first()
+            assert completion.is_completed
+            assert Task.query.get(task_id).status == 'COMPLETED'
+
+    
+    def test_bulk_status_follows_department_completions(self, client, department_head, task):
+        """Test bulk completing a task reverts while another department is still working on it."""
+        with client.application.app_context():
+            from extensions import db
+            from models import Department, TaskDepartmentAssignment, DepartmentTaskCompletion
+            t = Task.query.filter_by(task_name='Test Task').first()
+            head = User.query.filter_by(email='head@test.com').first()
+            other = Department(name='Other Department')
+            db.session.add(other)
+            db.session.flush()
+            for dept_id, done in ((head.department_id, True), (other.id, False)):
+                db.session.add(TaskDepartmentAssignment(task_id=t.id, department_id=dept_id, assigned_by_id=head.id))
+                db.session.add(DepartmentTaskCompletion(task_id=t.id, department_id=dept_id, is_completed=done))
+            db.session.commit()
+            task_id = t.id
+            other_id = other.id
+        
+        client.post('/auth/login', data={
+            'email': 'head@test.com',
+            'password': 'head123'
+        })
+        response = client.post('/dept-head/tasks/bulk', data={
+            'action': 'status',
+            'status': 'COMPLETED',
+            'task_ids[]': [str(task_id)]
+        }, follow_redirects=True)
+        assert response.status_code == 200
+        with client.application.app_context():
+            from models import DepartmentTaskCompletion
+            assert Task.query.get(task_id).status == 'ASSIGNED'
+            completion = DepartmentTaskCompletion.query.filter_by(task_id=task_id, department_id=other_id).first()
+            assert not completion.is_completed
+    
+    def test_bulk_department_complete_without_native_upsert(self, client, department_head, task, monkeypatch):
+        """Test completion rows are created row by row in savepoints on databases without an upsert syntax."""
+        from extensions import db
+        from models import DepartmentTaskCompletion, TaskDepartmentAssignment
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            head = User.query.filter_by(email='head@test.com').first()
+            second = Task(task_name='Second Task', priority='URGENT', status='ASSIGNED',
+                          department_id=t.department_id, created_by_id=t.created_by_id)
+            db.session.add(second)
+            db.session.flush()
+            for task_id in (t.id, second.id):
+                db.session.add(TaskDepartmentAssignment(task_id=task_id, department_id=head.department_id, assigned_by_id=head.id))
+            # The first task already has its row: the fallback must skip it, not fail
+            db.session.add(DepartmentTaskCompletion(task_id=t.id, department_id=head.department_id, is_completed=False))
+            db.session.commit()
+            task_ids = [t.id, second.id]
+            monkeypatch.setattr(db.engine.dialect, 'name', 'postgresql')
+        
+        client.post('/auth/login', data={'email': 'head@test.com', 'password': 'head123'})
+        response = client.post('/dept-head/tasks/bulk', data={
+            'action': 'mark_department_complete',
+            'task_ids[]': [str(task_id) for task_id in task_ids]
+        })
+        assert response.status_code == 302
+        with client.application.app_context():
+            completions = DepartmentTaskCompletion.query.filter(DepartmentTaskCompletion.task_id.in_(task_ids)).all()
+            assert sorted(c.task_id for c in completions) == sorted(task_ids)
+            assert all(c.is_completed for c in completions)
+    
+    def test_forwarded_tasks_are_coalesced_into_one_notification(self, client, department_head, task, team_member, monkeypatch):
+        """Test a forwarding burst produces a single notification per recipient."""
+        from extensions import db
+        from notification_queue import NotificationCoalescer
+        import utils
+        sent = []
+        monkeypatch.setattr(utils, 'send_task_assignments_notification',
+                            lambda user, tasks, assigned_by: sent.append((user.email, sorted(t.id for t in tasks), assigned_by.email)))
+        coalescer = NotificationCoalescer(client.application, window_seconds=60)
+        client.application.extensions['notification_queue'] = coalescer
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            tasks = [Task(task_name=f'Task {i}', priority='URGENT', status='ASSIGNED',
+                          department_id=t.department_id, created_by_id=t.created_by_id) for i in range(3)]
+            db.session.add_all(tasks)
+            db.session.commit()
+            task_ids = sorted([t.id] + [other.id for other in tasks])
+            member_id = User.query.filter_by(email='member@test.com').first().id
+        
+        client.post('/auth/login', data={
+            'email': 'head@test.com',
+            'password': 'head123'
+        })
+        client.post('/dept-head/tasks/bulk', data={
+            'action': 'forward', 'member_id': str(member_id), 'task_ids[]': [str(i) for i in task_ids[:2]]
+        })
+        client.post('/dept-head/tasks/bulk', data={
+            'action': 'forward', 'member_id': str(member_id), 'task_ids[]': [str(i) for i in task_ids[2:]]
+        })
+        assert sent == [] and coalescer.pending_user_ids() == {member_id}
+        
+        coalescer.flush_all()
+        assert sent == [('member@test.com', task_ids, 'head@test.com')]
+        assert coalescer.pending_user_ids() == set()
 
+    def test_task_detail_query_count_is_fixed(self, client, department_head, task, team_member):
+        """Test the task detail page loads with the same number of queries however large the task is."""
+        from extensions import db
+        from sqlalchemy import event
+        from models import Department, Subtask, TaskDepartmentAssignment, DepartmentTaskCompletion, TaskApprovalRequest
+        with client.application.app_context():
+            head = User.query.filter_by(email='head@test.com').first()
+            member = User.query.filter_by(email='member@test.com').first()
+            other = Department(name='Other Department')
+            db.session.add(other)
+            db.session.flush()
+            # Visible to the head only through the department assignment
+            t = Task.query.filter_by(task_name='Test Task').first()
+            t.department_id = other.id
+            db.session.add(TaskDepartmentAssignment(task_id=t.id, department_id=head.department_id, assigned_by_id=head.id))
+            db.session.commit()
+            task_id, head_id, member_id, dept_id = t.id, head.id, member.id, head.department_id
+
+        def add_details(index):
+            with client.application.app_context():
+                dept = Department(name=f'Extra Department {index}')
+                db.session.add(dept)
+                db.session.flush()
+                db.session.add_all([
+                    TaskDepartmentAssignment(task_id=task_id, department_id=dept.id, assigned_by_id=head_id),
+                    DepartmentTaskCompletion(task_id=task_id, department_id=dept.id, is_completed=index % 2 == 0),
+                    TaskAssignment(task_id=task_id, user_id=member_id if index == 0 else head_id, assigned_by_id=head_id),
+                    Subtask(task_id=task_id, subtask_name=f'Subtask {index}', created_by_id=member_id),
+                    TaskApprovalRequest(task_id=task_id, request_type='reassign', requested_by_id=head_id,
+                                        new_dept_head_id=head_id, approved_by_id=member_id, status='APPROVED'),
+                ])
+                db.session.commit()
+
+        client.post('/auth/login', data={'email': 'head@test.com', 'password': 'head123'})
+        client.get(f'/tasks/{task_id}')  # Consume the login flash message
+        statements = []
+        def count(*args):
+            statements.append(args[2])
+        with client.application.app_context():
+            event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            counts = []
+            for index in range(3):
+                add_details(index)
+                statements.clear()
+                response = client.get(f'/tasks/{task_id}')
+                assert response.status_code == 200
+                assert f'Subtask {index}'.encode() in response.data
+                counts.append(len(statements))
+        finally:
+            with client.application.app_context():
+                event.remove(db.engine, 'before_cursor_execute', count)
+        assert counts[0] == counts[1] == counts[2]
+    
+    def test_team_workload(self, client, department_head, task, team_member):
+        """Test open-task counts per member by priority and overdue state."""
+        from datetime import datetime, timedelta
+        from extensions import db
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            head = User.query.filter_by(email='head@test.com').first()
+            member_id = User.query.filter_by(email='member@test.com').first().id
+            late = Task(task_name='Late Task', priority='DAILY TASK', status='PENDING', department_id=t.department_id,
+                        created_by_id=head.id, deadline=datetime.now() - timedelta(days=1))
+            done = Task(task_name='Done Task', priority='URGENT', status='COMPLETED', department_id=t.department_id,
+                        created_by_id=head.id)
+            db.session.add_all([late, done])
+            db.session.flush()
+            db.session.add_all([TaskAssignment(task_id=task_id, user_id=member_id, assigned_by_id=head.id)
+                                for task_id in (t.id, late.id, done.id)])
+            db.session.commit()
+        
+        client.post('/auth/login', data={'email': 'head@test.com', 'password': 'head123'})
+        data = client.get('/dept-head/workload/counts').get_json()
+        members = {m['name']: m for m in data['members']}
+        assert members['Team Member']['open'] == 2 and members['Team Member']['overdue'] == 1
+        assert members['Team Member']['by_priority'] == {'URGENT': 1, 'IMPORTANT': 0, 'DAILY TASK': 1}
+        assert members['Department Head']['open'] == 0
+        
+        response = client.get('/dept-head/workload')
+        assert response.status_code == 200 and b'Team Member' in response.data
+        with client.application.app_context():
+            task_id = Task.query.filter_by(task_name='Test Task').first().id
+        response = client.get(f'/dept-head/tasks/{task_id}/forward')
+        assert b'2 open' in response.data and b'1 overdue' in response.data
+    
+    def test_concurrent_department_complete_conflicts(self, client, department_head, task, monkeypatch):
+        """Test a toggle from a stale page or a lost race answers 409 instead of overwriting."""
+        from extensions import db
+        from models import TaskDepartmentAssignment, DepartmentTaskCompletion
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            head = User.query.filter_by(email='head@test.com').first()
+            db.session.add(TaskDepartmentAssignment(task_id=t.id, department_id=head.department_id, assigned_by_id=head.id))
+            db.session.commit()
+            task_id = t.id
+        
+        client.post('/auth/login', data={'email': 'head@test.com', 'password': 'head123'})
+        url = f'/dept-head/tasks/{task_id}/mark-department-complete'
+        response = client.post(url, data={'version': '0'})
+        assert response.status_code == 302
+        with client.application.app_context():
+            completion = DepartmentTaskCompletion.query.filter_by(task_id=task_id).one()
+            assert completion.is_completed and completion.version_id == 2
+            assert Task.query.get(task_id).status == 'COMPLETED'
+        
+        # A second click from the page rendered before the first one
+        response = client.post(url, data={'version': '0'}, headers={'Accept': 'application/json'})
+        assert response.status_code == 409 and response.get_json()['conflict']
+        response = client.post(url, data={'version': '0'}, follow_redirects=True)
+        assert b'changed by someone else' in response.data
+        
+        # Another department changes the task between our read and our write
+        import routes.department_head as dept_head_routes
+        original = dept_head_routes._update_task_completion_status
+        def concurrent_update(task):
+            table = Task.__table__
+            db.session.execute(table.update().where(table.c.id == task.id).values(version_id=table.c.version_id + 1))
+            original(task)
+        monkeypatch.setattr(dept_head_routes, '_update_task_completion_status', concurrent_update)
+        response = client.post(url, data={'version': '2'}, headers={'Accept': 'application/json'})
+        assert response.status_code == 409
+        with client.application.app_context():
+            completion = DepartmentTaskCompletion.query.filter_by(task_id=task_id).one()
+            assert completion.is_completed and completion.version_id == 2
+    
+    def test_stale_status_form_conflicts(self, client, department_head, task):
+        """Test a status change from a page rendered before another change answers 409."""
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            task_id, version = t.id, t.version_id
+        client.post('/auth/login', data={'email': 'head@test.com', 'password': 'head123'})
+        assert f'name="version" value="{version}"'.encode() in client.get(f'/tasks/{task_id}').data
+        url = f'/dept-head/tasks/{task_id}/update-status'
+        client.post(url, data={'status': 'PENDING', 'version': str(version)})
+        response = client.post(url, data={'status': 'COMPLETED', 'version': str(version)}, headers={'Accept': 'application/json'})
+        assert response.status_code == 409
+        with client.application.app_context():
+            assert Task.query.get(task_id).status == 'PENDING'
+    
+    def test_dashboard_reads_use_replica(self):
+        """Test workload reads go to the replica, and to the primary after a write or when the replica lags."""
+        from datetime import datetime, timedelta
+        from app import create_app
+        from extensions import db, bcrypt
+        from models import Department, TaskChange
+        from tests.conftest import TestConfig
+        
+        class ReplicaConfig(TestConfig):
+            DATABASE_REPLICA_URLS = ['sqlite://']
+            REPLICA_LAG_CHECK_SECONDS = 0
+        
+        app = create_app(ReplicaConfig)
+        with app.app_context():
+            db.create_all()
+            db.metadata.create_all(app.extensions['replica_router'].engines['replica_0'])
+            dept = Department(name='Primary Department')
+            db.session.add(dept)
+            db.session.flush()
+            head = User(email='head@test.com', username='depthead', full_name='Department Head', role='department_head',
+                        password_hash=bcrypt.generate_password_hash('head123').decode('utf-8'), department_id=dept.id)
+            db.session.add(head)
+            db.session.flush()
+            db.session.add(Task(task_name='Primary Task', priority='URGENT', status='ASSIGNED',
+                                department_id=dept.id, created_by_id=head.id))
+            db.session.commit()
+            
+            client = app.test_client()
+            client.post('/auth/login', data={'email': 'head@test.com', 'password': 'head123'})
+            # The replica is empty, but the changes it misses are seconds old, so it is within the lag limit
+            assert client.get('/dept-head/workload/counts').get_json()['members'] == []
+            assert app.extensions['replica_router'].lag['replica_0'] < 60
+            
+            # Read-your-writes: the user's own write pins their reads to the primary for a while
+            client.post('/api/notifications/register-token', json={'fcm_token': 'token-1'})
+            assert [m['name'] for m in client.get('/dept-head/workload/counts').get_json()['members']] == ['Department Head']
+            
+            # A replica further behind than REPLICA_MAX_LAG_SECONDS is skipped
+            client = app.test_client()
+            client.post('/auth/login', data={'email': 'head@test.com', 'password': 'head123'})
+            assert client.get('/dept-head/workload/counts').get_json()['members'] == []
+            TaskChange.query.update({TaskChange.changed_at: datetime.utcnow() - timedelta(hours=1)})
+            db.session.commit()
+            assert [m['name'] for m in client.get('/dept-head/workload/counts').get_json()['members']] == ['Department Head']
+            db.drop_all()
@@ -134,4 +134,43 @@ class TestModels:
             assert t.department is not None
             assert t.department.id == dept.id
             assert t in dept.tasks
+    
+    def test_task_delete_cascades_in_database(self, app, task, team_member):
+        """Test deleting a task removes child rows via ON DELETE CASCADE."""
+        with app.app_context():
+            from models import Task, User, TaskDepartmentAssignment, DepartmentTaskCompletion
+            t = Task.query.filter_by(task_name='Test Task').first()
+            member = User.query.filter_by(email='member@test.com').first()
+            db.session.add(TaskAssignment(task_id=t.id, user_id=member.id, assigned_by_id=member.id))
+            db.session.add(Subtask(task_id=t.id, subtask_name='Child', created_by_id=member.id))
+            db.session.add(TaskDepartmentAssignment(task_id=t.id, department_id=t.department_id, assigned_by_id=member.id))
+            db.session.add(DepartmentTaskCompletion(task_id=t.id, department_id=t.department_id))
+            db.session.commit()
+            task_id = t.id
+            
+            # Bulk delete bypasses the ORM entirely, so only the database can cascade
+            Task.query.filter_by(id=task_id).delete(synchronize_session=False)
+            db.session.commit()
+            
+            assert TaskAssignment.query.filter_by(task_id=task_id).count() == 0
+            assert Subtask.query.filter_by(task_id=task_id).count() == 0
+            assert TaskDepartmentAssignment.query.filter_by(task_id=task_id).count() == 0
+            assert DepartmentTaskCompletion.query.filter_by(task_id=task_id).count() == 0
+    
+    def test_user_delete_cascades_assignments(self, app, task, team_member, admin_user):
+        """Test deleting a user removes their assignments in the database."""
+        with app.app_context():
+            from models import Task, User
+            t = Task.query.filter_by(task_name='Test Task').first()
+            member = User.query.filter_by(email='member@test.com').first()
+            admin = User.query.filter_by(email='admin@test.com').first()
+            db.session.add(TaskAssignment(task_id=t.id, user_id=member.id, assigned_by_id=admin.id))
+            db.session.commit()
+            member_id = member.id
+            
+            db.session.delete(member)
+            db.session.commit()
+            
+            assert TaskAssignment.query.filter_by(user_id=member_id).count() == 0
+            assert Task.query.get(t.id) is not None
 
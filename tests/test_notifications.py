@@ -0,0 +1,96 @@
+import pytest
+from extensions import db
+from models import Task, TaskAssignment, User, FCMDevice, Notification
+
+class TestNotificationInbox:
+    """Test the in-app notification inbox."""
+
+    def _assign_tasks(self, client, count):
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            member = User.query.filter_by(email='member@test.com').first()
+            db.session.add(FCMDevice(user_id=member.id, fcm_token='member-token'))
+            for i in range(count):
+                other = Task(task_name=f'Inbox Task {i}', priority='URGENT', status='ASSIGNED',
+                             department_id=t.department_id, created_by_id=t.created_by_id)
+                db.session.add(other)
+                db.session.flush()
+                db.session.add(TaskAssignment(task_id=other.id, user_id=member.id, assigned_by_id=t.created_by_id))
+            db.session.commit()
+
+    def test_assignments_are_stored_and_pushed_by_id(self, client, team_member, task):
+        """Test every assignment writes an inbox row and the push only carries its id."""
+        from notification_transport import get_notification_transport
+        self._assign_tasks(client, 3)
+        with client.application.app_context():
+            from utils import send_task_assignment_notification
+            member = User.query.filter_by(email='member@test.com').first()
+            assert Notification.query.filter_by(user_id=member.id).count() == 3
+            t = Task.query.filter_by(task_name='Inbox Task 0').first()
+            send_task_assignment_notification(member, t, member)
+            notification_id = Notification.query.filter_by(task_id=t.id).one().id
+            pushes = [data for _, _, _, data in get_notification_transport().sent]
+        assert pushes == [{'type': 'task_assigned', 'notification_id': str(notification_id)}]
+
+        client.post('/auth/login', data={'email': 'member@test.com', 'password': 'member123'})
+        data = client.get(f'/api/notifications/{notification_id}').get_json()
+        assert data['notification']['data']['task_id'] == t.id
+        assert data['notification']['body'] == '🔴 URGENT: Inbox Task 0'
+
+    def test_pagination_unread_count_and_mark_read(self, client, team_member, task):
+        """Test keyset pages, the unread count and bulk mark-read."""
+        self._assign_tasks(client, 3)
+        client.post('/auth/login', data={'email': 'member@test.com', 'password': 'member123'})
+        assert client.get('/api/notifications/unread-count').get_json()['unread'] == 3
+
+        first = client.get('/api/notifications?limit=2').get_json()
+        assert [n['title'] for n in first['notifications']] == ['New Task Assigned'] * 2
+        second = client.get(f'/api/notifications?limit=2&before={first["next_before"]}').get_json()
+        assert len(second['notifications']) == 1 and second['next_before'] is None
+        ids = [n['id'] for n in first['notifications'] + second['notifications']]
+        assert ids == sorted(ids, reverse=True)
+
+        response = client.post('/api/notifications/mark-read', json={'ids': ids[:2]})
+        assert response.get_json()['updated'] == 2
+        assert client.get('/api/notifications/unread-count').get_json()['unread'] == 1
+        assert [n['id'] for n in client.get('/api/notifications?unread=1').get_json()['notifications']] == ids[2:]
+        assert client.post('/api/notifications/mark-read', json={'all': True}).get_json()['updated'] == 1
+        assert client.post('/api/notifications/mark-read', json={}).status_code == 400
+
+    def test_other_users_notifications_are_hidden(self, client, admin_user, team_member, task):
+        """Test a user cannot read someone else's notification."""
+        self._assign_tasks(client, 1)
+        with client.application.app_context():
+            notification_id = Notification.query.first().id
+        client.post('/auth/login', data={'email': 'admin@test.com', 'password': 'admin123'})
+        assert client.get(f'/api/notifications/{notification_id}').status_code == 404
+        assert client.post('/api/notifications/mark-read', json={'all': True}).get_json()['updated'] == 0
+
+class TestFakeTransport:
+    """Test the in-process FCM stand-in used by the tests and the load-test harness."""
+
+    def test_failing_tokens_and_quota(self):
+        from notification_transport import FakeTransport, QuotaExceeded
+        transport = FakeTransport(quota_per_second=4, failing_tokens={'revoked'})
+        assert transport.send('good', 'Title', 'Body', {}).startswith('fake-message-')
+        assert transport.send_multicast(['good', 'invalid-token', 'revoked'], 'Title', 'Body', {}) == (1, 2)
+        with pytest.raises(QuotaExceeded):
+            transport.send('good', 'Title', 'Body', {})
+        assert (transport.calls, transport.failures, len(transport.sent)) == (3, 2, 2)
+
+class TestNotificationClient:
+    """Test the process-wide Firebase client."""
+
+    def test_initializes_once_and_reuses_templates(self, app, tmp_path, caplog):
+        from fcm_service import NotificationClient
+        from notification_transport import TransportUnavailable
+        client = NotificationClient(cred_path=str(tmp_path / 'missing.json'))
+        with app.app_context():
+            for _ in range(3):
+                with pytest.raises(TransportUnavailable):
+                    client.send('token', 'Title', 'Body', {'type': 'task_assigned'})
+        assert caplog.text.count('Firebase credentials file not found') == 1
+
+        assert client.android_config('task_assigned') is client.android_config('task_assigned')
+        assert client.android_config('task_deadlines').notification.tag == 'task_deadlines'
+        assert client.android_config('task_assigned').notification.channel_id == 'task_notifications'
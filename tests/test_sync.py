@@ -0,0 +1,292 @@
+import pytest
+from extensions import db
+from models import Task, TaskAssignment, Subtask, User, TaskChange
+
+class TestTaskChangeFeed:
+    """Test the incremental task sync endpoint."""
+
+    def _login_member(self, client):
+        client.post('/auth/login', data={
+            'email': 'member@test.com',
+            'password': 'member123'
+        })
+
+    def _assign(self, client, task_name, email):
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name=task_name).first()
+            user = User.query.filter_by(email=email).first()
+            assignment = TaskAssignment(task_id=t.id, user_id=user.id, assigned_by_id=user.id)
+            db.session.add(assignment)
+            db.session.commit()
+            return t.id, assignment.id
+
+    def test_snapshot_returns_visible_tasks(self, client, team_member, task):
+        """Test the initial sync only contains tasks assigned to the member."""
+        task_id, _ = self._assign(client, 'Test Task', 'member@test.com')
+        with client.application.app_context():
+            t = Task.query.get(task_id)
+            db.session.add(Task(task_name='Other Task', priority='URGENT', status='ASSIGNED',
+                                department_id=t.department_id, created_by_id=t.created_by_id))
+            db.session.commit()
+
+        self._login_member(client)
+        response = client.get('/api/tasks/changes')
+        assert response.status_code == 200
+        data = response.get_json()
+        assert [t['id'] for t in data['tasks']] == [task_id]
+        assert len(data['assignments']) == 1
+        assert data['cursor'] > 0
+
+    def test_incremental_changes_and_tombstones(self, client, team_member, task):
+        """Test changes after the cursor, including bulk updates and deletes."""
+        task_id, assignment_id = self._assign(client, 'Test Task', 'member@test.com')
+        self._login_member(client)
+        cursor = client.get('/api/tasks/changes').get_json()['cursor']
+
+        # Nothing changed yet
+        data = client.get(f'/api/tasks/changes?since={cursor}').get_json()
+        assert data['tasks'] == [] and data['deleted'] == [] and data['cursor'] == cursor
+
+        # Bulk status update bypasses the flush but is still recorded
+        client.post('/team-member/tasks/bulk', data={
+            'action': 'status', 'status': 'PENDING', 'task_ids[]': [str(task_id)]
+        })
+        with client.application.app_context():
+            member = User.query.filter_by(email='member@test.com').first()
+            subtask = Subtask(task_id=task_id, subtask_name='Step', created_by_id=member.id)
+            db.session.add(subtask)
+            db.session.commit()
+            subtask_id = subtask.id
+
+        data = client.get(f'/api/tasks/changes?since={cursor}').get_json()
+        assert data['tasks'][0]['status'] == 'PENDING'
+        assert subtask_id in [s['id'] for s in data['subtasks']]
+        cursor = data['cursor']
+
+        # Unassigning the member revokes access: the task comes back as a tombstone
+        with client.application.app_context():
+            db.session.delete(TaskAssignment.query.get(assignment_id))
+            db.session.commit()
+        data = client.get(f'/api/tasks/changes?since={cursor}').get_json()
+        assert {'type': 'task', 'id': task_id} in data['deleted']
+        assert data['tasks'] == []
+
+    def test_no_tombstones_for_tasks_never_visible(self, client, team_member, task):
+        """Test a member gets no tombstone for another department's deleted or reassigned task."""
+        from models import Department
+        task_id, _ = self._assign(client, 'Test Task', 'member@test.com')
+        with client.application.app_context():
+            t = Task.query.get(task_id)
+            other_dept = Department(name='Other Department')
+            db.session.add(other_dept)
+            db.session.flush()
+            other = Task(task_name='Other Task', priority='URGENT', status='ASSIGNED',
+                         department_id=other_dept.id, created_by_id=t.created_by_id)
+            moved = Task(task_name='Moved Task', priority='URGENT', status='ASSIGNED',
+                         department_id=other_dept.id, created_by_id=t.created_by_id)
+            db.session.add_all([other, moved])
+            db.session.commit()
+            other_id, moved_id, dept_id = other.id, moved.id, t.department_id
+
+        self._login_member(client)
+        cursor = client.get('/api/tasks/changes').get_json()['cursor']
+        with client.application.app_context():
+            db.session.delete(Task.query.get(other_id))
+            Task.query.get(moved_id).department_id = dept_id
+            db.session.commit()
+        data = client.get(f'/api/tasks/changes?since={cursor}').get_json()
+        assert data['deleted'] == [] and data['tasks'] == []
+
+        # The member's own task still comes back as a tombstone
+        with client.application.app_context():
+            db.session.delete(Task.query.get(task_id))
+            db.session.commit()
+        data = client.get(f'/api/tasks/changes?since={cursor}').get_json()
+        assert data['deleted'] == [{'type': 'task', 'id': task_id}]
+
+    def test_paging_with_limit(self, client, admin_user, task):
+        """Test has_more and cursor advance when the page is full."""
+        client.post('/auth/login', data={
+            'email': 'admin@test.com',
+            'password': 'admin123'
+        })
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            db.session.add(Task(task_name='Second Task', priority='URGENT', status='ASSIGNED',
+                                department_id=t.department_id, created_by_id=t.created_by_id))
+            db.session.commit()
+            start = db.session.query(db.func.min(TaskChange.id)).filter_by(entity_type='task').scalar() - 1
+        first = client.get(f'/api/tasks/changes?since={start}&limit=1').get_json()
+        assert first['has_more'] is True and first['cursor'] > start
+        second = client.get(f'/api/tasks/changes?since={first["cursor"]}&limit=1').get_json()
+        assert second['cursor'] > first['cursor']
+        names = [t['task_name'] for page in (first, second) for t in page['tasks']]
+        assert 'Test Task' in names
+
+        while second['has_more']:
+            second = client.get(f'/api/tasks/changes?since={second["cursor"]}&limit=1').get_json()
+        client.post(f'/admin/tasks/{first["tasks"][0]["id"]}/delete')
+        data = client.get(f'/api/tasks/changes?since={second["cursor"]}').get_json()
+        assert data['deleted'][0]['type'] == 'task'
+
+    def test_recent_changes_wait_for_the_safety_window(self, client, admin_user, task):
+        """Test changes inside the safety window are held back without advancing the cursor."""
+        client.post('/auth/login', data={
+            'email': 'admin@test.com',
+            'password': 'admin123'
+        })
+        cursor = client.get('/api/tasks/changes').get_json()['cursor']
+        client.application.config['SYNC_SAFETY_WINDOW_SECONDS'] = 60
+        with client.application.app_context():
+            Task.query.filter_by(task_name='Test Task').update({Task.status: 'PENDING'})
+            db.session.commit()
+        data = client.get(f'/api/tasks/changes?since={cursor}').get_json()
+        assert data['tasks'] == [] and data['cursor'] == cursor and data['has_more'] is False
+
+        client.application.config['SYNC_SAFETY_WINDOW_SECONDS'] = 0
+        data = client.get(f'/api/tasks/changes?since={cursor}').get_json()
+        assert data['tasks'][0]['status'] == 'PENDING' and data['cursor'] > cursor
+
+    def test_purged_changes_require_a_resync(self, client, admin_user, task):
+        """Test old changes are purged, the newest is kept and older cursors must resync."""
+        from datetime import datetime, timedelta
+        client.post('/auth/login', data={
+            'email': 'admin@test.com',
+            'password': 'admin123'
+        })
+        with client.application.app_context():
+            TaskChange.query.update({TaskChange.changed_at: datetime.utcnow() - timedelta(days=60)})
+            db.session.commit()
+            newest = db.session.query(db.func.max(TaskChange.id)).scalar()
+            stale_cursor = db.session.query(db.func.min(TaskChange.id)).scalar()
+
+        result = client.application.test_cli_runner().invoke(args=['purge-task-changes'])
+        assert f'{newest - stale_cursor} task change(s) purged' in result.output
+        with client.application.app_context():
+            assert [change.id for change in TaskChange.query.all()] == [newest]
+
+        response = client.get(f'/api/tasks/changes?since={stale_cursor}')
+        assert response.status_code == 410 and response.get_json()['resync_required'] is True
+        assert client.get(f'/api/tasks/changes?since={newest - 1}').status_code == 200
+        assert client.get('/api/tasks/changes').get_json()['cursor'] == newest
+
+class TestLiveTaskEvents:
+    """Test live task events published after commit."""
+
+    def test_events_are_routed_to_the_task_audience(self, client, admin_user, team_member, task):
+        """Test a committed change reaches assignees and a revoked assignee is told to drop the task."""
+        from events import get_event_broker, event_for_user
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            member = User.query.filter_by(email='member@test.com').first()
+            task_id, member_id, dept_id = t.id, member.id, t.department_id
+
+            subscription = get_event_broker().subscribe()
+            assignment = TaskAssignment(task_id=task_id, user_id=member_id, assigned_by_id=member_id)
+            db.session.add(assignment)
+            db.session.flush()
+            assert subscription.empty()  # Nothing is published before commit
+            db.session.commit()
+            [event] = subscription.get_nowait()
+            assert event_for_user(event, member_id, 'team_member', dept_id)['removed'] is False
+            assert event_for_user(event, member_id + 100, 'team_member', dept_id) is None
+            assert event_for_user(event, None, 'department_head', dept_id)['status'] == 'ASSIGNED'
+
+            db.session.delete(assignment)
+            db.session.commit()
+            [event] = subscription.get_nowait()
+            assert event_for_user(event, member_id, 'team_member', dept_id)['removed'] is True
+
+            # Rolled back changes are never published
+            Task.query.filter_by(id=task_id).update({Task.status: 'PENDING'})
+            db.session.rollback()
+            assert subscription.empty()
+            get_event_broker().unsubscribe(subscription)
+
+    def test_event_stream(self, client, team_member, task):
+        """Test the SSE endpoint forwards bulk status changes to the assignee."""
+        client.application.config['EVENTS_HEARTBEAT_SECONDS'] = 0.05
+        client.application.config['EVENTS_MAX_STREAM_SECONDS'] = 0.2
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            member = User.query.filter_by(email='member@test.com').first()
+            db.session.add(TaskAssignment(task_id=t.id, user_id=member.id, assigned_by_id=member.id))
+            db.session.commit()
+            task_id = t.id
+        client.post('/auth/login', data={
+            'email': 'member@test.com',
+            'password': 'member123'
+        })
+        response = client.get('/api/tasks/events', buffered=False)
+        assert response.mimetype == 'text/event-stream'
+        client.post('/team-member/tasks/bulk', data={
+            'action': 'status', 'status': 'PENDING', 'task_ids[]': [str(task_id)]
+        })
+        body = b''.join(response.response).decode()
+        assert 'event: tasks' in body
+        assert f'"task_id": {task_id}, "status": "PENDING"' in body
+        assert ': keep-alive' in body
+
+    def test_stream_limit_per_worker(self, client, team_member):
+        """Test streams beyond the per-worker limit get 503 with Retry-After, and closed streams free their slot."""
+        from events import get_event_broker
+        client.application.config.update(EVENTS_MAX_STREAMS_PER_WORKER=1, EVENTS_MAX_STREAM_SECONDS=0.1)
+        client.post('/auth/login', data={
+            'email': 'member@test.com',
+            'password': 'member123'
+        })
+        broker = get_event_broker()
+        held = broker.subscribe(limit=1)
+        response = client.get('/api/tasks/events')
+        assert response.status_code == 503 and response.headers['Retry-After'] == '30'
+        broker.unsubscribe(held)
+
+        response = client.get('/api/tasks/events', buffered=False)
+        assert response.status_code == 200
+        response.close()  # Before the stream was read
+        assert broker.subscribe(limit=1) is not None
+
+    def test_redis_listener_reconnects(self, monkeypatch):
+        """Test the Redis listener resubscribes after the connection drops instead of dying."""
+        import events
+        from events import LocalEventBroker, RedisEventBroker
+
+        class Stop(Exception):
+            pass
+
+        class FakePubSub:
+            def __init__(self, messages):
+                self.messages = messages
+
+            def subscribe(self, channel):
+                pass
+
+            def listen(self):
+                for message in self.messages:
+                    yield message
+                raise ConnectionError('connection lost')
+
+            def close(self):
+                pass
+
+        pubsubs = [FakePubSub([]), FakePubSub([{'data': '[{"task_id": 1}]'}])]
+
+        class FakeRedis:
+            def pubsub(self, ignore_subscribe_messages=False):
+                return pubsubs.pop(0)
+
+        delays = []
+        def sleep(seconds):
+            delays.append(seconds)
+            if not pubsubs:
+                raise Stop()
+        monkeypatch.setattr(events.time, 'sleep', sleep)
+
+        broker = RedisEventBroker.__new__(RedisEventBroker)
+        LocalEventBroker.__init__(broker)
+        broker._redis, broker._channel = FakeRedis(), 'test'
+        subscription = LocalEventBroker.subscribe(broker)  # Without starting a listener thread
+        with pytest.raises(Stop):
+            broker._listen()
+        assert subscription.get_nowait() == [{'task_id': 1}]
+        assert delays == [1, 1]  # Reset after a successful subscribe
@@ -190,3 +190,32 @@ class TestTaskFunctionality:
             assignments = TaskAssignment.query.filter_by(task_id=task.id).all()
             assert len(assignments) == 2
 
+    
+    def test_view_task_conditional_get(self, client, admin_user, task):
+        """Test task detail answers If-None-Match with 304 until the task changes."""
+        client.post('/auth/login', data={
+            'email': 'admin@test.com',
+            'password': 'admin123'
+        })
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            task_id = t.id
+            admin_id = t.created_by_id
+        client.get(f'/tasks/{task_id}')  # Consume the login flash message
+        response = client.get(f'/tasks/{task_id}')
+        etag = response.headers['ETag']
+        assert response.headers['Cache-Control'] == 'private, no-cache'
+        assert 'Last-Modified' in response.headers
+        
+        response = client.get(f'/tasks/{task_id}', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        
+        with client.application.app_context():
+            from extensions import db
+            db.session.add(Subtask(task_id=task_id, subtask_name='New Step', created_by_id=admin_id))
+            db.session.commit()
+        response = client.get(f'/tasks/{task_id}', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert b'New Step' in response.data
+        assert response.headers['ETag'] != etag
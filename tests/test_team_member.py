@@ -124,4 +124,239 @@ class TestTeamMemberFunctionality:
             subtask = Subtask.query.filter_by(subtask_name='Test Subtask').first()
             assert subtask is not None
             assert subtask.task_id == t.id
+            assert (t.subtasks_total, t.subtasks_done) == (1, 0)
+    
+    def test_batch_subtasks_maintain_progress_counts(self, client, team_member, task):
+        """Test the batch subtask endpoint creates and updates in one go and keeps the counters."""
+        with client.application.app_context():
+            from models import User
+            from extensions import db
+            t = Task.query.filter_by(task_name='Test Task').first()
+            member = User.query.filter_by(email='member@test.com').first()
+            db.session.add(TaskAssignment(task_id=t.id, user_id=member.id, assigned_by_id=member.id))
+            db.session.commit()
+            task_id = t.id
+        
+        client.post('/auth/login', data={
+            'email': 'member@test.com',
+            'password': 'member123'
+        })
+        response = client.post(f'/tasks/{task_id}/subtasks/batch', json={
+            'create': [{'subtask_name': f'Step {i}'} for i in range(3)]
+        })
+        data = response.get_json()
+        assert response.status_code == 200
+        assert (data['subtasks_total'], data['subtasks_done']) == (3, 0)
+        
+        first, second, third = data['created']
+        response = client.post(f'/tasks/{task_id}/subtasks/batch', json={
+            'create': [{'subtask_name': 'Step 3'}],
+            'update': [{'id': first, 'status': 'COMPLETED'}, {'id': second, 'status': 'COMPLETED'}]
+        })
+        data = response.get_json()
+        assert (data['updated'], data['subtasks_total'], data['subtasks_done']) == (2, 4, 2)
+        
+        # Invalid batches are rejected without writing anything
+        response = client.post(f'/tasks/{task_id}/subtasks/batch', json={
+            'create': [{'subtask_name': 'Step 4'}],
+            'update': [{'id': third, 'status': 'DONE'}]
+        })
+        assert response.status_code == 400
+        response = client.post(f'/tasks/{task_id}/subtasks/batch', json={'update': [{'id': 99999, 'status': 'COMPLETED'}]})
+        assert response.status_code == 400
+        
+        client.post(f'/tasks/subtasks/{first}/update-status', data={'status': 'PENDING'})
+        with client.application.app_context():
+            t = Task.query.get(task_id)
+            assert (t.subtasks_total, t.subtasks_done) == (4, 1)
+            assert Subtask.query.filter_by(task_id=task_id).count() == 4
+        assert b'1/4 subtasks done' in client.get('/team-member/dashboard').data
+    
+    def test_bulk_status_only_updates_assigned_tasks(self, client, team_member, task):
+        """Test bulk status change ignores tasks not assigned to the member."""
+        with client.application.app_context():
+            from extensions import db
+            from models import Task, User
+            t = Task.query.filter_by(task_name='Test Task').first()
+            member = User.query.filter_by(email='member@test.com').first()
+            other = Task(task_name='Unassigned Task', priority='URGENT', status='ASSIGNED',
+                         department_id=t.department_id, created_by_id=t.created_by_id)
+            db.session.add(other)
+            db.session.add(TaskAssignment(task_id=t.id, user_id=member.id, assigned_by_id=member.id))
+            db.session.commit()
+            task_id = t.id
+            other_id = other.id
+        
+        client.post('/auth/login', data={
+            'email': 'member@test.com',
+            'password': 'member123'
+        })
+        response = client.post('/team-member/tasks/bulk', data={
+            'action': 'status',
+            'status': 'PENDING',
+            'task_ids[]': [str(task_id), str(other_id)]
+        }, follow_redirects=True)
+        assert response.status_code == 200
+        with client.application.app_context():
+            from models import Task
+            assert Task.query.get(task_id).status == 'PENDING'
+            assert Task.query.get(other_id).status == 'ASSIGNED'
 
+    
+    def test_bulk_status_follows_department_completions(self, client, team_member, task):
+        """Test bulk completing a task reverts while another department is still working on it."""
+        with client.application.app_context():
+            from extensions import db
+            from models import Department, User, TaskDepartmentAssignment, DepartmentTaskCompletion
+            t = Task.query.filter_by(task_name='Test Task').first()
+            member = User.query.filter_by(email='member@test.com').first()
+            other = Department(name='Other Department')
+            db.session.add(other)
+            db.session.flush()
+            db.session.add(TaskAssignment(task_id=t.id, user_id=member.id, assigned_by_id=member.id))
+            for dept_id, done in ((t.department_id, True), (other.id, False)):
+                db.session.add(TaskDepartmentAssignment(task_id=t.id, department_id=dept_id, assigned_by_id=t.created_by_id))
+                db.session.add(DepartmentTaskCompletion(task_id=t.id, department_id=dept_id, is_completed=done))
+            db.session.commit()
+            task_id = t.id
+            other_id = other.id
+        
+        client.post('/auth/login', data={
+            'email': 'member@test.com',
+            'password': 'member123'
+        })
+        response = client.post('/team-member/tasks/bulk', data={
+            'action': 'status',
+            'status': 'COMPLETED',
+            'task_ids[]': [str(task_id)]
+        }, follow_redirects=True)
+        assert response.status_code == 200
+        with client.application.app_context():
+            from models import DepartmentTaskCompletion
+            assert Task.query.get(task_id).status == 'ASSIGNED'
+            completion = DepartmentTaskCompletion.query.filter_by(task_id=task_id, department_id=other_id).first()
+            assert not completion.is_completed
+    
+    def test_dashboard_conditional_get_tracks_assignments(self, client, team_member, task):
+        """Test dashboard ETag changes when a task is assigned to the member."""
+        client.post('/auth/login', data={
+            'email': 'member@test.com',
+            'password': 'member123'
+        })
+        client.get('/team-member/dashboard')  # Consume the login flash message
+        etag = client.get('/team-member/dashboard').headers['ETag']
+        response = client.get('/team-member/dashboard', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        
+        with client.application.app_context():
+            from extensions import db
+            from models import User
+            t = Task.query.filter_by(task_name='Test Task').first()
+            member = User.query.filter_by(email='member@test.com').first()
+            db.session.add(TaskAssignment(task_id=t.id, user_id=member.id, assigned_by_id=member.id))
+            db.session.commit()
+        response = client.get('/team-member/dashboard', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert b'Test Task' in response.data
+    
+    def test_stale_status_form_conflicts(self, client, team_member, task):
+        """Test a status change from a page rendered before another change answers 409."""
+        from extensions import db
+        from models import User
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            member = User.query.filter_by(email='member@test.com').first()
+            db.session.add(TaskAssignment(task_id=t.id, user_id=member.id, assigned_by_id=member.id))
+            db.session.commit()
+            task_id, version = t.id, t.version_id
+        client.post('/auth/login', data={'email': 'member@test.com', 'password': 'member123'})
+        assert f'name="version" value="{version}"'.encode() in client.get(f'/tasks/{task_id}').data
+        
+        client.post(f'/team-member/tasks/{task_id}/update-status', data={'status': 'PENDING', 'version': str(version)})
+        response = client.post(f'/team-member/tasks/{task_id}/update-status',
+                               data={'status': 'Review with ADMIN', 'version': str(version)}, follow_redirects=True)
+        assert b'changed by someone else' in response.data
+        with client.application.app_context():
+            assert Task.query.get(task_id).status == 'PENDING'
+    
+    def test_overdue_filter_and_deadline_reminders(self, client, team_member, task, monkeypatch):
+        """Test the overdue dashboard filter and one deadline digest per assignee."""
+        from datetime import datetime, timedelta
+        from extensions import db
+        from models import User
+        import utils
+        digests = []
+        monkeypatch.setattr(utils, 'send_deadline_digest_notification',
+                            lambda user, due_soon, overdue: digests.append(
+                                (user.email, [t.task_name for t in due_soon], [t.task_name for t in overdue])))
+        with client.application.app_context():
+            t = Task.query.filter_by(task_name='Test Task').first()
+            member = User.query.filter_by(email='member@test.com').first()
+            now = datetime.now()
+            t.deadline = now - timedelta(hours=2)
+            soon = Task(task_name='Soon Task', priority='URGENT', status='ASSIGNED', deadline=now + timedelta(hours=3),
+                        department_id=t.department_id, created_by_id=t.created_by_id)
+            done = Task(task_name='Done Task', priority='URGENT', status='COMPLETED', deadline=now - timedelta(hours=1),
+                        department_id=t.department_id, created_by_id=t.created_by_id)
+            db.session.add_all([soon, done])
+            db.session.flush()
+            for task_id in (t.id, soon.id, done.id):
+                db.session.add(TaskAssignment(task_id=task_id, user_id=member.id, assigned_by_id=member.id))
+            db.session.commit()
+        
+        client.post('/auth/login', data={
+            'email': 'member@test.com',
+            'password': 'member123'
+        })
+        response = client.get('/team-member/dashboard?overdue=1')
+        assert b'Test Task' in response.data
+        assert b'Soon Task' not in response.data and b'Done Task' not in response.data
+        
+        from models import TaskChange
+        with client.application.app_context():
+            changes_before = TaskChange.query.count()
+        runner = client.application.test_cli_runner()
+        result = runner.invoke(args=['send-deadline-reminders'])
+        assert '1 task(s) due soon, 1 overdue, 1 user(s) notified' in result.output
+        assert digests == [('member@test.com', ['Soon Task'], ['Test Task'])]
+        # Marking tasks as reminded is not a change sync clients or ETags need to see
+        with client.application.app_context():
+            assert TaskChange.query.count() == changes_before
+        # Each task is announced once per deadline
+        assert '0 task(s) due soon, 0 overdue, 0 user(s) notified' in runner.invoke(args=['send-deadline-reminders']).output
+    
+    def test_create_task_is_idempotent(self, client, team_member, monkeypatch):
+        """Test a repeated create with the same idempotency key adds no rows or notifications."""
+        from datetime import datetime, timedelta
+        from extensions import db
+        from models import IdempotencyKey, Notification
+        client.post('/auth/login', data={'email': 'member@test.com', 'password': 'member123'})
+        assert b'name="idempotency_key"' in client.get('/team-member/tasks/create').data
+        form = {'task_name': 'Once Task', 'priority': 'URGENT', 'idempotency_key': 'form-key-1'}
+        for _ in range(2):
+            assert client.post('/team-member/tasks/create', data=form).status_code == 302
+        client.post('/team-member/tasks/create', data={'task_name': 'Once Task', 'priority': 'URGENT'},
+                    headers={'Idempotency-Key': 'header-key-1'})
+        client.post('/team-member/tasks/create', data={'task_name': 'Once Task', 'priority': 'URGENT'},
+                    headers={'Idempotency-Key': 'header-key-1'})
+        with client.application.app_context():
+            assert Task.query.filter_by(task_name='Once Task').count() == 2
+            assert TaskAssignment.query.count() == 2
+            assert Notification.query.filter_by(notification_type='task_assigned').count() == 2
+        
+        # Two copies racing past the lookup: the second commit hits the unique key and is rolled back
+        monkeypatch.setattr('routes.team_member.find_idempotent_result', lambda key: None)
+        response = client.post('/team-member/tasks/create', data=form, follow_redirects=True)
+        assert b'This task was already created' in response.data
+        monkeypatch.undo()
+        with client.application.app_context():
+            assert Task.query.filter_by(task_name='Once Task').count() == 2
+            
+            # Expired keys no longer replay and are purged by the job
+            IdempotencyKey.query.update({IdempotencyKey.created_at: datetime.utcnow() - timedelta(days=2)})
+            db.session.commit()
+        client.post('/team-member/tasks/create', data=form)
+        with client.application.app_context():
+            assert Task.query.filter_by(task_name='Once Task').count() == 3
+        output = client.application.test_cli_runner().invoke(args=['purge-idempotency-keys']).output
+        assert '1 expired idempotency key(s) deleted' in output
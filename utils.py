@@ -1,5 +1,7 @@
+import hashlib
+from datetime import datetime, timezone
 from functools import wraps
-from flask import abort, current_app
+from flask import abort, current_app, request, session, make_response, flash, jsonify, redirect, url_for
 from flask_login import current_user
 from models import User
 
@@ -39,7 +41,11 @@ def can_access_task(user, task):
         # Check if task belongs to their department
         if user.department_id == task.department_id:
             return True
-        # Check if task is assigned to their department via TaskDepartmentAssignment
+        # Check if task is assigned to their department via TaskDepartmentAssignment,
+        # using the assignments already loaded by load_task_detail when present
+        from sqlalchemy import inspect
+        if 'department_assignments' not in inspect(task).unloaded:
+            return any(a.department_id == user.department_id for a in task.department_assignments)
         from models import TaskDepartmentAssignment
         dept_assignment = TaskDepartmentAssignment.query.filter_by(
             task_id=task.id,
@@ -51,6 +57,299 @@ def can_access_task(user, task):
         return any(assignment.user_id == user.id for assignment in task.assignments)
     return False
 
+def load_task_detail(task_id):
+    """Load a task with everything the task detail page renders in a fixed number of queries
+    (the task and its department, then one query per collection), or None if it does not exist"""
+    from sqlalchemy.orm import joinedload, selectinload
+    from models import Task, TaskAssignment, Subtask, TaskDepartmentAssignment, TaskApprovalRequest
+    return Task.query.options(
+        joinedload(Task.department),
+        selectinload(Task.assignments).joinedload(TaskAssignment.user),
+        selectinload(Task.subtasks).joinedload(Subtask.creator),
+        selectinload(Task.department_assignments).joinedload(TaskDepartmentAssignment.department),
+        selectinload(Task.department_completions),
+        selectinload(Task.approval_requests).options(
+            joinedload(TaskApprovalRequest.requested_by).joinedload(User.department),
+            joinedload(TaskApprovalRequest.approved_by),
+            joinedload(TaskApprovalRequest.new_dept_head),
+        ),
+    ).filter(Task.id == task_id).first()
+
+def accessible_tasks_clause(user):
+    """SQL filter matching the tasks a user can access (set-based counterpart of can_access_task).
+    Returns None for admins, who can access every task."""
+    from sqlalchemy import or_, select, false
+    from models import Task, TaskAssignment, TaskDepartmentAssignment
+    if user.role == 'admin':
+        return None
+    elif user.role == 'department_head':
+        if not user.department_id:
+            return false()
+        return or_(
+            Task.department_id == user.department_id,
+            Task.id.in_(
+                select(TaskDepartmentAssignment.task_id).where(
+                    TaskDepartmentAssignment.department_id == user.department_id
+                )
+            )
+        )
+    elif user.role == 'team_member':
+        return Task.id.in_(
+            select(TaskAssignment.task_id).where(TaskAssignment.user_id == user.id)
+        )
+    return false()
+
+def overdue_tasks_clause(now=None):
+    """SQL filter for open tasks past their deadline (a range on the (deadline, status) index).
+    Deadlines are entered as local times, so they are compared with local now."""
+    from sqlalchemy import and_
+    from models import Task
+    return and_(Task.deadline < (now or datetime.now()), Task.status != 'COMPLETED')
+
+def filter_accessible_task_ids(user, task_ids):
+    """Return the subset of task_ids the user can access, authorized with a single query"""
+    from models import Task
+    task_ids = set(task_ids)
+    if not task_ids:
+        return set()
+    query = Task.query.with_entities(Task.id).filter(Task.id.in_(task_ids))
+    clause = accessible_tasks_clause(user)
+    if clause is not None:
+        query = query.filter(clause)
+    return {row.id for row in query.all()}
+
+def parse_id_list(values):
+    """Convert a list of form values (e.g. request.form.getlist('task_ids[]')) to a set of ints"""
+    return {int(value) for value in values if value and str(value).isdigit()}
+
+def task_scope_version(user, task_id=None):
+    """Cheap version token for the task data a page shows to user (one task, or the user's whole scope).
+    Built from TaskChange watermarks (indexed on task_id, id) and the visible task count.
+    Returns (etag, last_modified), or None when the task does not exist or is not accessible."""
+    from sqlalchemy import func, select
+    from models import db, Task, TaskChange
+    
+    def watermark(*criteria):
+        return db.session.query(func.max(TaskChange.id), func.max(TaskChange.changed_at)).filter(*criteria).one()
+    
+    clause = accessible_tasks_clause(user)
+    if task_id is not None:
+        if not filter_accessible_task_ids(user, [task_id]):
+            return None
+        marks = [watermark(TaskChange.task_id == task_id), watermark(TaskChange.task_id.is_(None))]
+        count = 1
+    elif clause is None:
+        # Admins see everything, so the global watermark covers it (deletes log tombstones)
+        marks = [watermark()]
+        count = 0
+    else:
+        # Tombstones of tasks that left the scope are not matched, the count catches those
+        marks = [watermark(TaskChange.task_id.in_(select(Task.id).where(clause))),
+                 watermark(TaskChange.task_id.is_(None))]
+        count = Task.query.filter(clause).count()
+    
+    # Pages turn overdue as deadlines pass without any change being logged
+    passed = Task.query.with_entities(func.max(Task.deadline)).filter(Task.deadline < datetime.now())
+    if task_id is not None:
+        passed = passed.filter(Task.id == task_id)
+    elif clause is not None:
+        passed = passed.filter(clause)
+    last_deadline = passed.scalar()
+    
+    change_ids = [change_id or 0 for change_id, _ in marks]
+    timestamps = [changed_at for _, changed_at in marks if changed_at]
+    raw = f'{user.id}:{user.role}:{user.department_id}:{task_id}:{change_ids}:{count}:{last_deadline}'
+    return hashlib.sha1(raw.encode()).hexdigest(), max(timestamps) if timestamps else None
+
+def conditional_view(f):
+    """Decorator answering If-None-Match with 304 Not Modified before the view queries or renders.
+    Place it after login/role checks. Views with a task_id argument are versioned per task."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Pending flash messages must be rendered, so those responses are never cached
+        if request.method != 'GET' or session.get('_flashes'):
+            return f(*args, **kwargs)
+        version = task_scope_version(current_user, kwargs.get('task_id'))
+        if version is None:
+            return f(*args, **kwargs)
+        etag, last_modified = version
+        
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return decorated_function
+
+def wants_json():
+    """True for API clients (JSON body or Accept: application/json), False for browser forms"""
+    return request.is_json or request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+CONFLICT_MESSAGE = 'This task was changed by someone else in the meantime. Please review it and try again.'
+
+def conflict_response(task_id=None, message=CONFLICT_MESSAGE):
+    """409 for API clients; browsers are sent back to the task with a warning so they can retry on fresh data"""
+    if wants_json():
+        return jsonify({'success': False, 'conflict': True, 'message': message}), 409
+    flash(message, 'warning')
+    if task_id is not None:
+        return redirect(url_for('tasks.view_task', task_id=task_id))
+    return redirect(request.referrer or url_for('index'))
+
+def insert_ignore(model, rows):
+    """Insert rows in one statement, skipping rows that hit a unique constraint (an atomic
+    "create if missing" that cannot fail when a concurrent request inserts the same row).
+    SQLite and MySQL use their native upsert syntax; other databases insert row by row in savepoints."""
+    from models import db
+    if not rows:
+        return
+    table = model.__table__
+    dialect = db.session.get_bind(mapper=model.__mapper__).dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        statement = insert(table).on_conflict_do_nothing()
+    elif dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table).on_duplicate_key_update(id=table.c.id)
+    else:
+        from sqlalchemy.exc import IntegrityError
+        for row in rows:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(table.insert(), row)
+            except IntegrityError:
+                pass
+        return
+    db.session.execute(statement, rows)
+
+PENDING_APPROVALS_COUNTER = 'pending_approvals'
+
+def get_pending_approvals_count():
+    """Pending approval requests for the nav badge: a primary key lookup instead of a count().
+    Until `flask upgrade-db` has created the counter the live count is returned; page views never write it."""
+    from models import db, Counter, TaskApprovalRequest
+    counter = db.session.get(Counter, PENDING_APPROVALS_COUNTER)
+    if counter is None:
+        return TaskApprovalRequest.query.filter_by(status='PENDING').count()
+    return max(counter.value, 0)
+
+def adjust_pending_approvals_count(delta):
+    """Atomically add delta to the pending approvals counter; call in the transaction that
+    creates (+1) or resolves (-n) approval requests. Without a counter row (before `flask upgrade-db`)
+    nothing is stored and readers count the table."""
+    from models import Counter
+    if not delta:
+        return
+    Counter.query.filter_by(name=PENDING_APPROVALS_COUNTER).update(
+        {Counter.value: Counter.value + delta}, synchronize_session=False
+    )
+
+def recount_pending_approvals():
+    """Create or reset the pending approvals counter from the table (flask upgrade-db)"""
+    from models import db, Counter, TaskApprovalRequest
+    db.session.flush()
+    value = TaskApprovalRequest.query.filter_by(status='PENDING').count()
+    counter = db.session.get(Counter, PENDING_APPROVALS_COUNTER)
+    if counter is None:
+        db.session.add(Counter(name=PENDING_APPROVALS_COUNTER, value=value))
+    else:
+        counter.value = value
+    return value
+
+def update_task_completion_statuses(task_ids):
+    """Batch version of _update_task_completion_status.
+    Recomputes the overall status once per task using two reads and at most two UPDATEs.
+    Returns the (task_id, department_id, old, new) transitions it made."""
+    from models import db, Task, TaskDepartmentAssignment, DepartmentTaskCompletion
+    task_ids = set(task_ids)
+    if not task_ids:
+        return []
+    
+    dept_assignments = db.session.query(
+        TaskDepartmentAssignment.task_id, TaskDepartmentAssignment.department_id
+    ).filter(TaskDepartmentAssignment.task_id.in_(task_ids)).all()
+    completed = set(db.session.query(
+        DepartmentTaskCompletion.task_id, DepartmentTaskCompletion.department_id
+    ).filter(
+        DepartmentTaskCompletion.task_id.in_(task_ids),
+        DepartmentTaskCompletion.is_completed == True
+    ).all())
+    
+    # Tasks without department assignments keep their current status
+    all_completed = {}
+    for task_id, department_id in dept_assignments:
+        done = (task_id, department_id) in completed
+        all_completed[task_id] = all_completed.get(task_id, True) and done
+    
+    completed_ids = [task_id for task_id, done in all_completed.items() if done]
+    incomplete_ids = [task_id for task_id, done in all_completed.items() if not done]
+    
+    from task_status import set_task_statuses
+    transitions = set_task_statuses(completed_ids, 'COMPLETED')
+    # If a task was marked complete but not all departments are done, revert to ASSIGNED
+    transitions += set_task_statuses(incomplete_ids, 'ASSIGNED', Task.status == 'COMPLETED')
+    return transitions
+
+SUBTASK_STATUSES = ('PENDING', 'COMPLETED')
+
+def refresh_subtask_counts(task_ids=None):
+    """Recount subtasks_total/subtasks_done in one UPDATE for the given tasks (all tasks if None).
+    Call in the transaction that adds or changes subtasks; only tasks whose counts changed are written."""
+    from sqlalchemy import func, or_, select
+    from models import Task, Subtask
+    total = select(func.count(Subtask.id)).where(Subtask.task_id == Task.id).scalar_subquery()
+    done = select(func.count(Subtask.id)).where(
+        Subtask.task_id == Task.id, Subtask.status == 'COMPLETED'
+    ).scalar_subquery()
+    query = Task.query.filter(or_(Task.subtasks_total != total, Task.subtasks_done != done))
+    if task_ids is not None:
+        task_ids = set(task_ids)
+        if not task_ids:
+            return 0
+        query = query.filter(Task.id.in_(task_ids))
+    # Bulk UPDATEs bypass version_id_col, so the version is bumped here: a writer holding the
+    # task from before the subtask change must not overwrite the new counts
+    return query.update({Task.subtasks_total: total, Task.subtasks_done: done, Task.version_id: Task.version_id + 1},
+                        synchronize_session='fetch')
+
+def empty_workload():
+    """Workload entry for a user without open tasks"""
+    from models import TASK_PRIORITIES
+    return {'open': 0, 'overdue': 0, 'by_priority': {p: 0 for p in TASK_PRIORITIES}}
+
+def user_workloads(user_ids=None, department_id=None, now=None):
+    """Open (not COMPLETED) assigned tasks per user by priority, with overdue counts, from one
+    GROUP BY over TaskAssignment joined to Task. Narrow by user_ids or the users of department_id.
+    Returns {user_id: {'open': n, 'overdue': n, 'by_priority': {priority: n}}}; users without open tasks are absent."""
+    from sqlalchemy import case, distinct, func
+    from models import db, Task, TaskAssignment
+    query = db.session.query(
+        TaskAssignment.user_id,
+        Task.priority,
+        func.count(distinct(Task.id)),
+        func.count(distinct(case((overdue_tasks_clause(now), Task.id)))),
+    ).join(Task, Task.id == TaskAssignment.task_id).filter(Task.status != 'COMPLETED')
+    if user_ids is not None:
+        user_ids = set(user_ids)
+        if not user_ids:
+            return {}
+        query = query.filter(TaskAssignment.user_id.in_(user_ids))
+    if department_id is not None:
+        query = query.join(User, User.id == TaskAssignment.user_id).filter(User.department_id == department_id)
+    workloads = {}
+    for user_id, priority, open_count, overdue_count in query.group_by(TaskAssignment.user_id, Task.priority):
+        workload = workloads.setdefault(user_id, empty_workload())
+        workload['open'] += open_count
+        workload['overdue'] += overdue_count
+        workload['by_priority'][priority] = workload['by_priority'].get(priority, 0) + open_count
+    return workloads
+
 def send_task_assignment_notification(user, task, assigned_by):
     """Send FCM notification when a task is assigned to a user (sends to all user devices)"""
     try:
@@ -88,12 +387,18 @@ def send_task_assignment_notification(user, task, assigned_by):
         if task.priority == 'URGENT':
             body = f"🔴 URGENT: {task.task_name}"
         
-        data = {
-            'type': 'task_assigned',
-            'task_id': str(task.id),
-            'task_name': task.task_name,
-            'priority': task.priority,
-        }
+        # The app reads the details from the inbox; older pushes without an inbox row carry them inline
+        from inbox import assignment_notification_ids
+        notification_ids = assignment_notification_ids(user.id, [task.id])
+        if notification_ids:
+            data = {'type': 'task_assigned', 'notification_id': str(notification_ids[0])}
+        else:
+            data = {
+                'type': 'task_assigned',
+                'task_id': str(task.id),
+                'task_name': task.task_name,
+                'priority': task.priority,
+            }
         
         # Send to all user devices
         # result = send_notification_to_multiple(fcm_tokens, title, body, data)
@@ -112,3 +417,123 @@ def send_task_assignment_notification(user, task, assigned_by):
             current_app.logger.error(f"FCM Task Assignment Notification - EXCEPTION - User: {user.email if user else 'Unknown'} (ID: {user.id if user else 'N/A'}), Task: '{task.task_name if task else 'Unknown'}' (ID: {task.id if task else 'N/A'}), Error: {str(e)}")
         return False
 
+
+def send_task_assignments_notification(user, tasks, assigned_by):
+    """Send one FCM notification for several tasks assigned to a user at once (e.g. batch approvals)"""
+    if len(tasks) == 1:
+        return send_task_assignment_notification(user, tasks[0], assigned_by)
+    try:
+        from fcm_service import send_notification
+        
+        if not user.fcm_devices:
+            from flask import current_app
+            if current_app:
+                current_app.logger.info(f"FCM Task Assignment Digest - NO FCM TOKEN - User: {user.email} (ID: {user.id}), Tasks: {len(tasks)}, User has no registered FCM devices")
+            return False
+        
+        title = f"{len(tasks)} New Tasks Assigned"
+        names = ', '.join(task.task_name for task in tasks[:3])
+        body = f"{names} and {len(tasks) - 3} more" if len(tasks) > 3 else names
+        if any(task.priority == 'URGENT' for task in tasks):
+            body = f"🔴 URGENT: {body}"
+        
+        from inbox import assignment_notification_ids
+        notification_ids = assignment_notification_ids(user.id, [task.id for task in tasks])
+        if notification_ids:
+            data = {'type': 'tasks_assigned', 'notification_ids': ','.join(str(i) for i in sorted(notification_ids))}
+        else:
+            data = {
+                'type': 'tasks_assigned',
+                'task_ids': ','.join(str(task.id) for task in tasks),
+            }
+        
+        result = send_notification(user.fcm_devices[0].fcm_token, title, body, data)
+        from flask import current_app
+        if current_app:
+            status = "SUCCESS" if result else "FAILED"
+            current_app.logger.info(f"FCM Task Assignment Digest - {status} - User: {user.email} (ID: {user.id}), Task IDs: {[task.id for task in tasks]}, Assigned by: {assigned_by.email}")
+        return result
+    except Exception as e:
+        from flask import current_app
+        if current_app:
+            current_app.logger.error(f"FCM Task Assignment Digest - EXCEPTION - User: {user.email if user else 'Unknown'} (ID: {user.id if user else 'N/A'}), Tasks: {len(tasks)}, Error: {str(e)}")
+        return False
+
+def send_stale_approvals_notification(admins, escalated, expired):
+    """Store an inbox notification for every admin about escalated/expired approval requests and
+    push it to their devices (one multicast per admin, carrying the notification id)"""
+    try:
+        from fcm_service import send_notification_to_multiple
+        from flask import current_app
+        from inbox import create_notification
+        from models import db
+        
+        title = "Approval Requests Need Attention"
+        parts = []
+        if escalated:
+            parts.append(f"{escalated} waiting too long")
+        if expired:
+            parts.append(f"{expired} expired")
+        body = ', '.join(parts)
+        details = {'escalated': escalated, 'expired': expired}
+        notifications = [(admin, create_notification(admin.id, 'approvals_digest', title, body, details)) for admin in admins]
+        db.session.commit()
+        
+        sent = failed = 0
+        for admin, notification in notifications:
+            tokens = [device.fcm_token for device in admin.fcm_devices if device.fcm_token]
+            if not tokens:
+                continue
+            result = send_notification_to_multiple(tokens, title, body, {'type': 'approvals_digest', 'notification_id': str(notification.id)})
+            sent += result['success']
+            failed += result['failure']
+        if current_app:
+            current_app.logger.info(f"FCM Stale Approvals Digest - Sent: {sent}, Failed: {failed}, Admins: {len(admins)}, Escalated: {escalated}, Expired: {expired}")
+        return sent > 0
+    except Exception as e:
+        from flask import current_app
+        if current_app:
+            current_app.logger.error(f"FCM Stale Approvals Digest - EXCEPTION - Escalated: {escalated}, Expired: {expired}, Error: {str(e)}")
+        return False
+
+def send_deadline_digest_notification(user, due_soon, overdue):
+    """Store an inbox notification about tasks due soon and overdue tasks and push it to all of
+    the user's devices in one multicast"""
+    try:
+        from fcm_service import send_notification_to_multiple
+        from flask import current_app
+        from inbox import create_notification
+        from models import db
+        
+        tasks = list(overdue) + list(due_soon)
+        if overdue:
+            title = f"{len(overdue)} Task(s) Overdue" + (f", {len(due_soon)} Due Soon" if due_soon else "")
+        else:
+            title = f"{len(due_soon)} Task(s) Due Soon"
+        names = ', '.join(task.task_name for task in tasks[:3])
+        body = f"{names} and {len(tasks) - 3} more" if len(tasks) > 3 else names
+        if any(task.priority == 'URGENT' for task in tasks):
+            body = f"🔴 URGENT: {body}"
+        
+        notification = create_notification(user.id, 'task_deadlines', title, body, {
+            'overdue_task_ids': [task.id for task in overdue],
+            'due_soon_task_ids': [task.id for task in due_soon],
+        })
+        db.session.commit()
+        
+        tokens = [device.fcm_token for device in user.fcm_devices if device.fcm_token]
+        if not tokens:
+            if current_app:
+                current_app.logger.info(f"FCM Deadline Digest - NO FCM TOKEN - User: {user.email} (ID: {user.id}), Due soon: {len(due_soon)}, Overdue: {len(overdue)}")
+            return False
+        
+        data = {'type': 'task_deadlines', 'notification_id': str(notification.id)}
+        result = send_notification_to_multiple(tokens, title, body, data)
+        if current_app:
+            current_app.logger.info(f"FCM Deadline Digest - Sent: {result['success']}, Failed: {result['failure']} - User: {user.email} (ID: {user.id}), Overdue: {[task.id for task in overdue]}, Due soon: {[task.id for task in due_soon]}")
+        return result['success'] > 0
+    except Exception as e:
+        from flask import current_app
+        if current_app:
+            current_app.logger.error(f"FCM Deadline Digest - EXCEPTION - User: {user.email if user else 'Unknown'} (ID: {user.id if user else 'N/A'}), Error: {str(e)}")
+        return False